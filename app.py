@@ -7,7 +7,7 @@ import shutil
 import base64
 import google.generativeai as genai
 import subprocess
-from flask import Flask, request, render_template, jsonify, send_from_directory
+from flask import Flask, Request, request, render_template, jsonify, send_from_directory, Response, stream_with_context
 from werkzeug.utils import secure_filename
 import logging
 from pytube import YouTube
@@ -20,9 +20,37 @@ from urllib.parse import urlparse
 import time
 import json
 import imagehash
+import hashlib
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError, as_completed
 from azure_video_indexer import AzureVideoIndexer
+from job_queue import JobQueue, DEFAULT_JOB_WORKERS
+from result_cache import ResultCache, DEFAULT_CACHE_MAX_BYTES, copy_stream_with_hash, hash_file
+from gemini_client import (
+    GeminiClient, DEFAULT_GEMINI_MODEL, DEFAULT_SAFETY_SETTINGS, DEFAULT_REQUEST_TIMEOUT, DEFAULT_MAX_RETRIES, DEFAULT_MAX_CONCURRENCY,
+    generation_config as gemini_generation_config
+)
+from rate_limiter import TokenBucketRateLimiter, RateLimitExceeded, PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_BULK
+from image_payload import ImagePayloadCache, DEFAULT_IMAGE_MAX_EDGE, DEFAULT_IMAGE_QUALITY
+from response_cache import ResponseCache, DEFAULT_RESPONSE_CACHE_TTL, DEFAULT_RESPONSE_CACHE_MAX_BYTES
+from zip_stream import stream_zip
+from audio_chunks import split_audio_on_silence
+from upload_ingest import IngestFile, UploadRejected
+from download_cache import DownloadCache, DEFAULT_DOWNLOAD_CACHE_MAX_BYTES
+from keyframe_store import KeyframeStore, DEFAULT_MAX_SESSIONS
+from hash_matching import HASH_BITS, pack_hashes, find_similar_pairs
+from whisper_registry import (
+    WhisperModelRegistry, WHISPER_MODEL_NAMES, DEFAULT_WHISPER_MODEL, DEFAULT_MAX_WHISPER_MODELS
+)
+from frame_engine import (
+    SAMPLING_MODES, FRAME_DECODERS, DETECTOR_CLASSES, DEFAULT_ANALYSIS_WIDTH, open_frame_source, KeyframeWriter,
+    FrameDifferenceDetector, SceneDetector, TransitionAwareDetector,
+    run_keyframe_detectors, run_keyframe_detectors_parallel, build_result,
+    SignalIndex, replay_signal_index, IMAGE_HASH_NAMES, DEFAULT_OUTPUT_FORMAT, DEFAULT_OUTPUT_QUALITY,
+    supported_output_formats, output_profile, thumbnail_path
+)
 from flask_cors import CORS
-import collections
 import openai
 
 
@@ -37,38 +65,69 @@ KEYFRAMES_FOLDER = os.path.join('static', 'uploads', 'keyframes')
 GENERATED_IMAGES_FOLDER = os.path.join('static', 'uploads', 'generated')
 AUDIO_FOLDER = os.path.join('static', 'uploads', 'audio')
 TRANSCRIPTS_FOLDER = os.path.join('static', 'uploads', 'transcripts')
+CACHE_FOLDER = os.path.join('static', 'uploads', 'cache')  # Manifest kết quả trích xuất theo nội dung video
+SIGNALS_FOLDER = os.path.join('static', 'uploads', 'signals')  # Chỉ số từng khung hình để chọn lại keyframes
+SESSIONS_FOLDER = os.path.join('static', 'uploads', 'sessions')  # Manifest keyframes của từng phiên
+PROMPT_CACHE_FOLDER = os.path.join(CACHE_FOLDER, 'prompts')  # Prompt do Gemini tạo cho từng ảnh
+DOWNLOADS_FOLDER = os.path.join('static', 'uploads', 'downloads')  # Video tải từ URL, theo ID video
 ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv', 'webm'}
 API_KEY_FILE = 'api_key.txt'  # File chứa API key
 
+# Phiên âm dự phòng với SpeechRecognition: số yêu cầu nhận dạng đồng thời (độ dài đoạn: xem audio_chunks)
+SPEECH_RECOGNITION_WORKERS = 4
+
+# Tạo prompt hàng loạt (/generate-gemini-prompts): số luồng gọi đồng thời, số khung hình tối đa mỗi request
+# và thời gian mỗi khung hình được chờ lượt gọi API
+PROMPT_BATCH_WORKERS = 8
+PROMPT_BATCH_MAX_FRAMES = 200
+PROMPT_BATCH_RATE_WAIT = 600
+
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # Giới hạn 500MB
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_UPLOAD_BYTES', 500 * 1024 * 1024))  # Mặc định giới hạn 500MB
 
-# Rate limiting cho Gemini API
-GEMINI_API_CALLS = {}  # {timestamp: count}
+# Giới hạn video upload, kiểm tra ngay khi đọc được metadata (0 = không giới hạn)
+MAX_VIDEO_DURATION = float(os.getenv('MAX_VIDEO_DURATION', 0))  # Thời lượng tối đa (giây)
+MAX_VIDEO_EDGE = int(os.getenv('MAX_VIDEO_EDGE', 0))  # Cạnh dài nhất tối đa của khung hình (pixel)
+
+# Rate limiting cho Gemini API: token bucket dùng chung giữa các worker qua file SQLite
 GEMINI_RATE_LIMIT = 10  # Số lượng cuộc gọi tối đa trong 1 phút
 GEMINI_RATE_WINDOW = 60  # Thời gian cửa sổ tính giới hạn (giây)
-# Biến toàn cục để lưu trữ dữ liệu keyframes
-keyframesData = []
+GEMINI_RATE_MAX_WAIT = float(os.getenv('GEMINI_RATE_MAX_WAIT', 30))  # Thời gian chờ lượt tối đa trước khi trả 429
+GEMINI_RATE_LIMIT_DB = os.getenv('GEMINI_RATE_LIMIT_DB', os.path.join(tempfile.gettempdir(), 'gemini_rate_limit.db'))
+# Keyframes của từng phiên: manifest trong SESSIONS_FOLDER, giữ tối đa KEYFRAME_SESSIONS phiên trong bộ nhớ
+keyframe_store = KeyframeStore(max_sessions=int(os.getenv('KEYFRAME_SESSIONS', DEFAULT_MAX_SESSIONS)),
+                               manifest_folder=SESSIONS_FOLDER)
 
-def check_rate_limit():
-    """Kiểm tra nếu đã vượt quá giới hạn tốc độ cho Gemini API"""
-    current_time = time.time()
-    
-    # Xóa các timestamp cũ
-    for timestamp in list(GEMINI_API_CALLS.keys()):
-        if current_time - timestamp > GEMINI_RATE_WINDOW:
-            del GEMINI_API_CALLS[timestamp]
-    
-    # Tính tổng số cuộc gọi trong cửa sổ hiện tại
-    total_calls = sum(GEMINI_API_CALLS.values())
-    
-    # Kiểm tra nếu đã vượt quá giới hạn
-    if total_calls >= GEMINI_RATE_LIMIT:
-        return False
-    
-    # Thêm cuộc gọi mới
-    GEMINI_API_CALLS[current_time] = GEMINI_API_CALLS.get(current_time, 0) + 1
-    return True
+# Hàng đợi job xử lý video chạy nền (số luồng cấu hình qua biến môi trường JOB_WORKERS),
+# trạng thái job lưu trong SQLite để worker nào cũng trả lời được /jobs/<job_id>
+JOB_DB = os.getenv('JOB_DB', os.path.join(tempfile.gettempdir(), 'video_jobs.db'))
+job_queue = JobQueue(max_workers=int(os.getenv('JOB_WORKERS', DEFAULT_JOB_WORKERS)), db_path=JOB_DB)
+
+# Tải video từ URL song song với việc trích xuất từ luồng media (stream_download=true), mỗi job một luồng tải
+url_download_pool = ThreadPoolExecutor(max_workers=int(os.getenv('JOB_WORKERS', DEFAULT_JOB_WORKERS)),
+                                       thread_name_prefix='url-download')
+
+# Định dạng yt-dlp: ưu tiên một file MP4 có cả hình và tiếng
+YTDLP_FORMAT = 'best[ext=mp4]/best'
+
+# Video tải từ URL, dùng lại theo ID video, giới hạn dung lượng qua DOWNLOAD_CACHE_MAX_BYTES
+download_cache = DownloadCache(DOWNLOADS_FOLDER,
+                               max_bytes=int(os.getenv('DOWNLOAD_CACHE_MAX_BYTES', DEFAULT_DOWNLOAD_CACHE_MAX_BYTES)))
+
+# Model Whisper dùng chung cho mọi job phiên âm (tải một lần, giữ tối đa WHISPER_MAX_MODELS model)
+whisper_models = WhisperModelRegistry(max_models=int(os.getenv('WHISPER_MAX_MODELS', DEFAULT_MAX_WHISPER_MODELS)))
+
+# Giới hạn tốc độ gọi Gemini API dùng chung cho mọi worker
+gemini_rate_limiter = TokenBucketRateLimiter(GEMINI_RATE_LIMIT_DB, GEMINI_RATE_LIMIT, GEMINI_RATE_WINDOW, name='gemini')
+
+def check_rate_limit(priority=PRIORITY_NORMAL, timeout=GEMINI_RATE_MAX_WAIT, cancel=None):
+    """
+    Lấy một lượt gọi Gemini API, xếp hàng chờ tối đa timeout giây nếu đã hết lượt
+
+    Request có priority nhỏ hơn được phục vụ trước. Trả về False nếu vẫn vượt giới hạn khi hết hạn chờ
+    hoặc cancel (threading.Event, tùy chọn) được đặt trong lúc chờ.
+    """
+    return gemini_rate_limiter.acquire(priority, timeout, cancel)
 
 # Đọc API key từ file
 def get_api_key():
@@ -92,12 +151,45 @@ def get_leonardo_api_key():
 GEMINI_API_KEY = get_api_key()
 genai.configure(api_key=GEMINI_API_KEY)
 
+# Lớp gọi Gemini dùng chung: model được tạo một lần, timeout/thử lại/số lời gọi đồng thời cấu hình qua biến môi trường
+gemini_client = GeminiClient(timeout=float(os.getenv('GEMINI_TIMEOUT', DEFAULT_REQUEST_TIMEOUT)),
+                             max_retries=int(os.getenv('GEMINI_MAX_RETRIES', DEFAULT_MAX_RETRIES)),
+                             max_concurrency=int(os.getenv('GEMINI_MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY)))
+
+# Ảnh gửi lên Gemini được thu nhỏ (cạnh dài nhất GEMINI_IMAGE_MAX_EDGE) và nén lại (GEMINI_IMAGE_QUALITY)
+gemini_images = ImagePayloadCache(max_edge=int(os.getenv('GEMINI_IMAGE_MAX_EDGE', DEFAULT_IMAGE_MAX_EDGE)),
+                                  quality=int(os.getenv('GEMINI_IMAGE_QUALITY', DEFAULT_IMAGE_QUALITY)))
+
+# Cache prompt do Gemini tạo theo nội dung ảnh (thời hạn PROMPT_CACHE_TTL giây, tối đa PROMPT_CACHE_MAX_BYTES)
+prompt_cache = ResponseCache(PROMPT_CACHE_FOLDER,
+                             ttl=int(os.getenv('PROMPT_CACHE_TTL', DEFAULT_RESPONSE_CACHE_TTL)),
+                             max_bytes=int(os.getenv('PROMPT_CACHE_MAX_BYTES', DEFAULT_RESPONSE_CACHE_MAX_BYTES)))
+
 # Tạo thư mục nếu chưa tồn tại
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(KEYFRAMES_FOLDER, exist_ok=True)
 os.makedirs(GENERATED_IMAGES_FOLDER, exist_ok=True)
 os.makedirs(AUDIO_FOLDER, exist_ok=True)
 os.makedirs(TRANSCRIPTS_FOLDER, exist_ok=True)
+os.makedirs(SIGNALS_FOLDER, exist_ok=True)
+
+# Cache kết quả trích xuất, giới hạn dung lượng thư mục keyframes qua KEYFRAMES_CACHE_MAX_BYTES
+result_cache = ResultCache(CACHE_FOLDER, KEYFRAMES_FOLDER,
+                           max_bytes=int(os.getenv('KEYFRAMES_CACHE_MAX_BYTES', DEFAULT_CACHE_MAX_BYTES)),
+                           companion_folders=[SIGNALS_FOLDER, SESSIONS_FOLDER])
+
+def get_keyframe_phash(path, frame=None):
+    """
+    pHash của một keyframe (đường dẫn tương đối trong static/)
+
+    Dùng hash đã tính lúc trích xuất trong metadata frame; phiên cũ chưa có hash thì đọc ảnh từ đĩa.
+    """
+    full_path = os.path.join('static', path)
+    if frame and frame.get('phash'):
+        if not os.path.exists(full_path):
+            raise FileNotFoundError(f"Không tìm thấy ảnh: {full_path}")
+        return frame['phash']
+    return imagehash.phash(Image.open(full_path))
 
 # Phương pháp dự phòng sử dụng perceptual hashing
 def detect_duplicate_images_fallback(image_paths, threshold=0.85):
@@ -114,18 +206,13 @@ def detect_duplicate_images_fallback(image_paths, threshold=0.85):
         image_hashes = []
         for path in image_paths:
             try:
-                full_path = os.path.join('static', path)
-                img = Image.open(full_path)
-                # Sử dụng perceptual hash
-                p_hash = imagehash.phash(img)
+                # Khung hình của phiên chứa ảnh (tra theo đường dẫn)
+                frame = keyframe_store.find_by_path(path)
+                # Sử dụng perceptual hash (đã lưu lúc trích xuất nếu có)
+                p_hash = get_keyframe_phash(path, frame)
                 
                 # Lấy ID của khung hình nếu có
-                frame_id = None
-                for frame in keyframesData:
-                    if frame.get('path') == path and 'id' in frame:
-                        frame_id = frame['id']
-                        break
-                
+                frame_id = frame.get('id') if frame else None
                 if not frame_id:
                     frame_id = str(uuid.uuid4())[:8]
                 
@@ -145,26 +232,23 @@ def detect_duplicate_images_fallback(image_paths, threshold=0.85):
         # Chuyển đổi ngưỡng tương đồng (0.5-1.0) thành ngưỡng hash (12-0)
         hash_threshold = int(12 * (1 - threshold))
         
-        for i in range(len(image_hashes)):
-            for j in range(i+1, len(image_hashes)):
-                # Tính khoảng cách giữa các hash
-                hash_dist = image_hashes[i]['hash'] - image_hashes[j]['hash']
-                
-                if hash_dist <= hash_threshold:
-                    # Chuyển đổi khoảng cách hash thành độ tương đồng (0-1)
-                    similarity = 1 - (hash_dist / 64)
-                    
-                    # Chỉ thêm vào danh sách nếu vượt ngưỡng
-                    if similarity >= threshold:
-                        duplicates.append({
-                            'path': image_hashes[j]['path'],
-                            'duplicate_of': image_hashes[i]['path'],
-                            'similarity': similarity,
-                            'id': image_hashes[j]['id']
-                        })
+        # So sánh mọi cặp hash một lượt bằng XOR + đếm bit trên mảng uint64
+        packed_hashes = pack_hashes(item['hash'] for item in image_hashes)
+        for i, j, hash_dist in zip(*find_similar_pairs(packed_hashes, hash_threshold)):
+            # Chuyển đổi khoảng cách hash thành độ tương đồng (0-1)
+            similarity = 1 - (int(hash_dist) / 64)
+            
+            # Chỉ thêm vào danh sách nếu vượt ngưỡng
+            if similarity >= threshold:
+                duplicates.append({
+                    'path': image_hashes[j]['path'],
+                    'duplicate_of': image_hashes[i]['path'],
+                    'similarity': similarity,
+                    'id': image_hashes[j]['id']
+                })
         
         # Tạo danh sách ảnh độc nhất (không trùng lặp)
-        duplicate_paths = [d['path'] for d in duplicates]
+        duplicate_paths = {d['path'] for d in duplicates}
         unique_images = [path for path in image_paths if path not in duplicate_paths]
         
         return {
@@ -184,24 +268,15 @@ def detect_duplicate_images_with_gemini(image_paths, session_id, threshold=0.85)
     if not image_paths or len(image_paths) < 2:
         return {'unique_images': image_paths, 'duplicate_images': []}
     
-    # Kiểm tra rate limit
-    if not check_rate_limit():
+    # Kiểm tra rate limit (không chờ lượt vì đã có phương pháp dự phòng)
+    if not check_rate_limit(PRIORITY_BULK, timeout=0):
         logging.warning("Gemini API rate limit exceeded, switching to fallback method")
         return detect_duplicate_images_fallback(image_paths, threshold)
     
     try:
-        # Thử sử dụng Gemini API
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
         # Lưu trữ kết quả
         duplicates = []
         
-        # Tạo một từ điển ánh xạ đường dẫn đến ID khung hình
-        path_to_id_map = {}
-        for frame in keyframesData:
-            if 'path' in frame and 'id' in frame:
-                path_to_id_map[frame['path']] = frame['id']
-        
         # Giới hạn số lượng so sánh để tránh vượt quá quota
         max_comparisons = 5  # Giảm số lượng so sánh xuống
         comparison_count = 0
@@ -234,10 +309,9 @@ def detect_duplicate_images_with_gemini(image_paths, session_id, threshold=0.85)
                     if not os.path.exists(path1) or not os.path.exists(path2):
                         continue
                     
-                    # Đọc dữ liệu ảnh
-                    with open(path1, "rb") as img_file1, open(path2, "rb") as img_file2:
-                        image_data1 = img_file1.read()
-                        image_data2 = img_file2.read()
+                    # Ảnh đã thu nhỏ và nén lại để gửi lên Gemini
+                    image_data1 = gemini_images.inline_data(path1)
+                    image_data2 = gemini_images.inline_data(path2)
                     
                     # Tạo prompt cho Gemini
                     prompt = """
@@ -259,24 +333,14 @@ def detect_duplicate_images_with_gemini(image_paths, session_id, threshold=0.85)
                             "role": "user",
                             "parts": [
                                 {"text": prompt},
-                                {
-                                    "inline_data": {
-                                        "mime_type": "image/jpeg",
-                                        "data": base64.b64encode(image_data1).decode('utf-8')
-                                    }
-                                },
-                                {
-                                    "inline_data": {
-                                        "mime_type": "image/jpeg",
-                                        "data": base64.b64encode(image_data2).decode('utf-8')
-                                    }
-                                }
+                                {"inline_data": image_data1},
+                                {"inline_data": image_data2}
                             ]
                         }
                     ]
                     
                     # Gọi API Gemini
-                    response = model.generate_content(contents)
+                    response = gemini_client.generate(contents, label='detect_duplicates')
                     
                     # Xử lý phản hồi để trích xuất JSON
                     response_text = response.text.strip()
@@ -295,7 +359,8 @@ def detect_duplicate_images_with_gemini(image_paths, session_id, threshold=0.85)
                     # Kiểm tra nếu là ảnh trùng lặp dựa trên ngưỡng được cung cấp
                     if result.get('are_duplicates', False) and result.get('similarity_score', 0) >= threshold:
                         # Lấy ID của khung hình nếu có
-                        frame_id = path_to_id_map.get(image_paths[j], str(uuid.uuid4())[:8])
+                        frame = keyframe_store.find_by_path(image_paths[j], session_id)
+                        frame_id = (frame or {}).get('id') or str(uuid.uuid4())[:8]
                         
                         # Thêm vào danh sách trùng lặp
                         duplicates.append({
@@ -343,466 +408,573 @@ def detect_duplicate_images_with_gemini(image_paths, session_id, threshold=0.85)
         # Chuyển sang phương pháp dự phòng
         return detect_duplicate_images_fallback(image_paths, threshold)
 
-def is_transition_frame(frame, gray=None, diff_history=None, threshold=0.4):
+def get_extraction_workers(form):
+    """Số tiến trình dùng để trích xuất: 1 (tuần tự) trừ khi form có parallel=true"""
+    if form.get('parallel', 'false') != 'true':
+        return 1
+    return max(1, form.get('workers', os.cpu_count() or 1, type=int))
+
+def get_analysis_width(form):
+    """Chiều rộng ảnh dùng để phân tích khung hình; 0 = giữ độ phân giải gốc"""
+    analysis_width = form.get('analysis_width', DEFAULT_ANALYSIS_WIDTH, type=int)
+    return analysis_width if analysis_width and analysis_width > 0 else None
+
+def get_frame_decoder(form):
+    """Bộ giải mã khung hình được chọn trong form, None nếu không hợp lệ"""
+    decoder = form.get('decoder', 'opencv')
+    return decoder if decoder in FRAME_DECODERS else None
+
+def get_output_profile(form):
     """
-    Phát hiện nếu một khung hình có khả năng là một phần của hiệu ứng fade transition
-    
-    Sử dụng nhiều chỉ số đánh giá:
-    1. Phân tích độ tương phản và độ sáng
-    2. Phát hiện cạnh
-    3. Phân tích mẫu thời gian sử dụng lịch sử khác biệt
-    
-    Tham số:
-    - threshold: Giá trị từ 0-1 kiểm soát độ nhạy (cao hơn = nghiêm ngặt hơn)
-    
-    Trả về:
-    - Boolean cho biết khung hình có khả năng là transition hay không
+    Cấu hình ghi ảnh khung hình trong form (xem output_profile), None nếu không hợp lệ
+
+    - output_format: jpeg, webp hoặc avif (tùy bản OpenCV, xem supported_output_formats)
+    - output_quality: chất lượng nén 1-100
+    - output_max_dimension: cạnh dài nhất của ảnh lưu ra, 0 = giữ độ phân giải gốc
     """
-    # Chuyển sang ảnh xám nếu chưa có
-    if gray is None:
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    
-    # Tính toán thống kê ảnh
-    mean_val = np.mean(gray)
-    std_val = np.std(gray)
-    
-    # 1. Kiểm tra độ tương phản - transitions thường có độ tương phản thấp hơn
-    contrast_score = std_val / 128.0  # Chuẩn hóa về khoảng 0-1
-    low_contrast = contrast_score < (0.1 + threshold * 0.2)
-    
-    # 2. Phát hiện cạnh - transitions có ít cạnh mạnh hơn
-    edges = cv2.Canny(gray, 100, 200)
-    edge_density = np.count_nonzero(edges) / (gray.shape[0] * gray.shape[1])
-    low_edge_density = edge_density < (0.01 + threshold * 0.05)
-    
-    # 3. Kiểm tra mẫu thời gian - fade transitions thể hiện một mẫu cụ thể trong diff_history
-    temporal_pattern = False
-    if diff_history and len(diff_history) >= 3:
-        # Kiểm tra sự khác biệt tăng dần hoặc giảm dần (đặc trưng của fades)
-        diffs = np.array(diff_history[-3:])
-        is_increasing = np.all(np.diff(diffs) > 0)
-        is_decreasing = np.all(np.diff(diffs) < 0)
-        temporal_pattern = is_increasing or is_decreasing
-    
-    # Kết hợp các chỉ số - trọng số dựa trên ngưỡng
-    confidence = 0
-    
-    if low_contrast:
-        confidence += 0.4
-    
-    if low_edge_density:
-        confidence += 0.4
-    
-    if temporal_pattern:
-        confidence += 0.2
-    
-    # Trả về true nếu độ tin cậy kết hợp vượt quá ngưỡng
-    return confidence > threshold
+    output_format = form.get('output_format', DEFAULT_OUTPUT_FORMAT).lower()
+    output_format = 'jpeg' if output_format == 'jpg' else output_format
+    quality = form.get('output_quality', DEFAULT_OUTPUT_QUALITY, type=int)
+    max_dimension = form.get('output_max_dimension', 0, type=int)
+    if output_format not in supported_output_formats() or quality is None or not 1 <= quality <= 100 \
+            or max_dimension is None or max_dimension < 0:
+        return None
+    return output_profile(output_format, quality, max_dimension)
+
+def remove_keyframe_image(full_path):
+    """Xóa ảnh khung hình cùng ảnh thu nhỏ của nó"""
+    os.remove(full_path)
+    if os.path.exists(thumbnail_path(full_path)):
+        os.remove(thumbnail_path(full_path))
+
+def save_signal_index(signal_index, session_id, detectors):
+    """Lưu chỉ số khung hình của phiên cùng danh sách ảnh keyframes đã ghi (để dùng lại khi chọn lại)"""
+    signal_index.info['methods'] = [detector.method for detector in detectors]
+    signal_index.info['images'] = {
+        str(keyframe['frame_number']): os.path.basename(keyframe['path'])
+        for detector in detectors for keyframe in detector.keyframes
+    }
+    signal_index.info['image_hashes'] = {
+        str(keyframe['frame_number']): {name: keyframe[name] for name in IMAGE_HASH_NAMES}
+        for detector in detectors for keyframe in detector.keyframes
+        if all(name in keyframe for name in IMAGE_HASH_NAMES)
+    }
+    signal_index.save(SIGNALS_FOLDER, session_id)
 
-def extract_keyframes_with_transition_detection(video_path, threshold=30, max_frames=20, transition_threshold=0.4):
+def copy_session_transcript(source_session_id, session_id):
     """
-    Trích xuất keyframes với phát hiện transition
+    Sao chép phiên âm của phiên nguồn sang phiên mới (TRANSCRIPTS_FOLDER/<session_id>/)
+
+    Trả về thông tin phiên âm như transcribe_audio, None nếu phiên nguồn chưa có phiên âm.
     """
-    cap = cv2.VideoCapture(video_path)
-    
-    # Kiểm tra nếu không mở được video
-    if not cap.isOpened():
-        raise Exception("Không thể mở file video")
-    
-    # Lấy thông tin video
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    
-    # Lấy tên video để đặt tên folder
-    video_name = get_video_name_without_extension(video_path)
-    session_id = create_safe_session_id(video_name)
-    
-    # Tạo thư mục dựa trên tên video
-    session_folder = os.path.join(KEYFRAMES_FOLDER, session_id)
-    os.makedirs(session_folder, exist_ok=True)
-    
-    # Các biến theo dõi
-    prev_frame = None
-    keyframes = []
-    frame_count = 0
-    diff_history = collections.deque(maxlen=5)  # Lưu trữ lịch sử khác biệt
-    
-    # Tính toán bước nhảy để tăng hiệu suất với video dài
-    frame_skip = max(1, int(total_frames / (10 * fps)))  # Xử lý khoảng 10 khung hình mỗi giây
-    
-    logging.info(f"Bắt đầu xử lý video (Transition Aware): {video_path}")
-    logging.info(f"Tổng số khung hình: {total_frames}, FPS: {fps}, Skip: {frame_skip}")
-    
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-            
-        # Bỏ qua một số khung hình để tăng hiệu suất
-        if frame_count % frame_skip != 0 and frame_count > 0:
-            frame_count += 1
-            continue
-            
-        # Xử lý khung hình đầu tiên
-        if prev_frame is None:
-            prev_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            # Lưu khung hình đầu tiên
-            frame_filename = f"frame_0.jpg"
-            frame_path = os.path.join(session_folder, frame_filename)
-            cv2.imwrite(frame_path, frame)
-            
-            # Đường dẫn tương đối cho frontend
-            relative_path = os.path.join('uploads', 'keyframes', session_id, frame_filename)
-            keyframes.append({
-                'path': relative_path,
-                'frame_number': frame_count,
-                'timestamp': frame_count / fps,
-                'diff_value': 0,
-                'is_transition': False,
-                'id': str(uuid.uuid4())[:8]  # Thêm ID duy nhất cho mỗi khung hình
-            })
-            frame_count += 1
-            continue
-            
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        
-        # Tính toán sự khác biệt
-        diff = cv2.absdiff(gray, prev_frame)
-        mean_diff = np.mean(diff)
-        diff_history.append(mean_diff)
-        
-        # Nếu có sự thay đổi lớn, lưu khung hình
-        if mean_diff > threshold:
-            # Kiểm tra xem đây có phải là khung hình transition không
-            is_trans = is_transition_frame(frame, gray, diff_history, transition_threshold)
-            
-            frame_filename = f"frame_{len(keyframes)}.jpg"
-            frame_path = os.path.join(session_folder, frame_filename)
-            cv2.imwrite(frame_path, frame)
-            
-            # Đường dẫn tương đối cho frontend
-            relative_path = os.path.join('uploads', 'keyframes', session_id, frame_filename)
-            keyframes.append({
-                'path': relative_path,
-                'frame_number': frame_count,
-                'timestamp': frame_count / fps,
-                'diff_value': float(mean_diff),
-                'is_transition': is_trans,
-                'id': str(uuid.uuid4())[:8]
-            })
-            
-        prev_frame = gray
-        frame_count += 1
-        
-        # Giới hạn số lượng khung hình
-        if max_frames is not None and len(keyframes) >= max_frames:
-            break
-        
-    cap.release()
+    source_path = os.path.join(TRANSCRIPTS_FOLDER, source_session_id, f"{source_session_id}_transcript.txt")
+    if not os.path.exists(source_path):
+        return None
     
-    # Trả về thông tin các khung hình và ID phiên
+    transcript_folder = os.path.join(TRANSCRIPTS_FOLDER, session_id)
+    os.makedirs(transcript_folder, exist_ok=True)
+    transcript_path = os.path.join(transcript_folder, f"{session_id}_transcript.txt")
+    shutil.copyfile(source_path, transcript_path)
+    with open(transcript_path, 'r', encoding='utf-8') as f:
+        transcript = f.read()
     return {
-        'session_id': session_id,
-        'keyframes': keyframes,
-        'total_frames': total_frames,
-        'fps': fps,
-        'duration': total_frames / fps,
-        'width': width,
-        'height': height,
-        'method': 'transition_aware',
-        'transition_threshold': transition_threshold
+        'path': transcript_path,
+        'relative_path': os.path.join('uploads', 'transcripts', session_id, f"{session_id}_transcript.txt"),
+        'text': transcript
     }
 
-# Cập nhật các hàm trích xuất khung hình để sử dụng phát hiện trùng lặp
+def annotate_signal_index(session_id, **info):
+    """Bổ sung thông tin (tham số trích xuất, hash video, thông tin file) vào chỉ số đã lưu của phiên"""
+    try:
+        signal_index = SignalIndex.load(SIGNALS_FOLDER, session_id)
+    except FileNotFoundError:
+        return
+    signal_index.info.update(info)
+    signal_index.save(SIGNALS_FOLDER, session_id)
+
+def run_keyframe_extraction(video_path, detectors, sampling_mode='auto', workers=1,
+                            analysis_width=DEFAULT_ANALYSIS_WIDTH, decoder='opencv', progress=None,
+                            session_id=None, output=None):
+    """
+    Trích xuất khung hình với một hoặc nhiều detector trong cùng một lượt giải mã video
+
+    Với workers > 1, video được chia thành nhiều đoạn và giải mã song song trên nhiều tiến trình.
+    Việc phát hiện chạy trên ảnh xám rộng analysis_width, ảnh lưu ra giữ độ phân giải gốc.
+    decoder='ffmpeg' giải mã bằng tiến trình ffmpeg đa luồng (luôn chạy một lượt, bỏ qua workers).
+    progress (tùy chọn) nhận tỉ lệ video đã quét (0.0 - 1.0).
+    session_id mặc định được tạo từ tên video.
+    output (tùy chọn, xem output_profile): định dạng, chất lượng và kích thước tối đa của ảnh lưu ra.
+    Chỉ số của từng khung hình được lưu vào SIGNALS_FOLDER để chọn lại keyframes (/reselect-keyframes).
+    Trả về từ điển {tên phương pháp: kết quả}
+    """
+    source = open_frame_source(video_path, decoder, sampling_mode, analysis_width)
+    try:
+        # Lấy tên video để đặt tên folder
+        if session_id is None:
+            session_id = create_safe_session_id(get_video_name_without_extension(video_path))
+        
+        # Tạo thư mục dựa trên tên video
+        session_folder = os.path.join(KEYFRAMES_FOLDER, session_id)
+        writer = KeyframeWriter(session_folder, os.path.join('uploads', 'keyframes', session_id), source.fps,
+                                output=output)
+        
+        methods = ', '.join(detector.method for detector in detectors)
+        logging.info(f"Bắt đầu xử lý video ({methods}): {video_path}")
+        logging.info(f"Tổng số khung hình: {source.total_frames}, FPS: {source.fps}, "
+                     f"Skip: {source.frame_skip}, Sampling: {sampling_mode}, Analysis width: {analysis_width}, "
+                     f"Decoder: {decoder}")
+        
+        signal_index = SignalIndex.for_source(source)
+        if workers > 1 and decoder == 'opencv':
+            run_keyframe_detectors_parallel(source, detectors, writer, workers, progress=progress,
+                                            signal_index=signal_index)
+        else:
+            run_keyframe_detectors(source, detectors, writer, progress=progress, signal_index=signal_index)
+        
+        save_signal_index(signal_index, session_id, detectors)
+        
+        # Trả về thông tin các khung hình và ID phiên cho từng phương pháp
+        return {detector.method: build_result(source, session_id, detector) for detector in detectors}
+    finally:
+        source.release()
+
+def extract_keyframes_with_transition_detection(video_path, threshold=30, max_frames=20, transition_threshold=0.4,
+                                                sampling_mode='auto', workers=1,
+                                                analysis_width=DEFAULT_ANALYSIS_WIDTH, decoder='opencv',
+                                                progress=None, session_id=None, output=None):
+    """
+    Trích xuất keyframes với phát hiện transition
+    """
+    detector = TransitionAwareDetector(threshold, max_frames, transition_threshold)
+    return run_keyframe_extraction(video_path, [detector], sampling_mode, workers, analysis_width,
+                                   decoder, progress, session_id, output)[detector.method]
 
-def extract_keyframes_method1(video_path, threshold=30, max_frames=20):
+def extract_keyframes_method1(video_path, threshold=30, max_frames=20, sampling_mode='auto', workers=1,
+                              analysis_width=DEFAULT_ANALYSIS_WIDTH, decoder='opencv', progress=None,
+                              session_id=None, output=None):
     """
     Phương pháp 1: Trích xuất khung hình dựa trên sự thay đổi giữa các khung hình
+
+    Tham số:
+    - sampling_mode: cách bỏ qua khung hình ('grab', 'seek' hoặc 'auto'), xem iter_sampled_frames
+    - workers: số tiến trình giải mã song song (1 = tuần tự)
+    - analysis_width: chiều rộng ảnh xám dùng để phát hiện (None = độ phân giải gốc)
+    - decoder: bộ giải mã khung hình ('opencv' hoặc 'ffmpeg')
+    - output: cấu hình ghi ảnh khung hình (xem output_profile)
     """
-    cap = cv2.VideoCapture(video_path)
+    detector = FrameDifferenceDetector(threshold, max_frames)
+    return run_keyframe_extraction(video_path, [detector], sampling_mode, workers, analysis_width,
+                                   decoder, progress, session_id, output)[detector.method]
+
+def extract_keyframes_method2(video_path, threshold=30, min_scene_length=15, max_frames=20, sampling_mode='auto',
+                              workers=1, analysis_width=DEFAULT_ANALYSIS_WIDTH, decoder='opencv', progress=None,
+                              session_id=None, output=None):
+    """
+    Phương pháp 2: Trích xuất khung hình dựa trên phát hiện chuyển cảnh
+    """
+    detector = SceneDetector(threshold, max_frames, min_scene_length)
+    return run_keyframe_extraction(video_path, [detector], sampling_mode, workers, analysis_width,
+                                   decoder, progress, session_id, output)[detector.method]
+
+def build_detectors(methods, threshold=30, max_frames=20, min_scene_length=15, transition_threshold=0.4):
+    """Tạo detector cho từng phương pháp (xem DETECTOR_CLASSES)"""
+    detectors = []
+    for method in methods:
+        if method == FrameDifferenceDetector.method:
+            detectors.append(FrameDifferenceDetector(threshold, max_frames))
+        elif method == SceneDetector.method:
+            detectors.append(SceneDetector(threshold, max_frames, min_scene_length))
+        elif method == TransitionAwareDetector.method:
+            # Tránh trùng tên file với phương pháp 1 khi chạy cùng nhau
+            prefix = 'transition' if FrameDifferenceDetector.method in methods else None
+            detectors.append(TransitionAwareDetector(threshold, max_frames, transition_threshold, prefix))
+        else:
+            raise ValueError(f"Phương pháp không hợp lệ: {method}")
+    return detectors
+
+def extract_keyframes_multi(video_path, methods, threshold=30, max_frames=20, min_scene_length=15,
+                            transition_threshold=0.4, sampling_mode='auto', workers=1,
+                            analysis_width=DEFAULT_ANALYSIS_WIDTH, decoder='opencv', progress=None,
+                            session_id=None, output=None):
+    """
+    Chạy nhiều phương pháp trích xuất (xem DETECTOR_CLASSES) trong một lượt giải mã video
+
+    Trả về từ điển {tên phương pháp: kết quả}
+    """
+    detectors = build_detectors(methods, threshold, max_frames, min_scene_length, transition_threshold)
+    return run_keyframe_extraction(video_path, detectors, sampling_mode, workers, analysis_width, decoder,
+                                   progress, session_id, output)
+
+def extract_keyframes_primary(video_path, methods, **kwargs):
+    """
+    Chạy nhiều phương pháp, kết quả chính là của phương pháp đầu tiên
+
+    Kết quả của từng phương pháp nằm trong trường 'results'
+    """
+    results = extract_keyframes_multi(video_path, methods, **kwargs)
+    result = dict(results[methods[0]])
+    result['results'] = results
+    return result
+
+def get_video_url(form):
+    """URL video (YouTube hoặc TikTok) trong form, hỗ trợ tên trường cũ youtube_url"""
+    return form.get('video_url', '') or form.get('youtube_url', '')
+
+def get_whisper_model_name(form):
+    """Model Whisper được chọn trong form, None nếu không hợp lệ"""
+    model_name = form.get('whisper_model', DEFAULT_WHISPER_MODEL)
+    return model_name if model_name in WHISPER_MODEL_NAMES else None
+
+def add_audio_transcript(job, result, video_path, session_id, whisper_model=DEFAULT_WHISPER_MODEL):
+    """Trích xuất âm thanh và phiên âm, lỗi âm thanh không làm hỏng cả job"""
+    try:
+        # Trích xuất âm thanh
+        job.update('audio')
+        audio_result = extract_audio_from_video(video_path)
+        result['audio'] = audio_result
+        
+        # Phiên âm
+        job.update('transcribe')
+        transcript_result = transcribe_audio(audio_result['path'], session_id, whisper_model)
+        result['transcript'] = transcript_result
+    except Exception as audio_error:
+        logging.error(f"Lỗi khi xử lý âm thanh: {str(audio_error)}")
+        result['audio_error'] = str(audio_error)
+
+# Tăng khi thuật toán chọn khung hình thay đổi để bỏ qua kết quả đã lưu bằng phiên bản cũ
+# (2: điểm giữa cảnh được làm tròn về khung hình đã lấy mẫu ở mọi đường chạy,
+#  3: mật độ cạnh đo ở EDGE_REFERENCE_WIDTH thay vì analysis_width)
+EXTRACTION_CACHE_VERSION = 3
+
+def extraction_cache_params(extract):
+    """
+    Tham số ảnh hưởng đến kết quả trích xuất
+
+    Số tiến trình (workers) không nằm trong khóa vì chạy tuần tự, song song hay chọn lại
+    từ chỉ mục tín hiệu đều chọn đúng cùng các khung hình đã lấy mẫu.
+    """
+    params = {key: value for key, value in extract.keywords.items() if key != 'workers'}
+    params['function'] = extract.func.__name__
+    params['version'] = EXTRACTION_CACHE_VERSION
+    return params
+
+def cache_session_id(video_path, cache_key=None):
+    """Session ID theo tên video và khóa cache (ngẫu nhiên khi không dùng cache)"""
+    suffix = cache_key[:8] if cache_key else uuid.uuid4().hex[:8]
+    return f"{create_safe_session_id(get_video_name_without_extension(video_path))}_{suffix}"
+
+def extract_with_cache(job, extract, file_path, video_hash):
+    """
+    Trích xuất khung hình, dùng lại kết quả đã lưu nếu cùng nội dung video và tham số
+
+    Thư mục phiên mang hậu tố của khóa cache để các lần chạy với tham số khác nhau
+    trên cùng một video không ghi đè ảnh của nhau. Khi dùng lại kết quả, request nhận một
+    bản sao của phiên đã lưu để không dùng chung thư mục phiên với người đã upload trước.
+    """
+    if video_hash is None:
+        return extract(file_path, progress=job.stage_callback('extract'))
+    
+    cache_key = result_cache.key(video_hash, extraction_cache_params(extract))
+    # Kết quả đã lưu được sao chép sang một phiên riêng cho request này
+    cached_result = result_cache.get(cache_key, session_id=cache_session_id(file_path))
+    if cached_result is not None:
+        logging.info(f"Dùng kết quả đã lưu cho {file_path} (phiên {cached_result['session_id']})")
+        job.update('extract', 1.0)
+        cached_result['cached'] = True
+        return cached_result
+    
+    result = extract(file_path, progress=job.stage_callback('extract'),
+                     session_id=cache_session_id(file_path, cache_key))
+    result_cache.put(cache_key, result)
+    return result
+
+# Trường thông tin file/URL được thêm vào kết quả sau khi trích xuất
+RESULT_EXTRA_FIELDS = ('filename', 'video_url', 'video_title', 'video_source')
+
+# Phương pháp (DETECTOR_CLASSES) ứng với từng hàm trích xuất, dùng khi chọn lại keyframes
+EXTRACTION_FUNCTION_METHODS = {
+    'extract_keyframes_method1': [FrameDifferenceDetector.method],
+    'extract_keyframes_method2': [SceneDetector.method],
+    'extract_keyframes_with_transition_detection': [TransitionAwareDetector.method]
+}
+
+# Tham số có thể thay đổi khi chọn lại keyframes và kiểu dữ liệu của chúng
+RESELECT_PARAMS = {'threshold': int, 'max_frames': int, 'min_scene_length': int, 'transition_threshold': float}
+
+def reselect_keyframes(session_id, overrides):
+    """
+    Chọn lại keyframes của một phiên với tham số mới từ chỉ số khung hình đã lưu
+
+    Không giải mã lại video: detector chạy trên chỉ số đã lưu, ảnh đã có được sao chép
+    và chỉ những khung hình mới được chọn mới được đọc từ video.
+    Kết quả nằm trong một phiên mới và được lưu vào result_cache nếu biết hash của video.
+    """
+    signal_index = SignalIndex.load(SIGNALS_FOLDER, session_id)
+    params = dict(signal_index.info.get('params') or {'function': 'extract_keyframes_primary',
+                                                      'methods': signal_index.info['methods']})
+    # Chỉ đổi tham số mà phương pháp đã dùng để khóa cache khớp với lần trích xuất tương đương
+    params.update({name: value for name, value in overrides.items()
+                   if name in params or name in ('threshold', 'max_frames')})
+    # Chỉ số lưu bởi phiên bản cũ không được trả về kết quả đã lưu theo thuật toán cũ
+    params['version'] = EXTRACTION_CACHE_VERSION
+    
+    video_hash = signal_index.info.get('video_hash')
+    cache_key = result_cache.key(video_hash, params) if video_hash else None
+    if cache_key:
+        cached_result = result_cache.get(cache_key, session_id=cache_session_id(signal_index.info['video_path']))
+        if cached_result is not None:
+            cached_result['cached'] = True
+            add_reselect_transcript(cached_result, session_id)
+            return cached_result
+    
+    methods = EXTRACTION_FUNCTION_METHODS.get(params['function'], params.get('methods'))
+    detectors = build_detectors(methods, params.get('threshold', 30), params.get('max_frames', 20),
+                                params.get('min_scene_length', 15), params.get('transition_threshold', 0.4))
+    
+    new_session_id = cache_session_id(signal_index.info['video_path'], cache_key)
+    session_folder = os.path.join(KEYFRAMES_FOLDER, new_session_id)
+    writer = KeyframeWriter(session_folder, os.path.join('uploads', 'keyframes', new_session_id), signal_index.fps,
+                            output=params.get('output'))
+    existing_images = {
+        int(frame_number): os.path.join(KEYFRAMES_FOLDER, session_id, filename)
+        for frame_number, filename in signal_index.info.get('images', {}).items()
+    }
+    existing_hashes = {
+        int(frame_number): hashes for frame_number, hashes in signal_index.info.get('image_hashes', {}).items()
+    }
+    was_complete = signal_index.complete
+    source_info = dict(signal_index.info)
+    replay_signal_index(signal_index, detectors, writer, existing_images, existing_hashes)
+    if signal_index.complete and not was_complete:
+        # Phần video còn lại vừa được quét: lưu lại cho phiên gốc để lần chọn lại sau không quét lại
+        SignalIndex(source_info, signal_index.table, complete=True).save(SIGNALS_FOLDER, session_id)
+    
+    results = {detector.method: build_result(signal_index, new_session_id, detector) for detector in detectors}
+    result = dict(results[methods[0]])
+    if params['function'] not in EXTRACTION_FUNCTION_METHODS:
+        result['results'] = results
+    result.update(signal_index.info.get('extras', {}))
+    
+    # Phiên mới cũng có thể được chọn lại tiếp
+    signal_index.info['params'] = params
+    save_signal_index(signal_index, new_session_id, detectors)
+    if cache_key:
+        result_cache.put(cache_key, result)
+    add_reselect_transcript(result, session_id)
+    return result
+
+def add_reselect_transcript(result, source_session_id):
+    """Phiên chọn lại dùng chung phiên âm với phiên nguồn (sao chép sang thư mục của phiên mới)"""
+    transcript = copy_session_transcript(source_session_id, result['session_id'])
+    if transcript is not None:
+        result['transcript'] = transcript
+
+def extract_while_downloading(job, extract, video_url):
+    """
+    Trích xuất khung hình từ luồng media của URL trong khi file video được tải về song song
+
+    Trả về (kết quả, thông tin video đã tải). Kết quả là None khi video đã có trong download_cache,
+    không phát trực tiếp được (xem resolve_stream_url) hoặc không giải mã được qua mạng;
+    khi đó video được trích xuất từ file đã tải như bình thường.
+    """
+    if download_cache.get(video_download_key(video_url)) is not None:
+        return None, download_video_from_url(video_url)
     
-    # Kiểm tra nếu không mở được video
-    if not cap.isOpened():
-        raise Exception("Không thể mở file video")
+    stream_info = resolve_stream_url(video_url)
+    download = url_download_pool.submit(download_video_from_url, video_url)
+    if stream_info is None:
+        return None, download.result()
     
-    # Lấy thông tin video
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    # Tên phiên theo tiêu đề video giống như khi trích xuất từ file đã tải
+    video_name = f"{safe_video_name(stream_info.get('title', 'downloaded_video'))}.{stream_info.get('ext', 'mp4')}"
+    session_id = cache_session_id(video_name)
+    session_folder = os.path.join(KEYFRAMES_FOLDER, session_id)
+    try:
+        result = extract(stream_info['url'], progress=job.stage_callback('extract'), session_id=session_id)
+    except Exception as e:
+        logging.warning(f"Không trích xuất được từ luồng media, chờ tải xong video: {str(e)}")
+        shutil.rmtree(session_folder, ignore_errors=True)
+        return None, download.result()
     
-    # Lấy tên video để đặt tên folder
-    video_name = get_video_name_without_extension(video_path)
-    session_id = create_safe_session_id(video_name)
+    try:
+        video_info = download.result()
+    except Exception:
+        # Không có file video thì phiên không dùng lại được (chọn lại keyframes, phiên âm)
+        shutil.rmtree(session_folder, ignore_errors=True)
+        raise
+    # Chỉ số khung hình trỏ đến file đã tải (URL media có thời hạn) để chọn lại keyframes sau này
+    annotate_signal_index(session_id, video_path=video_info['path'])
+    return result, video_info
+
+def run_extraction_job(job, extract, file_path, filename, video_url, extract_audio,
+                       whisper_model=DEFAULT_WHISPER_MODEL, video_hash=None, use_cache=True,
+                       stream_download=False):
+    """
+    Job trích xuất khung hình: tải video (nếu từ URL), trích xuất, tách âm thanh và phiên âm
+
+    extract là functools.partial của một hàm extract_keyframes_*; kết quả được lưu trong
+    result_cache theo hash nội dung video (video_hash) và tham số trích xuất.
+    Với stream_download, video từ URL được trích xuất trong lúc tải (xem extract_while_downloading).
+    """
+    video_info = None
+    result = None
+    if video_url:
+        # Tải video từ URL - không cần validate URL nghiêm ngặt
+        job.update('download')
+        if stream_download:
+            result, video_info = extract_while_downloading(job, extract, video_url)
+        else:
+            video_info = download_video_from_url(video_url)
+        file_path = video_info['path']
+        filename = video_info['filename']
+        
+        # Ghi log
+        logging.info(f"Đã tải video {video_info['source']}: {video_info['title']}")
+        if use_cache:
+            video_hash = video_info['sha256']
     
-    # Tạo thư mục dựa trên tên video
-    session_folder = os.path.join(KEYFRAMES_FOLDER, session_id)
-    os.makedirs(session_folder, exist_ok=True)
+    if result is None:
+        result = extract_with_cache(job, extract, file_path, video_hash if use_cache else None)
+    elif use_cache:
+        result_cache.put(result_cache.key(video_hash, extraction_cache_params(extract)), result)
     
-    # Các biến theo dõi
-    prev_frame = None
-    keyframes = []
-    frame_count = 0
+    # Thêm tên file vào kết quả
+    result['filename'] = filename
     
-    # Tính toán bước nhảy để tăng hiệu suất với video dài
-    frame_skip = max(1, int(total_frames / (10 * fps)))  # Xử lý khoảng 10 khung hình mỗi giây
+    # Nếu là video từ URL, thêm thông tin
+    if video_info:
+        result['video_url'] = video_url
+        result['video_title'] = video_info['title']
+        result['video_source'] = video_info['source']
     
-    logging.info(f"Bắt đầu xử lý video (Phương pháp 1): {video_path}")
-    logging.info(f"Tổng số khung hình: {total_frames}, FPS: {fps}, Skip: {frame_skip}")
+    # Thông tin để /reselect-keyframes tạo lại kết quả với tham số mới
+    annotate_signal_index(result['session_id'], params=extraction_cache_params(extract), video_hash=video_hash,
+                          extras={key: result[key] for key in RESULT_EXTRA_FIELDS if key in result})
     
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-            
-        # Bỏ qua một số khung hình để tăng hiệu suất
-        if frame_count % frame_skip != 0 and frame_count > 0:
-            frame_count += 1
-            continue
-            
-        # Xử lý khung hình đầu tiên
-        if prev_frame is None:
-            prev_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            # Lưu khung hình đầu tiên
-            frame_filename = f"frame_0.jpg"
-            frame_path = os.path.join(session_folder, frame_filename)
-            cv2.imwrite(frame_path, frame)
-            
-            # Đường dẫn tương đối cho frontend
-            relative_path = os.path.join('uploads', 'keyframes', session_id, frame_filename)
-            keyframes.append({
-                'path': relative_path,
-                'frame_number': frame_count,
-                'timestamp': frame_count / fps,
-                'diff_value': 0,
-                 'id': str(uuid.uuid4())[:8]  # Thêm ID duy nhất cho mỗi khung hình
-            })
-            frame_count += 1
-            continue
-            
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        
-        # Tính toán sự khác biệt
-        diff = cv2.absdiff(gray, prev_frame)
-        mean_diff = np.mean(diff)
-        
-        # Nếu có sự thay đổi lớn, lưu khung hình
-        if mean_diff > threshold:
-            frame_filename = f"frame_{len(keyframes)}.jpg"
-            frame_path = os.path.join(session_folder, frame_filename)
-            cv2.imwrite(frame_path, frame)
-            
-            # Đường dẫn tương đối cho frontend
-            relative_path = os.path.join('uploads', 'keyframes', session_id, frame_filename)
-            keyframes.append({
-                'path': relative_path,
-                'frame_number': frame_count,
-                'timestamp': frame_count / fps,
-                'diff_value': float(mean_diff),
-                'id': str(uuid.uuid4())[:8]  # Thêm ID duy nhất cho mỗi khung hình
-            })
-            
-        prev_frame = gray
-        frame_count += 1
-        
-        # Giới hạn số lượng khung hình
-        if max_frames is not None and len(keyframes) >= max_frames:
-            break
-        
-    cap.release()
+    # Lưu keyframes của phiên
+    keyframe_store.set(result['session_id'], result.get('keyframes', []))
     
-    # Trả về thông tin các khung hình và ID phiên
-    return {
-        'session_id': session_id,  # Sử dụng session_id an toàn
-        'keyframes': keyframes,
-        'total_frames': total_frames,
-        'fps': fps,
-        'duration': total_frames / fps,
-        'width': width,
-        'height': height,
-        'method': 'frame_difference'
-    }
+    # Trích xuất và phiên âm nếu được yêu cầu
+    if extract_audio:
+        add_audio_transcript(job, result, file_path, result['session_id'], whisper_model)
+    
+    return result
 
-def extract_keyframes_method2(video_path, threshold=30, min_scene_length=15, max_frames=20):
+def job_response(job, **extra):
+    """Phản hồi 202 cho job vừa đăng ký, client theo dõi tiến độ qua /jobs/<job_id>"""
+    response = {'job_id': job.id, 'status': job.status, 'stages': job.stages, 'status_url': f"/jobs/{job.id}"}
+    response.update({key: value for key, value in extra.items() if value is not None})
+    return jsonify(response), 202
+
+def submit_extraction_job(kind, extract, extract_audio):
     """
-    Phương pháp 2: Trích xuất khung hình dựa trên phát hiện chuyển cảnh
+    Nhận video của request (lưu file upload hoặc ghi nhận URL) và đăng ký job trích xuất
+
+    Việc tải video từ URL, trích xuất và phiên âm đều chạy trong hàng đợi job,
+    request trả về job_id ngay lập tức. File upload được hash trong lúc nhận để tra cache;
+    metadata của video (nếu đọc được) được trả về trong trường video.
     """
-    cap = cv2.VideoCapture(video_path)
-    
-    # Kiểm tra nếu không mở được video
-    if not cap.isOpened():
-        raise Exception("Không thể mở file video")
-    
-    # Lấy thông tin video
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    
-    # Lấy tên video để đặt tên folder
-    video_name = get_video_name_without_extension(video_path)
-    session_id = create_safe_session_id(video_name)
-    
-    # Tạo thư mục dựa trên tên video
-    session_folder = os.path.join(KEYFRAMES_FOLDER, session_id)
-    os.makedirs(session_folder, exist_ok=True)
+    # Model Whisper dùng để phiên âm
+    whisper_model = get_whisper_model_name(request.form)
+    if whisper_model is None:
+        return jsonify({'error': f"whisper_model phải là một trong {', '.join(WHISPER_MODEL_NAMES)}"}), 400
     
-    # Các biến theo dõi
-    prev_frame = None
-    scene_start = 0
-    frame_count = 0
-    scenes = []
-    keyframes = []
+    # use_cache=false bỏ qua kết quả đã lưu (vd: khi đo hiệu năng)
+    use_cache = request.form.get('use_cache', 'true') == 'true'
     
-    # Tính toán bước nhảy để tăng hiệu suất với video dài
-    frame_skip = max(1, int(total_frames / (10 * fps)))  # Xử lý khoảng 10 khung hình mỗi giây
+    # stream_download=true trích xuất video từ URL trong lúc đang tải
+    stream_download = request.form.get('stream_download', 'false') == 'true'
     
-    logging.info(f"Bắt đầu xử lý video (Phương pháp 2): {video_path}")
-    logging.info(f"Tổng số khung hình: {total_frames}, FPS: {fps}, Skip: {frame_skip}")
+    filename = None
+    file_path = None
+    video_hash = None
+    video_metadata = None
     
-    while cap.isOpened() and (max_frames is None or len(keyframes) < max_frames):
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        # Bỏ qua một số khung hình để tăng hiệu suất
-        if frame_count % frame_skip != 0 and frame_count > 0:
-            frame_count += 1
-            continue
-        
-        # Xử lý khung hình đầu tiên
-        if prev_frame is None:
-            prev_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            scene_start = frame_count
-            
-            # Lưu khung hình đầu tiên
-            frame_filename = f"scene_0.jpg"
-            frame_path = os.path.join(session_folder, frame_filename)
-            cv2.imwrite(frame_path, frame)
-            
-            # Đường dẫn tương đối cho frontend
-            relative_path = os.path.join('uploads', 'keyframes', session_id, frame_filename)
-            keyframes.append({
-                'path': relative_path,
-                'frame_number': frame_count,
-                'timestamp': frame_count / fps,
-                'scene_id': 0,
-                'hist_diff': 0,
-                'id': str(uuid.uuid4())[:8]  # Thêm ID duy nhất cho mỗi khung hình
-            })
+    # Kiểm tra nếu có URL video (YouTube hoặc TikTok)
+    video_url = get_video_url(request.form)
+    if not video_url:
+        # Xử lý upload file trực tiếp
+        if 'video' not in request.files:
+            return jsonify({'error': 'Không tìm thấy video'}), 400
             
-            frame_count += 1
-            continue
-        
-        # Chuyển sang ảnh xám
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        
-        # Tính toán sự khác biệt bằng histogram
-        hist1 = cv2.calcHist([prev_frame], [0], None, [64], [0, 256])
-        hist2 = cv2.calcHist([gray], [0], None, [64], [0, 256])
-        
-        # Chuẩn hóa histogram
-        cv2.normalize(hist1, hist1, 0, 1, cv2.NORM_MINMAX)
-        cv2.normalize(hist2, hist2, 0, 1, cv2.NORM_MINMAX)
-        
-        # So sánh histogram
-        hist_diff = cv2.compareHist(hist1, hist2, cv2.HISTCMP_BHATTACHARYYA)
+        file = request.files['video']
         
-        # Phát hiện chuyển cảnh
-        if hist_diff > threshold / 100 and (frame_count - scene_start) >= min_scene_length:
-            # Lưu thông tin cảnh
-            scenes.append({
-                'start': scene_start,
-                'end': frame_count,
-                'length': frame_count - scene_start
-            })
-            
-            # Lấy khung hình đại diện (khung hình giữa cảnh)
-            mid_frame_idx = scene_start + (frame_count - scene_start) // 2
-            
-            # Định vị lại đến khung hình giữa cảnh
-            cap.set(cv2.CAP_PROP_POS_FRAMES, mid_frame_idx)
-            ret, mid_frame = cap.read()
+        if file.filename == '':
+            return jsonify({'error': 'Không có file nào được chọn'}), 400
             
-            if ret:
-                # Lưu khung hình
-                frame_filename = f"scene_{len(scenes)}.jpg"
-                frame_path = os.path.join(session_folder, frame_filename)
-                cv2.imwrite(frame_path, mid_frame)
-                
-                # Đường dẫn tương đối cho frontend
-                relative_path = os.path.join('uploads', 'keyframes', session_id, frame_filename)
-                keyframes.append({
-                    'path': relative_path,
-                    'frame_number': mid_frame_idx,
-                    'timestamp': mid_frame_idx / fps,
-                    'scene_id': len(scenes),
-                    'hist_diff': float(hist_diff),
-                    'id': str(uuid.uuid4())[:8]  # Thêm ID duy nhất cho mỗi khung hình
-                })
-                
-                # Đặt lại vị trí hiện tại
-                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_count)
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if not allowed_file(file.filename):
+            return jsonify({'error': 'Định dạng file không được hỗ trợ'}), 400
             
-            # Bắt đầu cảnh mới
-            scene_start = frame_count
-        
-        prev_frame = gray
-        frame_count += 1
-    
-    # Xử lý cảnh cuối cùng nếu cần
-    if scene_start < frame_count - min_scene_length and (max_frames is None or len(scenes) < max_frames):
-        scenes.append({
-            'start': scene_start,
-            'end': frame_count,
-            'length': frame_count - scene_start
-        })
-        
-        # Lấy khung hình đại diện cho cảnh cuối
-        mid_frame_idx = scene_start + (frame_count - scene_start) // 2
-        cap.set(cv2.CAP_PROP_POS_FRAMES, mid_frame_idx)
-        ret, mid_frame = cap.read()
-        
-        if ret:
-            frame_filename = f"scene_{len(scenes)}.jpg"
-            frame_path = os.path.join(session_folder, frame_filename)
-            cv2.imwrite(frame_path, mid_frame)
-            
-            # Đường dẫn tương đối cho frontend
-            relative_path = os.path.join('uploads', 'keyframes', session_id, frame_filename)
-            keyframes.append({
-                'path': relative_path,
-                'frame_number': mid_frame_idx,
-                'timestamp': mid_frame_idx / fps,
-                'scene_id': len(scenes),
-                'hist_diff': 0,
-                'id': str(uuid.uuid4())[:8]  # Thêm ID duy nhất cho mỗi khung hình
-            })
-    
-    cap.release()
+        # File đã được ghi và hash trong lúc nhận request, chỉ cần đổi tên
+        filename = secure_filename(file.filename)
+        file_path = unique_upload_path(filename)
+        video_hash, video_metadata = save_uploaded_video(file, file_path)
     
-    # Trả về thông tin các khung hình và ID phiên
-    return {
-        'session_id': session_id,
-        'keyframes': keyframes,
-        'scenes': scenes,
-        'total_frames': total_frames,
-        'fps': fps,
-        'duration': total_frames / fps,
-        'width': width,
-        'height': height,
-        'method': 'scene_detection'
-    }
+    stages = (['download'] if video_url else []) + ['extract'] + (['audio', 'transcribe'] if extract_audio else [])
+    job = job_queue.submit(kind, run_extraction_job, extract, file_path, filename, video_url, extract_audio,
+                           whisper_model, video_hash, use_cache, stream_download, stages=stages)
+    return job_response(job, video=video_metadata)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def check_upload_metadata(metadata):
+    """Từ chối video upload theo metadata (gọi khi đang nhận request, xem IngestFile)"""
+    if MAX_VIDEO_DURATION and metadata['duration'] and metadata['duration'] > MAX_VIDEO_DURATION:
+        raise UploadRejected(f"Video dài {metadata['duration']:.0f} giây, vượt quá giới hạn "
+                             f"{MAX_VIDEO_DURATION:.0f} giây")
+    if MAX_VIDEO_EDGE and max(metadata['width'] or 0, metadata['height'] or 0) > MAX_VIDEO_EDGE:
+        raise UploadRejected(f"Độ phân giải {metadata['width']}x{metadata['height']} vượt quá giới hạn "
+                             f"{MAX_VIDEO_EDGE} pixel")
+
+class VideoUploadRequest(Request):
+    """
+    Request ghi file video upload thẳng vào UPLOAD_FOLDER trong lúc nhận dữ liệu
+
+    Mặc định Werkzeug lưu cả file vào file tạm rồi view mới sao chép sang thư mục upload;
+    với IngestFile, hash nội dung và metadata có ngay khi nhận xong request (metadata của video
+    MP4 "faststart" có ngay từ những byte đầu tiên) và video quá giới hạn bị từ chối sớm.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if not filename or not allowed_file(filename):
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        stream = IngestFile(app.config['UPLOAD_FOLDER'], on_metadata=check_upload_metadata)
+        self.__dict__.setdefault('ingest_files', []).append(stream)
+        return stream
+
+    def close(self):
+        super().close()
+        # Xóa file của upload bị hủy giữa chừng (chưa được lưu bằng save_uploaded_video)
+        for stream in self.__dict__.get('ingest_files', ()):
+            stream.close()
+
+app.request_class = VideoUploadRequest
+
+@app.errorhandler(UploadRejected)
+def upload_rejected(error):
+    return jsonify({'error': str(error)}), 422
+
+def unique_upload_path(filename):
+    """
+    Đường dẫn lưu video upload, không trùng với file đã có
+
+    Job đọc file sau khi request trả về, nên hai lần upload cùng tên không được ghi đè lên nhau.
+    """
+    name, ext = os.path.splitext(filename)
+    return os.path.join(app.config['UPLOAD_FOLDER'], f"{name}_{uuid.uuid4().hex[:8]}{ext}")
+
+def save_uploaded_video(file, file_path):
+    """
+    Lưu video upload vào file_path, trả về SHA-256 nội dung và metadata (None nếu không đọc được)
+
+    File đã được ghi trong lúc nhận request (IngestFile) chỉ cần đổi tên.
+    """
+    if isinstance(file.stream, IngestFile):
+        file.stream.commit(file_path)
+        return file.stream.hexdigest(), file.stream.metadata
+    return copy_stream_with_hash(file.stream, file_path), None
+
 def get_video_name_without_extension(video_path):
     """Lấy tên video không có đuôi mở rộng"""
     base_name = os.path.basename(video_path)
@@ -878,9 +1050,11 @@ def extract_audio_from_video(video_path):
         logging.error(f"Lỗi khi trích xuất âm thanh: {str(e)}")
         raise Exception(f"Không thể trích xuất âm thanh: {str(e)}")
 
-def transcribe_audio(audio_path, session_id):
+def transcribe_audio(audio_path, session_id, model_name=DEFAULT_WHISPER_MODEL):
     """
     Phiên âm file âm thanh thành văn bản sử dụng OpenAI Whisper hoặc phương pháp thay thế
+
+    model_name: kích thước model Whisper (xem WHISPER_MODEL_NAMES), model được giữ trong whisper_models
     """
     try:
         # Tạo thư mục cho file phiên âm
@@ -890,21 +1064,19 @@ def transcribe_audio(audio_path, session_id):
         # Đường dẫn đến file phiên âm
         transcript_path = os.path.join(transcript_folder, f"{session_id}_transcript.txt")
         
-        # Kiểm tra nếu Whisper khả dụng
+        # Kiểm tra nếu Whisper khả dụng, model chỉ được tải ở lần dùng đầu tiên
         try:
-            import whisper
-            WHISPER_AVAILABLE = True
-            whisper_model = whisper.load_model("base")
+            whisper_model = whisper_models.get(model_name)
         except ImportError:
-            WHISPER_AVAILABLE = False
             whisper_model = None
         
-        if WHISPER_AVAILABLE and whisper_model is not None:
-            logging.info(f"Bắt đầu phiên âm file với Whisper: {audio_path}")
+        if whisper_model is not None:
+            logging.info(f"Bắt đầu phiên âm file với Whisper ({model_name}): {audio_path}")
             
             try:
-                # Thực hiện phiên âm với Whisper
-                result = whisper_model.transcribe(audio_path)
+                # Thực hiện phiên âm với Whisper; model dùng chung giữa các job nên phải chờ lượt
+                with whisper_models.use(model_name) as whisper_model:
+                    result = whisper_model.transcribe(audio_path)
                 transcript = result["text"]
                 
                 # Lưu phiên âm vào file
@@ -916,7 +1088,8 @@ def transcribe_audio(audio_path, session_id):
                 return {
                     'path': transcript_path,
                     'relative_path': relative_path,
-                    'text': transcript
+                    'text': transcript,
+                    'model': model_name
                 }
             except Exception as whisper_error:
                 logging.error(f"Lỗi khi phiên âm với Whisper: {str(whisper_error)}")
@@ -935,12 +1108,32 @@ def transcribe_audio(audio_path, session_id):
             logging.error(f"Lỗi khi phiên âm với SpeechRecognition: {str(sr_error)}")
             raise Exception(f"Không thể phiên âm: {str(e)}")
 
+def recognize_audio_chunk(chunk, language="vi-VN"):
+    """Nhận dạng một đoạn âm thanh (pydub AudioSegment) qua bộ nhớ, không ghi file tạm"""
+    import speech_recognition as sr
+    
+    buffer = BytesIO()
+    chunk.export(buffer, format="wav")
+    buffer.seek(0)
+    
+    recognizer = sr.Recognizer()
+    with sr.AudioFile(buffer) as source:
+        audio_data = recognizer.record(source)
+    try:
+        return recognizer.recognize_google(audio_data, language=language)
+    except sr.UnknownValueError:
+        return "[Không nhận dạng được]"
+    except sr.RequestError:
+        return "[Lỗi kết nối]"
+
 def transcribe_with_speechrecognition(audio_path, transcript_path, session_id):
     """
     Phương pháp thay thế sử dụng SpeechRecognition
+
+    Âm thanh được chia tại các khoảng lặng, các đoạn được nhận dạng song song
+    (tối đa SPEECH_RECOGNITION_WORKERS yêu cầu cùng lúc) và ghép lại theo thứ tự.
     """
     try:
-        import speech_recognition as sr
         from pydub import AudioSegment
         
         logging.info(f"Bắt đầu phiên âm file với SpeechRecognition: {audio_path}")
@@ -952,44 +1145,14 @@ def transcribe_with_speechrecognition(audio_path, transcript_path, session_id):
         # Chuyển đổi định dạng âm thanh nếu cần
         sound = AudioSegment.from_wav(audio_path)
         
-        # Chia âm thanh thành các đoạn 30 giây để xử lý
-        chunk_length_ms = 30000  # 30 giây
-        chunks = [sound[i:i+chunk_length_ms] for i in range(0, len(sound), chunk_length_ms)]
-        
-        recognizer = sr.Recognizer()
-        transcript = ""
-        
-        # Thư mục tạm cho chunks
-        temp_chunk_dir = os.path.join(transcript_dir, "temp_chunks")
-        os.makedirs(temp_chunk_dir, exist_ok=True)
+        # Chia âm thanh thành các đoạn tối đa 30 giây tại các khoảng lặng
+        chunks = [sound[start:end] for start, end in split_audio_on_silence(sound)]
+        logging.info(f"Phiên âm {len(chunks)} đoạn âm thanh")
         
-        for i, chunk in enumerate(chunks):
-            # Lưu đoạn âm thanh tạm thời
-            chunk_path = os.path.join(temp_chunk_dir, f"chunk_{i}.wav")
-            chunk.export(chunk_path, format="wav")
-            
-            # Phiên âm đoạn âm thanh
-            with sr.AudioFile(chunk_path) as source:
-                audio_data = recognizer.record(source)
-                try:
-                    text = recognizer.recognize_google(audio_data, language="vi-VN")
-                    transcript += text + " "
-                except sr.UnknownValueError:
-                    transcript += "[Không nhận dạng được] "
-                except sr.RequestError:
-                    transcript += "[Lỗi kết nối] "
-            
-            # Xóa file tạm
-            try:
-                os.remove(chunk_path)
-            except:
-                pass
-        
-        # Xóa thư mục tạm
-        try:
-            shutil.rmtree(temp_chunk_dir)
-        except:
-            pass
+        # map giữ nguyên thứ tự các đoạn dù kết quả trả về không theo thứ tự
+        with ThreadPoolExecutor(max_workers=SPEECH_RECOGNITION_WORKERS) as executor:
+            texts = list(executor.map(recognize_audio_chunk, chunks))
+        transcript = "".join(text + " " for text in texts)
         
         # Lưu phiên âm vào file
         with open(transcript_path, "w", encoding="utf-8") as f:
@@ -1074,81 +1237,113 @@ def extract_tiktok_id(url):
     
     return None
 
+def video_download_key(video_url):
+    """Khóa cache tải xuống theo ID video (vd: youtube_<id>), None nếu không xác định được ID"""
+    is_tiktok = 'tiktok.com' in video_url or 'vm.tiktok.com' in video_url
+    video_id = extract_tiktok_id(video_url) if is_tiktok else extract_video_id(video_url)
+    if not video_id:
+        return None
+    return secure_filename(f"{'tiktok' if is_tiktok else 'youtube'}_{video_id}")
+
+def safe_video_name(video_title):
+    """Tên file an toàn (không có đuôi) từ tiêu đề video"""
+    safe_title = secure_filename(video_title)
+    if not safe_title:
+        safe_title = "downloaded_video"
+        
+    # Đảm bảo tên file không quá dài
+    if len(safe_title) > 50:
+        short_uuid = str(uuid.uuid4())[:8]
+        safe_title = f"{safe_title[:40]}_{short_uuid}"
+    return safe_title
+
 def download_video_from_url(video_url):
     """
     Download video from YouTube or TikTok URL using yt-dlp
+
+    Video được tải thẳng vào thư mục của nó trong download_cache (không qua thư mục tạm),
+    video đã tải trước đó (cùng ID) được dùng lại. Trả về thông tin video kèm sha256 của file.
     """
-    try:
-        # Check if it's a TikTok URL
-        is_tiktok = 'tiktok.com' in video_url or 'vm.tiktok.com' in video_url
-        
-        # Create a temporary directory to save the video
-        temp_dir = tempfile.mkdtemp()
-        
-        logging.info(f"Downloading video from: {video_url} (TikTok: {is_tiktok})")
-        
-        # Configure yt-dlp options
-        ydl_opts = {
-            'format': 'best[ext=mp4]/best',
-            'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
-            'noplaylist': True,
-            'quiet': False,
-            'no_warnings': False,
-            'ignoreerrors': False,
-        }
+    # Check if it's a TikTok URL
+    is_tiktok = 'tiktok.com' in video_url or 'vm.tiktok.com' in video_url
+    cache_key = video_download_key(video_url)
+    
+    with download_cache.lock(cache_key):
+        cached_info = download_cache.get(cache_key)
+        if cached_info is not None:
+            logging.info(f"Dùng video đã tải cho {video_url}: {cached_info['path']}")
+            return cached_info
         
-        # Download video using yt-dlp
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict = ydl.extract_info(video_url, download=True)
-            video_title = info_dict.get('title', 'downloaded_video')
-            video_path = ydl.prepare_filename(info_dict)
+        # URL không xác định được ID video vẫn được tải vào thư mục riêng
+        key = cache_key or f"url_{uuid.uuid4().hex[:12]}"
+        download_folder = download_cache.path(key)
+        
+        try:
+            logging.info(f"Downloading video from: {video_url} (TikTok: {is_tiktok})")
+            
+            # Configure yt-dlp options
+            ydl_opts = {
+                'format': YTDLP_FORMAT,
+                'outtmpl': os.path.join(download_folder, 'video.%(ext)s'),
+                'noplaylist': True,
+                'quiet': False,
+                'no_warnings': False,
+                'ignoreerrors': False,
+            }
+            
+            # Download video using yt-dlp
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info_dict = ydl.extract_info(video_url, download=True)
+                video_title = info_dict.get('title', 'downloaded_video')
+                video_path = ydl.prepare_filename(info_dict)
             
             # Check if file exists after download
             if not os.path.exists(video_path):
                 # Try to find file in directory
-                files = os.listdir(temp_dir)
+                files = [f for f in os.listdir(download_folder) if not f.endswith('.part')]
                 if files:
-                    video_path = os.path.join(temp_dir, files[0])
+                    video_path = os.path.join(download_folder, files[0])
                 else:
                     raise Exception("No file found after download")
-                    
-            logging.info(f"Successfully downloaded video with yt-dlp: {video_path}")
-            
-            # Create safe filename
-            safe_title = secure_filename(video_title)
-            if not safe_title:
-                safe_title = "downloaded_video"
-                
-            # Đảm bảo tên file không quá dài
-            if len(safe_title) > 50:
-                short_uuid = str(uuid.uuid4())[:8]
-                safe_title = f"{safe_title[:40]}_{short_uuid}"
-            
-            # Path to file in uploads folder
-            dest_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{safe_title}.mp4")
             
-            # Copy file from temp directory to uploads folder
-            shutil.copy2(video_path, dest_path)
-            
-            # Clean up temp directory
-            shutil.rmtree(temp_dir)
+            logging.info(f"Successfully downloaded video with yt-dlp: {video_path}")
             
-            # Determine video source
-            source = "TikTok" if is_tiktok else "YouTube"
+            # Đổi tên theo tiêu đề video (cùng thư mục nên không cần sao chép)
+            filename = f"{safe_video_name(video_title)}{os.path.splitext(video_path)[1] or '.mp4'}"
+            dest_path = os.path.join(download_folder, filename)
+            os.replace(video_path, dest_path)
             
-            return {
+            video_info = {
                 'path': dest_path,
                 'title': video_title,
-                'filename': f"{safe_title}.mp4",
-                'source': source
+                'filename': filename,
+                'source': "TikTok" if is_tiktok else "YouTube",
+                'sha256': hash_file(dest_path)
             }
-    
+            download_cache.put(key, video_info)
+            return video_info
+        
+        except Exception as e:
+            logging.error(f"Error downloading video: {str(e)}")
+            # Xóa file tải dở
+            shutil.rmtree(download_folder, ignore_errors=True)
+            raise Exception(f"Could not download video: {str(e)}")
+
+def resolve_stream_url(video_url):
+    """
+    URL media trực tiếp của video (định dạng YTDLP_FORMAT) để giải mã trong khi đang tải
+
+    None nếu định dạng không phải một file tải qua HTTP (vd: hình và tiếng tách riêng, HLS).
+    """
+    try:
+        with yt_dlp.YoutubeDL({'format': YTDLP_FORMAT, 'noplaylist': True, 'quiet': True}) as ydl:
+            info_dict = ydl.extract_info(video_url, download=False)
     except Exception as e:
-        logging.error(f"Error downloading video: {str(e)}")
-        # Clean up temp directory if it exists
-        if 'temp_dir' in locals() and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-        raise Exception(f"Could not download video: {str(e)}")
+        logging.warning(f"Không lấy được URL media của {video_url}: {str(e)}")
+        return None
+    if not info_dict.get('url') or info_dict.get('protocol') not in ('http', 'https'):
+        return None
+    return info_dict
 
 # Legacy function for backward compatibility
 def download_youtube_video(youtube_url):
@@ -1160,51 +1355,14 @@ def generate_image_from_keyframe(keyframe_path, prompt, style, session_id):
     Tạo ảnh mới từ khung hình đã trích xuất sử dụng Gemini 2.0 Flash Experimental
     """
     try:
-        # Kiểm tra rate limit
-        if not check_rate_limit():
-            raise Exception("Gemini API rate limit exceeded. Please try again later.")
+        # Rate limit đã được kiểm tra ở endpoint /generate-image (mỗi request chỉ tính một lượt)
         
      # Tạo thư mục cho ảnh được tạo ra nếu chưa tồn tại
         gen_session_folder = os.path.join(GENERATED_IMAGES_FOLDER, session_id)
         os.makedirs(gen_session_folder, exist_ok=True)
         
-        # Đọc ảnh gốc
-        with open(os.path.join('static', keyframe_path), "rb") as img_file:
-            image_data = img_file.read()
-        
-        # Chuẩn bị tham số cho Gemini
-        generation_config = {
-            "temperature": 0.9,
-            "top_p": 0.95,
-            "top_k": 40,
-            "max_output_tokens": 2048,
-        }
-        
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            }
-        ]
-        
-        # Tạo mô hình Gemini
-        model = genai.GenerativeModel(
-            model_name='gemini-1.5-flash',
-            generation_config=generation_config,
-            safety_settings=safety_settings
-        )
+        # Đọc ảnh gốc (đã thu nhỏ và nén lại để gửi lên Gemini)
+        image_data = gemini_images.inline_data(os.path.join('static', keyframe_path))
         
         # Thêm style vào prompt
         full_prompt = f"{prompt}. Style: {style}."
@@ -1215,18 +1373,14 @@ def generate_image_from_keyframe(keyframe_path, prompt, style, session_id):
                 "role": "user",
                 "parts": [
                     {"text": full_prompt},
-                    {
-                        "inline_data": {
-                            "mime_type": "image/jpeg",
-                            "data": base64.b64encode(image_data).decode('utf-8')
-                        }
-                    }
+                    {"inline_data": image_data}
                 ]
             }
         ]
         
         # Gọi API Gemini để tạo ảnh
-        response = model.generate_content(contents, stream=False)
+        response = gemini_client.generate(contents, label='generate_image', generation_config=gemini_generation_config(),
+                                          safety_settings=DEFAULT_SAFETY_SETTINGS, stream=False)
         
         # Xử lý phản hồi để lấy ảnh
         generated_images = []
@@ -1281,193 +1435,99 @@ def upload_file():
     # Lấy lựa chọn trích xuất âm thanh
     extract_audio = request.form.get('extract_audio', 'false') == 'true'
     
-    # Lấy ngưỡng transition
-    transition_threshold = request.form.get('transition_threshold', 0.4, type=float)
-    
-    # Khởi tạo biến filename và file_path
-    filename = None
-    file_path = None
-    
-    # Kiểm tra nếu có URL video (YouTube hoặc TikTok)
-    video_url = request.form.get('video_url', '')
-    if not video_url:
-        # Compatibility with old code - check for youtube_url
-        video_url = request.form.get('youtube_url', '')
-    
-    if video_url:
-        try:
-            # Tải video từ URL - không cần validate URL nghiêm ngặt
-            video_info = download_video_from_url(video_url)
-            file_path = video_info['path']
-            filename = video_info['filename']
-            
-            # Ghi log
-            logging.info(f"Đã tải video {video_info['source']}: {video_info['title']}")
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
-    else:
-        # Xử lý upload file trực tiếp
-        if 'video' not in request.files:
-            return jsonify({'error': 'Không tìm thấy video'}), 400
-            
-        file = request.files['video']
-        
-        if file.filename == '':
-            return jsonify({'error': 'Không có file nào được chọn'}), 400
-            
-        if not allowed_file(file.filename):
-            return jsonify({'error': 'Định dạng file không được hỗ trợ'}), 400
-            
-        # Lưu file tạm thời
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-
-    # Kiểm tra xem file_path và filename đã được thiết lập chưa
-    if not file_path or not filename:
-        return jsonify({'error': 'Không thể xử lý file hoặc URL'}), 400
-
-    # Trích xuất khung hình theo phương pháp được chọn
-    try:
-        if method == 'method1':
-            # Frame difference method
-            result = extract_keyframes_method1(file_path, threshold, max_frames)
-        elif method == 'method2':
-            # Transition detection method
-            result = extract_keyframes_with_transition_detection(file_path, threshold, max_frames, transition_threshold)
-        else:
-            # Default to method1 if invalid method is specified
-            result = extract_keyframes_method1(file_path, threshold, max_frames)
-        
-        # Thêm tên file vào kết quả
-        result['filename'] = filename
-        
-        # Nếu là video từ URL, thêm thông tin
-        if video_url:
-            result['video_url'] = video_url
-            if 'video_info' in locals() and 'title' in video_info:
-                result['video_title'] = video_info['title']
-                result['video_source'] = video_info['source']
-        
-        # Lưu dữ liệu keyframes vào biến toàn cục
-        global keyframesData
-        keyframesData = result.get('keyframes', [])
-        
-        # Trích xuất và phiên âm nếu được yêu cầu
-        if extract_audio:
-            try:
-                # Trích xuất âm thanh
-                audio_result = extract_audio_from_video(file_path)
-                result['audio'] = audio_result
-                
-                # Phiên âm
-                transcript_result = transcribe_audio(audio_result['path'], result['session_id'])
-                result['transcript'] = transcript_result
-            except Exception as audio_error:
-                logging.error(f"Lỗi khi xử lý âm thanh: {str(audio_error)}")
-                result['audio_error'] = str(audio_error)
-        
-        return jsonify(result)
-    except Exception as e:
-        logging.error(f"Lỗi khi xử lý video: {str(e)}")
-        return jsonify({'error': str(e)}), 500
-
-@app.route('/upload-method1', methods=['POST'])
-def upload_file_method1():
-    # Trích xuất các thông số
-    threshold = request.form.get('threshold', 30, type=int)
-    max_frames = request.form.get('max_frames', 20, type=int)
-    
-    # Lấy lựa chọn trích xuất âm thanh
-    extract_audio = request.form.get('extract_audio', 'false') == 'true'
-    
-    # Khởi tạo biến filename và file_path
-    filename = None
-    file_path = None
-    
-    # Kiểm tra nếu có URL video (YouTube hoặc TikTok)
-    video_url = request.form.get('video_url', '')
-    if not video_url:
-        # Compatibility with old code - check for youtube_url
-        video_url = request.form.get('youtube_url', '')
-    
-    if video_url:
-        try:
-            # Tải video từ URL - không cần validate URL nghiêm ngặt
-            video_info = download_video_from_url(video_url)
-            file_path = video_info['path']
-            filename = video_info['filename']
-            
-            # Ghi log
-            logging.info(f"Đã tải video {video_info['source']}: {video_info['title']}")
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
-    else:
-        # Xử lý upload file trực tiếp
-        if 'video' not in request.files:
-            return jsonify({'error': 'Không tìm thấy video'}), 400
-            
-        file = request.files['video']
-        
-        if file.filename == '':
-            return jsonify({'error': 'Không có file nào được chọn'}), 400
-            
-        if not allowed_file(file.filename):
-            return jsonify({'error': 'Định dạng file không được hỗ trợ'}), 400
-            
-        # Lưu file tạm thời
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-
-    # Kiểm tra xem file_path và filename đã được thiết lập chưa
-    if not file_path or not filename:
-        return jsonify({'error': 'Không thể xử lý file hoặc URL'}), 400
+    # Lấy ngưỡng transition
+    transition_threshold = request.form.get('transition_threshold', 0.4, type=float)
+    
+    # Lấy chế độ lấy mẫu khung hình
+    sampling_mode = request.form.get('sampling_mode', 'auto')
+    if sampling_mode not in SAMPLING_MODES:
+        return jsonify({'error': f"sampling_mode phải là một trong {', '.join(SAMPLING_MODES)}"}), 400
+    
+    # Số tiến trình trích xuất song song
+    workers = get_extraction_workers(request.form)
+    
+    # Độ phân giải dùng để phân tích khung hình
+    analysis_width = get_analysis_width(request.form)
+    
+    # Bộ giải mã khung hình (opencv hoặc ffmpeg)
+    decoder = get_frame_decoder(request.form)
+    if decoder is None:
+        return jsonify({'error': f"decoder phải là một trong {', '.join(FRAME_DECODERS)}"}), 400
+    
+    # Định dạng, chất lượng và kích thước tối đa của ảnh khung hình lưu ra
+    output = get_output_profile(request.form)
+    if output is None:
+        return jsonify({'error': f"output_format phải là một trong {', '.join(supported_output_formats())}, "
+                                 f"output_quality từ 1 đến 100 và output_max_dimension >= 0"}), 400
+    
+    # Danh sách phương pháp chạy chung một lượt giải mã (vd: "frame_difference,scene_detection")
+    methods = list(dict.fromkeys(m.strip() for m in request.form.get('methods', '').split(',') if m.strip()))
+    invalid_methods = [m for m in methods if m not in DETECTOR_CLASSES]
+    if invalid_methods:
+        return jsonify({'error': f"methods chỉ chấp nhận: {', '.join(DETECTOR_CLASSES)}"}), 400
+    
+    # Nhiều phương pháp trong một lượt giải mã, phương pháp đầu tiên là kết quả chính
+    if methods:
+        extract = functools.partial(extract_keyframes_primary, methods=methods, threshold=threshold,
+                                    max_frames=max_frames, min_scene_length=min_scene_length,
+                                    transition_threshold=transition_threshold, sampling_mode=sampling_mode,
+                                    workers=workers, analysis_width=analysis_width, decoder=decoder, output=output)
+    elif method == 'method2':
+        # Transition detection method
+        extract = functools.partial(extract_keyframes_with_transition_detection, threshold=threshold,
+                                    max_frames=max_frames, transition_threshold=transition_threshold,
+                                    sampling_mode=sampling_mode, workers=workers, analysis_width=analysis_width,
+                                    decoder=decoder, output=output)
+    else:
+        # Frame difference method (mặc định khi phương pháp không hợp lệ)
+        extract = functools.partial(extract_keyframes_method1, threshold=threshold, max_frames=max_frames,
+                                    sampling_mode=sampling_mode, workers=workers, analysis_width=analysis_width,
+                                    decoder=decoder, output=output)
+    
+    return submit_extraction_job('upload', extract, extract_audio)
 
-    # Trích xuất khung hình theo phương pháp 1
-    try:
-        # Frame difference method - removed detect_duplicates and duplicate_threshold
-        result = extract_keyframes_method1(file_path, threshold, max_frames)
-        
-        # Thêm tên file vào kết quả
-        result['filename'] = filename
-        
-        # Nếu là video từ URL, thêm thông tin
-        if video_url:
-            result['video_url'] = video_url
-            if 'video_info' in locals() and 'title' in video_info:
-                result['video_title'] = video_info['title']
-                result['video_source'] = video_info['source']
-        
-        # Lưu dữ liệu keyframes vào biến toàn cục
-        global keyframesData
-        keyframesData = result.get('keyframes', [])
-        
-        # Trích xuất và phiên âm nếu được yêu cầu
-        if extract_audio:
-            try:
-                # Trích xuất âm thanh
-                audio_result = extract_audio_from_video(file_path)
-                result['audio'] = audio_result
-                
-                # Phiên âm
-                transcript_result = transcribe_audio(audio_result['path'], result['session_id'])
-                result['transcript'] = transcript_result
-            except Exception as audio_error:
-                logging.error(f"Lỗi khi xử lý âm thanh: {str(audio_error)}")
-                result['audio_error'] = str(audio_error)
-        
-        return jsonify(result)
-    except Exception as e:
-        logging.error(f"Lỗi khi xử lý video: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+@app.route('/upload-method1', methods=['POST'])
+def upload_file_method1():
+    # Trích xuất các thông số
+    threshold = request.form.get('threshold', 30, type=int)
+    max_frames = request.form.get('max_frames', 20, type=int)
+    
+    # Lấy lựa chọn trích xuất âm thanh
+    extract_audio = request.form.get('extract_audio', 'false') == 'true'
+    
+    # Lấy chế độ lấy mẫu khung hình
+    sampling_mode = request.form.get('sampling_mode', 'auto')
+    if sampling_mode not in SAMPLING_MODES:
+        return jsonify({'error': f"sampling_mode phải là một trong {', '.join(SAMPLING_MODES)}"}), 400
+    
+    # Số tiến trình trích xuất song song
+    workers = get_extraction_workers(request.form)
+    
+    # Độ phân giải dùng để phân tích khung hình
+    analysis_width = get_analysis_width(request.form)
+    
+    # Bộ giải mã khung hình (opencv hoặc ffmpeg)
+    decoder = get_frame_decoder(request.form)
+    if decoder is None:
+        return jsonify({'error': f"decoder phải là một trong {', '.join(FRAME_DECODERS)}"}), 400
+    
+    # Định dạng, chất lượng và kích thước tối đa của ảnh khung hình lưu ra
+    output = get_output_profile(request.form)
+    if output is None:
+        return jsonify({'error': f"output_format phải là một trong {', '.join(supported_output_formats())}, "
+                                 f"output_quality từ 1 đến 100 và output_max_dimension >= 0"}), 400
+    
+    # Trích xuất khung hình theo phương pháp 1 (frame difference)
+    extract = functools.partial(extract_keyframes_method1, threshold=threshold, max_frames=max_frames,
+                                sampling_mode=sampling_mode, workers=workers, analysis_width=analysis_width,
+                                decoder=decoder, output=output)
+    return submit_extraction_job('upload-method1', extract, extract_audio)
 
 @app.route('/upload-method2', methods=['POST'])
 def upload_file_method2():
     # Trích xuất các thông số
     threshold = request.form.get('threshold', 30, type=int)
     max_frames = request.form.get('max_frames', 20, type=int)
-    min_scene_length = request.form.get('min_scene_length', 15, type=int)
     
     # Lấy lựa chọn trích xuất âm thanh
     extract_audio = request.form.get('extract_audio', 'false') == 'true'
@@ -1475,86 +1535,28 @@ def upload_file_method2():
     # Lấy ngưỡng transition
     transition_threshold = request.form.get('transition_threshold', 0.4, type=float)
     
-    # Khởi tạo biến filename và file_path
-    filename = None
-    file_path = None
+    # Số tiến trình trích xuất song song
+    workers = get_extraction_workers(request.form)
     
-    # Kiểm tra nếu có URL video (YouTube hoặc TikTok)
-    video_url = request.form.get('video_url', '')
-    if not video_url:
-        # Compatibility with old code - check for youtube_url
-        video_url = request.form.get('youtube_url', '')
+    # Độ phân giải dùng để phân tích khung hình
+    analysis_width = get_analysis_width(request.form)
     
-    if video_url:
-        try:
-            # Tải video từ URL - không cần validate URL nghiêm ngặt
-            video_info = download_video_from_url(video_url)
-            file_path = video_info['path']
-            filename = video_info['filename']
-            
-            # Ghi log
-            logging.info(f"Đã tải video {video_info['source']}: {video_info['title']}")
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
-    else:
-        # Xử lý upload file trực tiếp
-        if 'video' not in request.files:
-            return jsonify({'error': 'Không tìm thấy video'}), 400
-            
-        file = request.files['video']
-        
-        if file.filename == '':
-            return jsonify({'error': 'Không có file nào được chọn'}), 400
-            
-        if not allowed_file(file.filename):
-            return jsonify({'error': 'Định dạng file không được hỗ trợ'}), 400
-            
-        # Lưu file tạm thời
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-
-    # Kiểm tra xem file_path và filename đã được thiết lập chưa
-    if not file_path or not filename:
-        return jsonify({'error': 'Không thể xử lý file hoặc URL'}), 400
-
-    # Trích xuất khung hình theo phương pháp 2
-    try:
-        # Transition detection method - removed detect_duplicates and duplicate_threshold
-        result = extract_keyframes_with_transition_detection(file_path, threshold, max_frames, transition_threshold=transition_threshold)
-        
-        # Thêm tên file vào kết quả
-        result['filename'] = filename
-        
-        # Nếu là video từ URL, thêm thông tin
-        if video_url:
-            result['video_url'] = video_url
-            if 'video_info' in locals() and 'title' in video_info:
-                result['video_title'] = video_info['title']
-                result['video_source'] = video_info['source']
-        
-        # Lưu dữ liệu keyframes vào biến toàn cục
-        global keyframesData
-        keyframesData = result.get('keyframes', [])
-        
-        # Trích xuất và phiên âm nếu được yêu cầu
-        if extract_audio:
-            try:
-                # Trích xuất âm thanh
-                audio_result = extract_audio_from_video(file_path)
-                result['audio'] = audio_result
-                
-                # Phiên âm
-                transcript_result = transcribe_audio(audio_result['path'], result['session_id'])
-                result['transcript'] = transcript_result
-            except Exception as audio_error:
-                logging.error(f"Lỗi khi xử lý âm thanh: {str(audio_error)}")
-                result['audio_error'] = str(audio_error)
-        
-        return jsonify(result)
-    except Exception as e:
-        logging.error(f"Lỗi khi xử lý video: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+    # Bộ giải mã khung hình (opencv hoặc ffmpeg)
+    decoder = get_frame_decoder(request.form)
+    if decoder is None:
+        return jsonify({'error': f"decoder phải là một trong {', '.join(FRAME_DECODERS)}"}), 400
+    
+    # Định dạng, chất lượng và kích thước tối đa của ảnh khung hình lưu ra
+    output = get_output_profile(request.form)
+    if output is None:
+        return jsonify({'error': f"output_format phải là một trong {', '.join(supported_output_formats())}, "
+                                 f"output_quality từ 1 đến 100 và output_max_dimension >= 0"}), 400
+    
+    # Trích xuất khung hình theo phương pháp 2 (transition detection)
+    extract = functools.partial(extract_keyframes_with_transition_detection, threshold=threshold,
+                                max_frames=max_frames, transition_threshold=transition_threshold,
+                                workers=workers, analysis_width=analysis_width, decoder=decoder, output=output)
+    return submit_extraction_job('upload-method2', extract, extract_audio)
 
 @app.route('/extract-keyframes-advanced', methods=['POST'])
 def extract_keyframes_advanced():
@@ -1565,97 +1567,71 @@ def extract_keyframes_advanced():
     
     # Lấy các tùy chọn trích xuất
     extract_audio = request.form.get('extract_audio', 'false') == 'true'
-    detect_duplicates = request.form.get('detect_duplicates', 'true') == 'true'
     
-    # Lấy các ngưỡng
-    duplicate_threshold = request.form.get('duplicate_threshold', 0.85, type=float)
+    # Lấy ngưỡng transition
     transition_threshold = request.form.get('transition_threshold', 0.4, type=float)
     
-    # Khởi tạo biến filename và file_path
-    filename = None
-    file_path = None
+    # Độ phân giải dùng để phân tích khung hình
+    analysis_width = get_analysis_width(request.form)
     
-    # Kiểm tra nếu có URL video (YouTube hoặc TikTok)
-    video_url = request.form.get('video_url', '')
-    if not video_url:
-        # Compatibility with old code - check for youtube_url
-        video_url = request.form.get('youtube_url', '')
+    # Bộ giải mã khung hình (opencv hoặc ffmpeg)
+    decoder = get_frame_decoder(request.form)
+    if decoder is None:
+        return jsonify({'error': f"decoder phải là một trong {', '.join(FRAME_DECODERS)}"}), 400
+    
+    # Định dạng, chất lượng và kích thước tối đa của ảnh khung hình lưu ra
+    output = get_output_profile(request.form)
+    if output is None:
+        return jsonify({'error': f"output_format phải là một trong {', '.join(supported_output_formats())}, "
+                                 f"output_quality từ 1 đến 100 và output_max_dimension >= 0"}), 400
     
-    if video_url:
-        try:
-            # Tải video từ URL
-            video_info = download_video_from_url(video_url)
-            file_path = video_info['path']
-            filename = video_info['filename']
-            
-            # Ghi log
-            logging.info(f"Đã tải video {video_info['source']}: {video_info['title']}")
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
-    else:
-        # Xử lý upload file trực tiếp
-        if 'video' not in request.files:
-            return jsonify({'error': 'Không tìm thấy video'}), 400
-            
-        file = request.files['video']
-        
-        if file.filename == '':
-            return jsonify({'error': 'Không có file nào được chọn'}), 400
-            
-        if not allowed_file(file.filename):
-            return jsonify({'error': 'Định dạng file không được hỗ trợ'}), 400
-            
-        # Lưu file tạm thời
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-
-    # Kiểm tra xem file_path và filename đã được thiết lập chưa
-    if not file_path or not filename:
-        return jsonify({'error': 'Không thể xử lý file hoặc URL'}), 400
-
     # Trích xuất khung hình với phát hiện transition
+    extract = functools.partial(extract_keyframes_with_transition_detection, threshold=threshold,
+                                max_frames=max_frames, transition_threshold=transition_threshold,
+                                analysis_width=analysis_width, decoder=decoder, output=output)
+    return submit_extraction_job('extract-keyframes-advanced', extract, extract_audio)
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """API endpoint trả về trạng thái, tiến độ theo giai đoạn và kết quả của một job"""
+    status = job_queue.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Không tìm thấy job'}), 404
+    return jsonify(status)
+
+@app.route('/gemini-metrics', methods=['GET'])
+def gemini_metrics():
+    """API endpoint trả về thống kê lời gọi Gemini (số lần gọi, lỗi, thử lại, độ trễ) của tiến trình hiện tại"""
+    return jsonify(gemini_client.metrics())
+
+@app.route('/reselect-keyframes', methods=['POST'])
+def reselect_keyframes_endpoint():
+    """API endpoint chọn lại keyframes của phiên với threshold/max_frames mới mà không xử lý lại video"""
     try:
-        result = extract_keyframes_with_transition_detection(
-            file_path, 
-            threshold, 
-            max_frames, 
-            detect_duplicates, 
-            duplicate_threshold,
-            transition_threshold
-        )
-        
-        # Thêm tên file vào kết quả
-        result['filename'] = filename
+        data = request.json or {}
+        session_id = data.get('session_id')
+        if not session_id:
+            return jsonify({'error': 'Thiếu session_id'}), 400
         
-        # Nếu là video từ URL, thêm thông tin
-        if video_url:
-            result['video_url'] = video_url
-            if 'video_info' in locals() and 'title' in video_info:
-                result['video_title'] = video_info['title']
-                result['video_source'] = video_info['source']
+        overrides = {}
+        for name, cast in RESELECT_PARAMS.items():
+            if data.get(name) is not None:
+                try:
+                    overrides[name] = cast(data[name])
+                except (TypeError, ValueError):
+                    return jsonify({'error': f"{name} không hợp lệ"}), 400
         
-        # Lưu dữ liệu keyframes vào biến toàn cục
-        global keyframesData
-        keyframesData = result.get('keyframes', [])
+        try:
+            result = reselect_keyframes(secure_filename(session_id), overrides)
+        except FileNotFoundError:
+            return jsonify({'error': 'Phiên không có chỉ số khung hình, vui lòng xử lý lại video'}), 404
         
-        # Trích xuất và phiên âm nếu được yêu cầu
-        if extract_audio:
-            try:
-                # Trích xuất âm thanh
-                audio_result = extract_audio_from_video(file_path)
-                result['audio'] = audio_result
-                
-                # Phiên âm
-                transcript_result = transcribe_audio(audio_result['path'], result['session_id'])
-                result['transcript'] = transcript_result
-            except Exception as audio_error:
-                logging.error(f"Lỗi khi xử lý âm thanh: {str(audio_error)}")
-                result['audio_error'] = str(audio_error)
+        # Lưu keyframes của phiên mới
+        keyframe_store.set(result['session_id'], result.get('keyframes', []))
         
         return jsonify(result)
     except Exception as e:
-        logging.error(f"Lỗi khi xử lý video: {str(e)}")
+        logging.error(f"Lỗi khi chọn lại keyframes: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/delete-keyframe', methods=['POST'])
@@ -1678,12 +1654,11 @@ def delete_keyframe():
             return jsonify({'error': 'Không tìm thấy file ảnh'}), 404
         
         # Xóa file
-        os.remove(full_path)
+        remove_keyframe_image(full_path)
         logging.info(f"Đã xóa khung hình: {frame_path}")
         
-        # Cập nhật keyframesData
-        global keyframesData
-        keyframesData = [frame for frame in keyframesData if frame.get('id') != frame_id]
+        # Cập nhật keyframes của phiên
+        keyframe_store.session(session_id).remove_many([frame_id])
         
         return jsonify({
             'success': True,
@@ -1724,13 +1699,12 @@ def remove_duplicates():
             # Kiểm tra nếu file tồn tại
             if os.path.exists(full_path):
                 # Xóa file
-                os.remove(full_path)
+                remove_keyframe_image(full_path)
                 deleted_frames.append(frame_id)
                 logging.info(f"Đã xóa khung hình trùng lặp: {frame_path}")
-                
-                # Cập nhật keyframesData
-                global keyframesData
-                keyframesData = [f for f in keyframesData if f.get('id') != frame_id]
+        
+        # Cập nhật keyframes của phiên một lần cho tất cả khung hình đã xóa
+        keyframe_store.session(session_id).remove_many(deleted_frames)
         
         return jsonify({
             'success': True,
@@ -1743,6 +1717,22 @@ def remove_duplicates():
 
 
 
+def get_session_frame_files(session_id, keyframes_path):
+    """
+    Tên file các khung hình của phiên theo thứ tự trong video
+
+    Dùng manifest của phiên (sắp theo frame_number); phiên cũ chưa có manifest thì
+    liệt kê thư mục và sắp theo số trong tên file.
+    """
+    session = keyframe_store.get(session_id)
+    if session is not None:
+        keyframes = sorted(session.list(), key=lambda frame: frame.get('frame_number', 0))
+        files = [os.path.basename(frame['path']) for frame in keyframes]
+        return [f for f in dict.fromkeys(files) if os.path.isfile(os.path.join(keyframes_path, f))]
+    
+    return sorted([f for f in os.listdir(keyframes_path) if os.path.isfile(os.path.join(keyframes_path, f))],
+                  key=lambda x: int(x.split('_')[1].split('.')[0]) if '_' in x else 0)
+
 @app.route('/generate-script', methods=['POST'])
 def generate_script():
     """API endpoint để trích xuất kịch bản từ các khung hình"""
@@ -1770,8 +1760,7 @@ def generate_script():
                 return jsonify({'error': 'Không tìm thấy thư mục khung hình'}), 404
                 
             # Lấy danh sách các file khung hình, sắp xếp theo thứ tự
-            files = sorted([f for f in os.listdir(keyframes_path) if os.path.isfile(os.path.join(keyframes_path, f))],
-                          key=lambda x: int(x.split('_')[1].split('.')[0]) if '_' in x else 0)
+            files = get_session_frame_files(session_id, keyframes_path)
             
             if not files:
                 return jsonify({'error': 'Không có khung hình nào được tìm thấy'}), 404
@@ -1791,56 +1780,19 @@ def generate_script():
                 prompt += f"\n\nĐây là phiên âm từ audio của video, hãy sử dụng để bổ sung cho phân tích của bạn: {transcript}"
             
             # Kiểm tra rate limit
-            if not check_rate_limit():
+            if not check_rate_limit(PRIORITY_INTERACTIVE):
                 return jsonify({'error': 'Gemini API rate limit exceeded. Please try again later.'}), 429
             
             # Cấu hình model Gemini
-            generation_config = {
-                "temperature": temperature,
-                "top_p": 0.95,
-                "top_k": 40,
-                "max_output_tokens": 2048,
-            }
-            
-            safety_settings = [
-                {
-                    "category": "HARM_CATEGORY_HARASSMENT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_HATE_SPEECH",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                }
-            ]
-            
-            model = genai.GenerativeModel(
-                model_name='gemini-1.5-flash',
-                generation_config=generation_config,
-                safety_settings=safety_settings
-            )
+            script_config = gemini_generation_config(temperature=temperature)
             
             # Chuẩn bị danh sách hình ảnh để gửi đến Gemini
             image_parts = []
             for file in files[:10]:  # Giới hạn số lượng hình ảnh
                 file_path = os.path.join(keyframes_path, file)
                 
-                # Đọc và mã hóa hình ảnh
-                with open(file_path, "rb") as img_file:
-                    image_data = img_file.read()
-                
-                # Thêm hình ảnh vào danh sách
-                image_parts.append({
-                    "mime_type": "image/jpeg",
-                    "data": base64.b64encode(image_data).decode('utf-8')
-                })
+                # Đọc, thu nhỏ và mã hóa hình ảnh, thêm vào danh sách
+                image_parts.append(gemini_images.inline_data(file_path))
             
             # Tạo nội dung cho request
             contents = [
@@ -1858,7 +1810,8 @@ def generate_script():
             
             # Gọi API Gemini
             try:
-                response = model.generate_content(contents)
+                response = gemini_client.generate(contents, label='generate_script', generation_config=script_config,
+                                                  safety_settings=DEFAULT_SAFETY_SETTINGS)
                 
                 # Trả về kết quả
                 return jsonify({
@@ -1887,41 +1840,11 @@ def generate_script():
                 prompt += f"\n\nĐây là phiên âm từ audio của video, hãy sử dụng để bổ sung cho phân tích của bạn: {transcript_text}"
             
             # Kiểm tra rate limit
-            if not check_rate_limit():
+            if not check_rate_limit(PRIORITY_INTERACTIVE):
                 return jsonify({'error': 'Gemini API rate limit exceeded. Please try again later.'}), 429
             
             # Cấu hình model Gemini
-            generation_config = {
-                "temperature": temperature,
-                "top_p": 0.95,
-                "top_k": 40,
-                "max_output_tokens": 2048,
-            }
-            
-            safety_settings = [
-                {
-                    "category": "HARM_CATEGORY_HARASSMENT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_HATE_SPEECH",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                }
-            ]
-            
-            model = genai.GenerativeModel(
-                model_name='gemini-1.5-flash',
-                generation_config=generation_config,
-                safety_settings=safety_settings
-            )
+            script_config = gemini_generation_config(temperature=temperature)
             
             # Chuẩn bị danh sách hình ảnh để gửi đến Gemini
             contents = [
@@ -1960,15 +1883,9 @@ def generate_script():
                         if os.path.exists(file_path):
                             # Đọc và mã hóa hình ảnh
                             try:
-                                with open(file_path, "rb") as img_file:
-                                    image_data = img_file.read()
-                                
-                                # Thêm hình ảnh vào request
+                                # Thêm hình ảnh (đã thu nhỏ và nén lại) vào request
                                 contents[0]["parts"].append({
-                                    "inline_data": {
-                                        "mime_type": "image/jpeg",
-                                        "data": base64.b64encode(image_data).decode('utf-8')
-                                    }
+                                    "inline_data": gemini_images.inline_data(file_path)
                                 })
                             except Exception as img_error:
                                 logging.error(f"Error processing image {file_path}: {str(img_error)}")
@@ -1977,7 +1894,8 @@ def generate_script():
             
             # Gọi API Gemini
             try:
-                response = model.generate_content(contents)
+                response = gemini_client.generate(contents, label='generate_script', generation_config=script_config,
+                                                  safety_settings=DEFAULT_SAFETY_SETTINGS)
                 
                 # Trả về kết quả
                 return jsonify({
@@ -2014,7 +1932,7 @@ def generate_image():
             return jsonify({'error': 'Thiếu thông tin cần thiết'}), 400
         
         # Kiểm tra rate limit
-        if not check_rate_limit():
+        if not check_rate_limit(PRIORITY_INTERACTIVE):
             return jsonify({'error': 'Gemini API rate limit exceeded. Please try again later.'}), 429
         
         # Gọi hàm tạo ảnh
@@ -2042,6 +1960,66 @@ def download_keyframes(session_id):
     
     return jsonify({'files': file_paths})
 
+# Thư mục được phép tải xuống qua /download-zip (ảnh khung hình và ảnh đã tạo)
+ZIP_DOWNLOAD_FOLDERS = (KEYFRAMES_FOLDER, GENERATED_IMAGES_FOLDER)
+
+def zip_response(entries, filename):
+    """Phản hồi ZIP được tạo dần từ các file trên đĩa và gửi theo từng đoạn (chunked)"""
+    return Response(stream_with_context(stream_zip(entries)), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/download-zip/<session_id>', methods=['GET'])
+def download_keyframes_zip(session_id):
+    """
+    Tải xuống keyframes của phiên dạng ZIP theo thứ tự trong video
+
+    Ảnh được đọc thẳng từ đĩa và lưu nguyên trong ZIP (không nén lại).
+    include_transcript=true thêm phiên âm, include_manifest=true thêm metadata keyframes (JSON).
+    """
+    keyframes_path = os.path.join(KEYFRAMES_FOLDER, session_id)
+    if os.path.basename(session_id) != session_id or not os.path.isdir(keyframes_path):
+        return jsonify({'error': 'Không tìm thấy phiên trích xuất'}), 404
+    
+    files = get_session_frame_files(session_id, keyframes_path)
+    if not files:
+        return jsonify({'error': 'Không có khung hình nào để tải xuống'}), 404
+    
+    # Đánh số thứ tự để ảnh được sắp đúng thứ tự khi giải nén
+    entries = [(f"images/{index:03d}_{filename}", os.path.join(keyframes_path, filename))
+               for index, filename in enumerate(files, 1)]
+    
+    if request.args.get('include_transcript', 'false') == 'true':
+        entries.append(('transcript.txt', os.path.join(TRANSCRIPTS_FOLDER, session_id, f"{session_id}_transcript.txt")))
+    
+    if request.args.get('include_manifest', 'false') == 'true':
+        manifest = {'session_id': session_id, 'keyframes': keyframe_store.session(session_id).list()}
+        entries.append(('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')))
+    
+    return zip_response(entries, f"keyframes-{session_id}.zip")
+
+@app.route('/download-zip', methods=['POST'])
+def download_images_zip():
+    """
+    Tải xuống các ảnh đã chọn (trường paths, đường dẫn dạng uploads/...) dạng ZIP
+
+    Chỉ chấp nhận ảnh trong ZIP_DOWNLOAD_FOLDERS; filename là tên file ZIP.
+    """
+    paths = request.form.getlist('paths')
+    allowed_folders = [os.path.realpath(folder) + os.sep for folder in ZIP_DOWNLOAD_FOLDERS]
+    
+    entries = []
+    for path in paths:
+        full_path = os.path.realpath(os.path.join('static', path))
+        if not any(full_path.startswith(folder) for folder in allowed_folders) or not os.path.isfile(full_path):
+            return jsonify({'error': f"Không tìm thấy ảnh: {path}"}), 404
+        entries.append((f"images/{len(entries) + 1:03d}_{os.path.basename(full_path)}", full_path))
+    
+    if not entries:
+        return jsonify({'error': 'Không có ảnh nào để tải xuống'}), 400
+    
+    filename = secure_filename(request.form.get('filename', '')) or 'images.zip'
+    return zip_response(entries, filename)
+
 @app.route('/download-transcript/<session_id>', methods=['GET'])
 def download_transcript(session_id):
     """API endpoint để tải xuống phiên âm"""
@@ -2078,9 +2056,9 @@ def analyze_frame_differences():
         if not os.path.exists(keyframes_path):
             return jsonify({'error': 'Không tìm thấy thư mục khung hình'}), 404
             
-        # Lấy dữ liệu keyframes hiện tại
-        global keyframesData
-        current_keyframes = keyframesData.copy()
+        # Lấy dữ liệu keyframes hiện tại của phiên
+        session_keyframes = keyframe_store.session(session_id)
+        current_keyframes = session_keyframes.list()
         
         # Chuẩn bị danh sách khung hình cho phân tích
         frames_to_analyze = []
@@ -2090,7 +2068,8 @@ def analyze_frame_differences():
                 frames_to_analyze.append({
                     'id': frame['id'],
                     'path': frame['path'],
-                    'full_path': full_path
+                    'full_path': full_path,
+                    'phash': frame.get('phash')
                 })
         
         # Phân tích độ khác biệt giữa các khung hình
@@ -2100,8 +2079,7 @@ def analyze_frame_differences():
         frame_hashes = []
         for frame in frames_to_analyze:
             try:
-                img = Image.open(frame['full_path'])
-                hash_value = imagehash.phash(img)
+                hash_value = get_keyframe_phash(frame['path'], frame)
                 frame_hashes.append({
                     'id': frame['id'],
                     'path': frame['path'],
@@ -2110,36 +2088,40 @@ def analyze_frame_differences():
             except Exception as e:
                 logging.error(f"Error processing {frame['path']}: {str(e)}")
         
-        # So sánh từng cặp khung hình
-        for i in range(len(frame_hashes)):
-            for j in range(i+1, len(frame_hashes)):
-                # Tính khoảng cách giữa các hash
-                hash_dist = frame_hashes[i]['hash'] - frame_hashes[j]['hash']
-                
-                # Chuyển đổi khoảng cách hash thành độ tương đồng (0-1)
-                similarity = 1 - (hash_dist / 64)
-                
-                # Nếu độ tương đồng cao (độ khác biệt thấp), đánh dấu khung hình j là tương tự khung hình i
-                if similarity > (1 - difference_threshold):
-                    similar_frames.append({
-                        'id': frame_hashes[j]['id'],
-                        'path': frame_hashes[j]['path'],
-                        'similarity': similarity,
-                        'similar_to': frame_hashes[i]['path']
-                    })
+        # So sánh từng cặp khung hình: chỉ lấy các cặp có khoảng cách hash đủ nhỏ rồi lọc lại chính xác
+        max_distance = min(HASH_BITS, int(np.ceil(HASH_BITS * float(difference_threshold))))
+        packed_hashes = pack_hashes(frame['hash'] for frame in frame_hashes)
+        for i, j, hash_dist in zip(*find_similar_pairs(packed_hashes, max_distance)):
+            # Chuyển đổi khoảng cách hash thành độ tương đồng (0-1)
+            similarity = 1 - (int(hash_dist) / 64)
+            
+            # Nếu độ tương đồng cao (độ khác biệt thấp), đánh dấu khung hình j là tương tự khung hình i
+            if similarity > (1 - difference_threshold):
+                similar_frames.append({
+                    'id': frame_hashes[j]['id'],
+                    'path': frame_hashes[j]['path'],
+                    'similarity': similarity,
+                    'similar_to': frame_hashes[i]['path']
+                })
+        
+        # Mỗi khung hình lấy cặp tương tự đầu tiên
+        similar_by_id = {}
+        for similar in similar_frames:
+            similar_by_id.setdefault(similar['id'], similar)
         
         # Cập nhật trạng thái của các khung hình
+        updates = {}
         for frame in current_keyframes:
             frame['is_similar'] = False
-            for similar in similar_frames:
-                if frame['id'] == similar['id']:
-                    frame['is_similar'] = True
-                    frame['similarity'] = similar['similarity']
-                    frame['similar_to'] = similar['similar_to']
-                    break
+            similar = similar_by_id.get(frame['id'])
+            if similar:
+                frame['is_similar'] = True
+                frame['similarity'] = similar['similarity']
+                frame['similar_to'] = similar['similar_to']
+            updates[frame['id']] = {key: frame[key] for key in ('is_similar', 'similarity', 'similar_to') if key in frame}
         
-        # Cập nhật keyframesData toàn cục
-        keyframesData = current_keyframes
+        # Lưu trạng thái vào keyframes của phiên
+        session_keyframes.update_many(updates)
         
         # Trả về kết quả
         return jsonify({
@@ -2181,13 +2163,12 @@ def remove_similar_frames():
             # Kiểm tra nếu file tồn tại
             if os.path.exists(full_path):
                 # Xóa file
-                os.remove(full_path)
+                remove_keyframe_image(full_path)
                 deleted_frames.append(frame_id)
                 logging.info(f"Đã xóa khung hình tương tự: {frame_path}")
-                
-                # Cập nhật keyframesData
-                global keyframesData
-                keyframesData = [f for f in keyframesData if f.get('id') != frame_id]
+        
+        # Cập nhật keyframes của phiên một lần cho tất cả khung hình đã xóa
+        keyframe_store.session(session_id).remove_many(deleted_frames)
         
         return jsonify({
             'success': True,
@@ -2200,6 +2181,61 @@ def remove_similar_frames():
         return jsonify({'error': str(e)}), 500
 
 
+# Prompt mẫu để Gemini viết prompt tạo ảnh tương tự một khung hình
+IMAGE_PROMPT_TEMPLATE = "Write an English prompt to create a similar image. Describe in detail the character's shape, features, color and background. Only return the best prompt, without any other words.."
+IMAGE_PROMPT_CONFIG = gemini_generation_config(max_output_tokens=4096)
+
+def generate_keyframe_prompt(keyframe_path, priority=PRIORITY_BULK, rate_limit_wait=GEMINI_RATE_MAX_WAIT,
+                             cancel=None):
+    """
+    Dùng Gemini viết prompt tạo ảnh tương tự khung hình keyframe_path (đường dẫn trong static/)
+
+    Phản hồi được lưu trong prompt_cache theo hash nội dung ảnh, prompt mẫu và cấu hình model,
+    nên bấm lại cho cùng một khung hình trả về ngay mà không tốn lượt gọi API.
+    Trả về (prompt, cached); FileNotFoundError nếu không có ảnh, RateLimitExceeded nếu
+    vẫn hết lượt sau rate_limit_wait giây, CancelledError nếu cancel (threading.Event) được đặt
+    trước khi có lượt gọi API.
+    """
+    full_path = os.path.join('static', keyframe_path)
+    if not os.path.exists(full_path):
+        raise FileNotFoundError(f"Không tìm thấy hình ảnh: {keyframe_path}")
+    
+    with open(full_path, "rb") as img_file:
+        image_data = img_file.read()
+    
+    cache_key = prompt_cache.key(image=hashlib.sha256(image_data).hexdigest(), prompt=IMAGE_PROMPT_TEMPLATE,
+                                 model=DEFAULT_GEMINI_MODEL, config=IMAGE_PROMPT_CONFIG,
+                                 safety=DEFAULT_SAFETY_SETTINGS, image_settings=gemini_images.settings)
+    cached_prompt = prompt_cache.get(cache_key)
+    if cached_prompt is not None:
+        return cached_prompt, True
+    
+    # Kiểm tra rate limit (gọi hàng loạt, nhường lượt cho các request tương tác)
+    if cancel is not None and cancel.is_set():
+        raise CancelledError()
+    if not check_rate_limit(priority, rate_limit_wait, cancel):
+        if cancel is not None and cancel.is_set():
+            raise CancelledError()
+        raise RateLimitExceeded("Gemini API rate limit exceeded. Please try again later.")
+    
+    # Tạo nội dung cho request
+    contents = [
+        {
+            "role": "user",
+            "parts": [
+                {"text": IMAGE_PROMPT_TEMPLATE},
+                {"inline_data": gemini_images.inline_data(full_path)}
+            ]
+        }
+    ]
+    
+    # Gọi API Gemini
+    response = gemini_client.generate(contents, label='generate_gemini_prompt', model_name=DEFAULT_GEMINI_MODEL,
+                                      generation_config=IMAGE_PROMPT_CONFIG, safety_settings=DEFAULT_SAFETY_SETTINGS,
+                                      cancel=cancel)
+    prompt_cache.put(cache_key, response.text)
+    return response.text, False
+
 @app.route('/generate-gemini-prompt', methods=['POST'])
 def generate_gemini_prompt():
     """API endpoint để tạo prompt từ hình ảnh sử dụng Gemini 2.0 Flash"""
@@ -2210,76 +2246,17 @@ def generate_gemini_prompt():
         if not keyframe_path:
             return jsonify({'error': 'Thiếu đường dẫn hình ảnh'}), 400
         
-        # Kiểm tra rate limit
-        if not check_rate_limit():
-            return jsonify({'error': 'Gemini API rate limit exceeded. Please try again later.'}), 429
-        
-        # Đọc hình ảnh
-        full_path = os.path.join('static', keyframe_path)
-        if not os.path.exists(full_path):
+        try:
+            prompt, cached = generate_keyframe_prompt(keyframe_path)
+        except FileNotFoundError:
             return jsonify({'error': 'Không tìm thấy hình ảnh'}), 404
-            
-        with open(full_path, "rb") as img_file:
-            image_data = img_file.read()
-        
-        # Cấu hình Gemini model
-        generation_config = {
-            "temperature": 0.9,
-            "top_p": 0.95,
-            "top_k": 40,
-            "max_output_tokens": 4096,
-        }
-        
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            }
-        ]
-        
-        model = genai.GenerativeModel(
-            model_name='gemini-1.5-flash',
-            generation_config=generation_config,
-            safety_settings=safety_settings
-        )
-        
-        # Prompt cho Gemini
-        prompt = "Write an English prompt to create a similar image. Describe in detail the character's shape, features, color and background. Only return the best prompt, without any other words.."
-        
-        # Tạo nội dung cho request
-        contents = [
-            {
-                "role": "user",
-                "parts": [
-                    {"text": prompt},
-                    {
-                        "inline_data": {
-                            "mime_type": "image/jpeg",
-                            "data": base64.b64encode(image_data).decode('utf-8')
-                        }
-                    }
-                ]
-            }
-        ]
-        
-        # Gọi API Gemini
-        response = model.generate_content(contents)
+        except RateLimitExceeded as e:
+            return jsonify({'error': str(e)}), 429
         
         return jsonify({
             'success': True,
-            'prompt': response.text
+            'prompt': prompt,
+            'cached': cached
         })
         
     except Exception as e:
@@ -2290,6 +2267,52 @@ def generate_gemini_prompt():
         }), 500
 
 
+def prompt_batch_results(keyframe_paths):
+    """Tạo prompt cho nhiều khung hình song song, trả về từng kết quả ngay khi xong (dòng NDJSON)"""
+    executor = ThreadPoolExecutor(max_workers=min(PROMPT_BATCH_WORKERS, len(keyframe_paths)))
+    cancel = threading.Event()
+    try:
+        futures = {
+            executor.submit(generate_keyframe_prompt, path, PRIORITY_BULK, PROMPT_BATCH_RATE_WAIT, cancel): (index, path)
+            for index, path in enumerate(keyframe_paths)
+        }
+        for future in as_completed(futures):
+            index, path = futures[future]
+            item = {'index': index, 'keyframe_path': path}
+            try:
+                prompt, cached = future.result()
+                item.update(success=True, prompt=prompt, cached=cached)
+            except FileNotFoundError:
+                item.update(success=False, status=404, error='Không tìm thấy hình ảnh')
+            except RateLimitExceeded as e:
+                item.update(success=False, status=429, error=str(e))
+            except Exception as e:
+                logging.error(f"Error generating prompt for {path}: {str(e)}")
+                item.update(success=False, status=500, error=str(e))
+            yield json.dumps(item, ensure_ascii=False) + '\n'
+    finally:
+        # Client ngắt kết nối thì bỏ các khung hình chưa xử lý, các luồng đang chờ lượt gọi API dừng chờ
+        cancel.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+@app.route('/generate-gemini-prompts', methods=['POST'])
+def generate_gemini_prompts():
+    """
+    API endpoint tạo prompt cho nhiều khung hình cùng lúc
+
+    Các lời gọi Gemini chạy song song trong giới hạn của rate limiter; mỗi kết quả được gửi về
+    dưới dạng một dòng JSON (application/x-ndjson) ngay khi hoàn thành, không theo thứ tự gửi lên.
+    """
+    data = request.json or {}
+    keyframe_paths = data.get('keyframe_paths')
+    
+    if not keyframe_paths or not isinstance(keyframe_paths, list):
+        return jsonify({'error': 'Thiếu danh sách đường dẫn hình ảnh'}), 400
+    if len(keyframe_paths) > PROMPT_BATCH_MAX_FRAMES:
+        return jsonify({'error': f'Tối đa {PROMPT_BATCH_MAX_FRAMES} khung hình mỗi lần'}), 400
+    
+    return Response(stream_with_context(prompt_batch_results(keyframe_paths)), mimetype='application/x-ndjson')
+
 @app.route('/generate-prompt', methods=['POST'])
 def generate_prompt():
     """API endpoint to generate a prompt for an image using ChatGPT"""
@@ -2451,21 +2474,16 @@ def process_video_azure():
         use_existing_analysis = request.form.get('use_existing_analysis', 'true') == 'true'
         extract_audio = request.form.get('extract_audio', 'true') == 'true'
         save_images = request.form.get('save_images', 'true') == 'true'
+        whisper_model = get_whisper_model_name(request.form)
+        if whisper_model is None:
+            return jsonify({'error': f"whisper_model must be one of {', '.join(WHISPER_MODEL_NAMES)}"}), 400
         
         # Get video source (file upload or URL)
         video_path = None
-        temp_video_path = None
         
-        # Check if video is from URL
+        # Check if video is from URL (downloaded inside the job)
         video_url = request.form.get('video_url', '')
-        if video_url:
-            try:
-                # Download video from URL
-                video_info = download_video_from_url(video_url)
-                video_path = video_info['path']
-            except Exception as e:
-                return jsonify({'error': str(e)}), 500
-        else:
+        if not video_url:
             # Process direct file upload
             if 'video' not in request.files:
                 return jsonify({'error': 'No video found'}), 400
@@ -2478,76 +2496,92 @@ def process_video_azure():
             if not allowed_file(file.filename):
                 return jsonify({'error': 'File format not supported'}), 400
                 
-            # Save temporary file
+            # Save the uploaded file (already written to the upload folder while receiving)
             filename = secure_filename(file.filename)
-            video_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(video_path)
-        
-        # Create save path for images - use the same KEYFRAMES_FOLDER as method 1
-        save_path = KEYFRAMES_FOLDER
-        
-        # Process video with Azure Video Indexer
-        result = process_azure_video(
-            video_path, 
-            api_key, 
-            account_id, 
-            location, 
-            language,
-            force_upload, 
-            use_existing_analysis, 
-            False,  # Set extract_audio to False for Azure
-            save_images, 
-            save_path
-        )
-        
-        # Add filename to the result
-        result['filename'] = os.path.basename(video_path)
-        
-        # Create a session ID for this video (for transcript access)
-        video_name = get_video_name_without_extension(video_path)
-        session_id = create_safe_session_id(video_name)
-        
-        # Update session_id based on the saved folder if available
-        if 'saved_folder' in result:
-            # Extract session ID from the saved folder path
-            session_folder = result['saved_folder']
-            if session_folder:
-                session_id = os.path.basename(session_folder)
-        
-        result['session_id'] = session_id
+            video_path = unique_upload_path(filename)
+            save_uploaded_video(file, video_path)
         
-        # Use the regular audio extraction method if requested
-        if extract_audio:
-            try:
-                # Extract audio
-                audio_result = extract_audio_from_video(video_path)
-                result['audio'] = audio_result
-                
-                # Transcribe
-                transcript_result = transcribe_audio(audio_result['path'], session_id)
-                result['transcript'] = transcript_result
-            except Exception as audio_error:
-                logging.error(f"Error processing audio: {str(audio_error)}")
-                result['audio_error'] = str(audio_error)
-        
-        return jsonify(result)
+        stages = (['download'] if video_url else []) + ['azure'] + (['audio', 'transcribe'] if extract_audio else [])
+        job = job_queue.submit('process-video-azure', run_azure_job, video_path, video_url, api_key, account_id,
+                               location, language, force_upload, use_existing_analysis, extract_audio, save_images,
+                               whisper_model, stages=stages)
+        return job_response(job)
         
+    except UploadRejected:
+        raise
     except Exception as e:
         logging.error(f"Error in Azure video processing: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
+def run_azure_job(job, video_path, video_url, api_key, account_id, location, language,
+                  force_upload, use_existing_analysis, extract_audio, save_images,
+                  whisper_model=DEFAULT_WHISPER_MODEL):
+    """Background job: download (if URL), process with Azure Video Indexer, then extract audio and transcribe"""
+    if video_url:
+        # Download video from URL
+        job.update('download')
+        video_info = download_video_from_url(video_url)
+        video_path = video_info['path']
+    
+    # Create save path for images - use the same KEYFRAMES_FOLDER as method 1
+    save_path = KEYFRAMES_FOLDER
+    
+    # Process video with Azure Video Indexer
+    result = process_azure_video(
+        video_path, 
+        api_key, 
+        account_id, 
+        location, 
+        language,
+        force_upload, 
+        use_existing_analysis, 
+        False,  # Set extract_audio to False for Azure
+        save_images, 
+        save_path,
+        progress=job.stage_callback('azure')
+    )
+    
+    # Add filename to the result
+    result['filename'] = os.path.basename(video_path)
+    
+    # Create a session ID for this video (for transcript access)
+    video_name = get_video_name_without_extension(video_path)
+    session_id = create_safe_session_id(video_name)
+    
+    # Update session_id based on the saved folder if available
+    if 'saved_folder' in result:
+        # Extract session ID from the saved folder path
+        session_folder = result['saved_folder']
+        if session_folder:
+            session_id = os.path.basename(session_folder)
+    
+    result['session_id'] = session_id
+    
+    # Use the regular audio extraction method if requested
+    if extract_audio:
+        add_audio_transcript(job, result, video_path, session_id, whisper_model)
+    
+    return result
+
+
 # Helper functions for Azure Video Indexer
 def process_azure_video(video_path, api_key, account_id, location, language,
                        force_upload=False, use_existing_analysis=True, 
-                       extract_audio=True, save_images=True, save_path=""):
-    """Process video with Azure Video Indexer"""
+                       extract_audio=True, save_images=True, save_path="", progress=None):
+    """Process video with Azure Video Indexer, reporting step/total to the optional progress callback"""
+    
+    def step_done(step):
+        if progress is not None:
+            progress(step / 7)
     
     try:
         # Step 1: Get access token
         logging.info("Getting Azure Video Indexer access token...")
         access_token = get_azure_access_token(api_key, account_id, location)
         
+        step_done(1)
+        
         # Step 2: Upload video
         logging.info("Uploading video to Azure...")
         video_id = upload_video_to_azure(
@@ -2559,6 +2593,8 @@ def process_azure_video(video_path, api_key, account_id, location, language,
             force_upload
         )
         
+        step_done(2)
+        
         # Step 3: Check processing state
         logging.info("Checking processing state...")
         processing_state = check_azure_processing_state(access_token, video_id, location, account_id)
@@ -2570,26 +2606,35 @@ def process_azure_video(video_path, api_key, account_id, location, language,
         else:
             logging.info("Using existing analysis...")
         
+        step_done(3)
+        
         # Step 4: Get scene information
         logging.info("Getting scene information...")
         scenes_info = get_azure_scenes_info(access_token, video_id, location, account_id)
         
+        step_done(4)
+        
         # Step 5: Extract images from video
         logging.info("Extracting scene images...")
         result = extract_azure_scene_images(video_path, scenes_info)
         
+        step_done(5)
+        
         # Step 6: Extract audio to text (if requested)
         if extract_audio:
             logging.info("Extracting audio to text...")
             transcript = get_azure_transcript(access_token, video_id, location, account_id)
             result['transcript'] = transcript
         
+        step_done(6)
+        
         # Step 7: Save images to directory (if requested)
         if save_images and save_path:
             logging.info("Saving images to directory...")
             saved_folder = save_azure_extracted_images(result, save_path)
             result['saved_folder'] = saved_folder
         
+        step_done(7)
         logging.info("Azure Video Indexer processing completed!")
         return result
         
@@ -3171,7 +3216,7 @@ def generate_new_prompt():
             }), 400
         
         # Kiểm tra rate limit
-        if not check_rate_limit():
+        if not check_rate_limit(PRIORITY_INTERACTIVE):
             return jsonify({
                 'success': False,
                 'error': 'Đã vượt quá giới hạn tốc độ API. Vui lòng thử lại sau.'
@@ -3179,8 +3224,6 @@ def generate_new_prompt():
         
         # Sử dụng Gemini để tạo prompt mới
         try:
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            
             # Xây dựng hướng dẫn cho Gemini
             instruction = f"""
             Viết một prompt mới cho AI tạo hình ảnh, dựa trên prompt sau đây:
@@ -3195,7 +3238,7 @@ def generate_new_prompt():
             """
             
             # Gửi yêu cầu đến Gemini
-            response = model.generate_content(instruction)
+            response = gemini_client.generate(instruction, label='generate_new_prompt')
             
             # Xử lý kết quả
             new_prompt = response.text.strip()
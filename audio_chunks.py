@@ -0,0 +1,30 @@
+SPEECH_CHUNK_MAX_MS = 30000  # Đoạn tối đa 30 giây
+SPEECH_CHUNK_MIN_MS = 10000  # Chỉ cắt tại khoảng lặng khi đoạn đã dài ít nhất 10 giây
+SPEECH_SILENCE_MIN_MS = 400  # Khoảng lặng tối thiểu để làm điểm cắt
+
+
+def split_audio_on_silence(sound, max_chunk_ms=SPEECH_CHUNK_MAX_MS, min_chunk_ms=SPEECH_CHUNK_MIN_MS,
+                           min_silence_ms=SPEECH_SILENCE_MIN_MS):
+    """
+    Chia âm thanh thành các đoạn [start, end) (ms) không dài quá max_chunk_ms
+
+    Điểm cắt là giữa khoảng lặng cuối cùng trong cửa sổ [min_chunk_ms, max_chunk_ms] của mỗi đoạn
+    để không cắt ngang câu nói; nếu không có khoảng lặng thì cắt cứng tại max_chunk_ms.
+    """
+    from pydub.silence import detect_silence
+
+    # Ngưỡng lặng tương đối so với độ lớn trung bình của file
+    silence_thresh = sound.dBFS - 16 if sound.dBFS != float('-inf') else -60
+    silences = detect_silence(sound, min_silence_len=min_silence_ms, silence_thresh=silence_thresh, seek_step=10)
+    cut_points = [(silence_start + silence_end) // 2 for silence_start, silence_end in silences]
+
+    chunks = []
+    start = 0
+    while len(sound) - start > max_chunk_ms:
+        candidates = [point for point in cut_points if start + min_chunk_ms <= point <= start + max_chunk_ms]
+        end = candidates[-1] if candidates else start + max_chunk_ms
+        chunks.append((start, end))
+        start = end
+    if start < len(sound):
+        chunks.append((start, len(sound)))
+    return chunks
@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+import contextlib
+
+
+DEFAULT_DOWNLOAD_CACHE_MAX_BYTES = 5 * 1024 * 1024 * 1024  # Dung lượng tối đa của các video đã tải
+DOWNLOAD_MIN_AGE = 3600  # Video được dùng trong khoảng này (giây) không bị xóa (job có thể vẫn đang đọc)
+INFO_FILENAME = 'info.json'
+
+
+def _folder_size(folder):
+    total = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class DownloadCache:
+    """
+    Video tải từ URL, mỗi video một thư mục {key} chứa file video và info.json
+
+    key được tạo từ ID video (vd: youtube_<id>), nên cùng một video chỉ được tải một lần;
+    lock(key) đảm bảo hai job cùng lúc không tải trùng. info.json chỉ được ghi sau khi tải xong.
+    Khi tổng dung lượng vượt quá max_bytes, các video ít được dùng gần đây nhất bị xóa trước.
+    """
+
+    def __init__(self, folder, max_bytes=DEFAULT_DOWNLOAD_CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._locks = {}
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, key):
+        """Thư mục chứa video của key (tạo mới nếu chưa có)"""
+        folder = os.path.join(self.folder, key)
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def lock(self, key):
+        """Khóa dùng khi kiểm tra và tải video của key (key None: không khóa)"""
+        if key is None:
+            return contextlib.nullcontext()
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self, key):
+        """Thông tin video đã tải (có trường path) hoặc None nếu chưa có/file đã bị xóa"""
+        if key is None:
+            return None
+        info_path = os.path.join(self.folder, key, INFO_FILENAME)
+        try:
+            with open(info_path, 'r', encoding='utf-8') as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(info.get('path', '')):
+            return None
+
+        # Đánh dấu lần dùng gần nhất cho việc loại bỏ LRU
+        now = time.time()
+        os.utime(info_path, (now, now))
+        return info
+
+    def put(self, key, info):
+        """Ghi thông tin video vừa tải xong rồi dọn bớt các video cũ nếu vượt dung lượng"""
+        info_path = os.path.join(self.path(key), INFO_FILENAME)
+        temp_path = f"{info_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False)
+        os.replace(temp_path, info_path)
+        self._evict(keep=key)
+
+    def _evict(self, keep=None):
+        with self._lock:
+            entries = []
+            total = 0
+            now = time.time()
+            for key in os.listdir(self.folder):
+                folder = os.path.join(self.folder, key)
+                if not os.path.isdir(folder):
+                    continue
+                info_path = os.path.join(folder, INFO_FILENAME)
+                used_at = os.path.getmtime(info_path if os.path.exists(info_path) else folder)
+                size = _folder_size(folder)
+                entries.append((used_at, key, size))
+                total += size
+
+            for used_at, key, size in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if key == keep or now - used_at < DOWNLOAD_MIN_AGE:
+                    continue
+                logging.info(f"Xóa video đã tải khỏi cache: {key} ({size} bytes)")
+                shutil.rmtree(os.path.join(self.folder, key), ignore_errors=True)
+                total -= size
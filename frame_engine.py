@@ -0,0 +1,1212 @@
+import os
+import json
+import uuid
+import shutil
+import logging
+import threading
+import tempfile
+import subprocess
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import imagehash
+from PIL import Image
+
+# Lấy mẫu khung hình khi trích xuất
+SAMPLING_MODES = ('grab', 'seek', 'auto')
+SEEK_MIN_STRIDE = 150  # Bước nhảy (số khung hình) tối thiểu để chế độ 'auto' dùng seek thay vì grab
+
+# Bộ giải mã khung hình: OpenCV (VideoCapture) hoặc tiến trình ffmpeg đọc qua pipe
+FRAME_DECODERS = ('opencv', 'ffmpeg')
+FFMPEG_DECODE_THREADS = 0  # 0 = ffmpeg tự chọn số luồng giải mã
+FFMPEG_ERROR_TAIL_BYTES = 4096  # Phần cuối log lỗi của ffmpeg đưa vào thông báo lỗi
+
+# Chiều rộng ảnh xám dùng để phân tích (ảnh lưu ra vẫn giữ độ phân giải gốc)
+DEFAULT_ANALYSIS_WIDTH = 320
+
+# Mật độ cạnh (Canny) phụ thuộc độ phân giải nên luôn được đo ở cùng một chiều rộng,
+# để ngưỡng transition cho cùng kết quả với mọi analysis_width
+EDGE_REFERENCE_WIDTH = DEFAULT_ANALYSIS_WIDTH
+
+# Bộ đệm khung hình gần nhất (dùng để lấy khung hình giữa cảnh mà không cần seek lại)
+RING_BUFFER_MAX_BYTES = 256 * 1024 * 1024
+
+# Trích xuất song song theo đoạn
+SEGMENTS_PER_WORKER = 4  # Chia nhỏ hơn số worker để cân bằng tải giữa các tiến trình
+MIN_SEGMENT_SAMPLES = 50  # Số khung hình được lấy mẫu tối thiểu trong một đoạn
+
+# Nén và ghi ảnh khung hình chính trên các luồng riêng trong khi bộ quét tiếp tục giải mã
+KEYFRAME_WRITE_WORKERS = 4  # Số luồng nén/ghi ảnh dùng chung cho mọi phiên
+KEYFRAME_WRITE_QUEUE = 16  # Số ảnh chờ ghi tối đa của một phiên, đầy thì bộ quét phải chờ
+
+# Hash ảnh được lưu trong metadata của mỗi khung hình chính
+IMAGE_HASH_NAMES = ('phash', 'dhash')
+
+# Định dạng ảnh khung hình chính: phần mở rộng và cờ chất lượng của cv2.imwrite
+OUTPUT_FORMATS = {
+    'jpeg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY),
+    'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY),
+    'avif': ('.avif', getattr(cv2, 'IMWRITE_AVIF_QUALITY', None)),
+}
+DEFAULT_OUTPUT_FORMAT = 'jpeg'
+DEFAULT_OUTPUT_QUALITY = 95  # Giống chất lượng JPEG mặc định của OpenCV
+THUMBNAIL_FOLDER = 'thumbs'  # Thư mục con chứa ảnh thu nhỏ trong thư mục phiên
+THUMBNAIL_MAX_DIMENSION = 320  # Cạnh dài nhất của ảnh thu nhỏ hiển thị trong lưới (pixel)
+THUMBNAIL_QUALITY = 75
+
+# Các chỉ số được tính cho mỗi khung hình được lấy mẫu
+SIGNAL_NAMES = ('mean_diff', 'hist_diff', 'contrast', 'edge_density')
+
+
+def compute_frame_skip(total_frames, fps):
+    """Tính bước nhảy để tăng hiệu suất với video dài (khoảng 10 khung hình mỗi giây)"""
+    return max(1, int(total_frames / (10 * fps)))
+
+
+def iter_sampled_frames(cap, frame_skip, sampling_mode='auto', start_frame=0, end_frame=None):
+    """
+    Duyệt các khung hình được lấy mẫu (start_frame, start_frame + frame_skip, ...) trước end_frame
+
+    Các khung hình bị bỏ qua không được chuyển đổi thành ảnh:
+    - 'grab': gọi cap.grab() cho khung hình bị bỏ qua (không retrieve/chuyển màu)
+    - 'seek': định vị thẳng đến khung hình cần lấy, decoder chỉ giải mã từ keyframe gần nhất
+    - 'auto': dùng 'seek' khi bước nhảy >= SEEK_MIN_STRIDE, ngược lại dùng 'grab'
+
+    Trả về (yield) từng cặp (frame_index, frame)
+    """
+    if sampling_mode not in SAMPLING_MODES:
+        raise ValueError(f"Chế độ lấy mẫu không hợp lệ: {sampling_mode}")
+
+    if sampling_mode == 'auto':
+        sampling_mode = 'seek' if frame_skip >= SEEK_MIN_STRIDE else 'grab'
+
+    frame_index = start_frame
+    position = 0  # Vị trí khung hình tiếp theo mà cap sẽ đọc
+
+    # Đoạn bắt đầu giữa video luôn được định vị trực tiếp
+    if start_frame > 0 and cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame):
+        position = start_frame
+
+    while end_frame is None or frame_index < end_frame:
+        # Định vị đến khung hình cần lấy nếu dùng chế độ seek
+        if sampling_mode == 'seek' and position != frame_index:
+            if not cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index):
+                # Backend không hỗ trợ seek, chuyển sang grab cho phần còn lại
+                logging.warning("Không thể seek trong video, chuyển sang chế độ grab")
+                sampling_mode = 'grab'
+            else:
+                position = frame_index
+
+        # Bỏ qua các khung hình trung gian mà không retrieve
+        while position < frame_index:
+            if not cap.grab():
+                return
+            position += 1
+
+        ret, frame = cap.read()
+        if not ret:
+            return
+        position += 1
+
+        yield frame_index, frame
+        frame_index += frame_skip
+
+
+def analysis_size(width, height, analysis_width=None):
+    """Kích thước (rộng, cao) của ảnh phân tích, chỉ thu nhỏ khi ảnh rộng hơn analysis_width"""
+    if analysis_width and width > analysis_width:
+        return analysis_width, max(1, round(height * analysis_width / width))
+    return width, height
+
+
+def to_analysis_gray(frame, analysis_width=None):
+    """Chuyển khung hình sang ảnh xám, thu nhỏ về analysis_width nếu ảnh rộng hơn"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    height, width = gray.shape
+    size = analysis_size(width, height, analysis_width)
+    if size != (width, height):
+        gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    return gray
+
+
+class SampledFrame:
+    """Một khung hình được lấy mẫu: chỉ số, thời điểm, ảnh gốc (BGR) và ảnh xám dùng để phân tích"""
+
+    __slots__ = ('index', 'timestamp', 'image', 'gray', 'hist')
+
+    def __init__(self, index, timestamp, image, gray):
+        self.index = index
+        self.timestamp = timestamp
+        self.image = image
+        self.gray = gray
+        self.hist = None  # Histogram được tính khi cần và dùng lại cho khung hình kế tiếp
+
+
+class OpenCVFrameSource:
+    """
+    Nguồn khung hình dùng cv2.VideoCapture
+
+    Chỉ giải mã các khung hình được lấy mẫu và chuyển sang ảnh xám một lần
+    cho tất cả detector. Ảnh xám được thu nhỏ về analysis_width (None = giữ nguyên)
+    để giảm chi phí phân tích, ảnh gốc vẫn được giữ để lưu khung hình chính.
+    """
+
+    def __init__(self, video_path, sampling_mode='auto', frame_skip=None, start_frame=0, end_frame=None,
+                 analysis_width=None):
+        self.video_path = video_path
+        self.sampling_mode = sampling_mode
+        self.analysis_width = analysis_width
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.cap = cv2.VideoCapture(video_path)
+
+        # Kiểm tra nếu không mở được video
+        if not self.cap.isOpened():
+            raise Exception("Không thể mở file video")
+
+        # Lấy thông tin video
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.frame_skip = frame_skip or compute_frame_skip(self.total_frames, self.fps)
+
+    def __iter__(self):
+        for frame_index, frame in iter_sampled_frames(self.cap, self.frame_skip, self.sampling_mode,
+                                                      self.start_frame, self.end_frame):
+            gray = to_analysis_gray(frame, self.analysis_width)
+            yield SampledFrame(frame_index, frame_index / self.fps, frame, gray)
+
+    def release(self):
+        self.cap.release()
+
+
+class FFmpegFrameSource:
+    """
+    Nguồn khung hình đọc ảnh xám thô từ tiến trình ffmpeg qua stdout
+
+    ffmpeg giải mã đa luồng (-threads), tự lọc các khung hình được lấy mẫu (select)
+    và thu nhỏ (scale), Python chỉ đọc dữ liệu vào các bộ đệm NumPy cấp phát sẵn.
+    Nguồn này không có ảnh gốc BGR: ảnh của khung hình chính được đọc lại
+    sau lượt quét (read_frames_sorted).
+    """
+
+    def __init__(self, video_path, sampling_mode='auto', frame_skip=None, analysis_width=None,
+                 threads=FFMPEG_DECODE_THREADS):
+        self.video_path = video_path
+        self.sampling_mode = sampling_mode  # ffmpeg luôn giải mã tuần tự, giữ lại để tương thích
+        self.analysis_width = analysis_width
+        self.threads = threads
+
+        # Lấy thông tin video
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise Exception("Không thể mở file video")
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        self.total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        cap.release()
+
+        self.frame_skip = frame_skip or compute_frame_skip(self.total_frames, self.fps)
+        self.output_width, self.output_height = analysis_size(self.width, self.height, analysis_width)
+        self.process = None
+        self._stderr = None
+
+    def _command(self):
+        filters = (f"select='not(mod(n\\,{self.frame_skip}))',"
+                   f"scale={self.output_width}:{self.output_height}:flags=area,format=gray")
+        return [
+            'ffmpeg',
+            '-v', 'error',
+            '-threads', str(self.threads),
+            '-i', self.video_path,
+            '-an', '-sn',
+            '-vf', filters,
+            '-vsync', '0',  # Không nhân bản/bỏ khung hình, giữ đúng thứ tự được lấy mẫu
+            '-f', 'rawvideo',
+            '-pix_fmt', 'gray',
+            'pipe:1'
+        ]
+
+    def __iter__(self):
+        # Log lỗi ghi ra file tạm: pipe stderr không được đọc trong lúc giải mã sẽ đầy
+        # (video hỏng có thể sinh nhiều log) và làm ffmpeg dừng lại chờ, treo cả lượt đọc stdout
+        self._stderr = tempfile.TemporaryFile()
+        try:
+            self.process = subprocess.Popen(self._command(), stdout=subprocess.PIPE, stderr=self._stderr)
+        except FileNotFoundError:
+            self._stderr.close()
+            raise Exception("Không tìm thấy ffmpeg để giải mã video")
+
+        # Hai bộ đệm luân phiên: detector còn giữ khung hình trước để so sánh
+        buffers = np.empty((2, self.output_height, self.output_width), dtype=np.uint8)
+        sample_number = 0
+        while True:
+            gray = buffers[sample_number % 2]
+            if not self._read_into(gray):
+                break
+            frame_index = sample_number * self.frame_skip
+            yield SampledFrame(frame_index, frame_index / self.fps, None, gray)
+            sample_number += 1
+
+        self.process.wait()
+        if self.process.returncode != 0 and sample_number == 0:
+            raise Exception(f"FFmpeg không giải mã được video: {self._error_tail()}")
+
+    def _error_tail(self):
+        """Phần cuối log lỗi của ffmpeg"""
+        size = self._stderr.seek(0, os.SEEK_END)
+        self._stderr.seek(max(0, size - FFMPEG_ERROR_TAIL_BYTES))
+        return self._stderr.read().decode('utf-8', errors='replace').strip()
+
+    def _read_into(self, buffer):
+        """Đọc đúng một khung hình vào buffer, trả về False khi hết dữ liệu"""
+        view = memoryview(buffer).cast('B')
+        filled = 0
+        while filled < len(view):
+            count = self.process.stdout.readinto(view[filled:])
+            if not count:
+                return False
+            filled += count
+        return True
+
+    def release(self):
+        if self.process is not None:
+            if self.process.poll() is None:
+                # Dừng sớm khi các detector đã đủ khung hình
+                self.process.kill()
+            self.process.wait()
+            self.process.stdout.close()
+        if self._stderr is not None:
+            self._stderr.close()
+
+
+def open_frame_source(video_path, decoder='opencv', sampling_mode='auto', analysis_width=None):
+    """Tạo nguồn khung hình theo bộ giải mã được chọn (xem FRAME_DECODERS)"""
+    if decoder == 'ffmpeg':
+        return FFmpegFrameSource(video_path, sampling_mode, analysis_width=analysis_width)
+    if decoder == 'opencv':
+        return OpenCVFrameSource(video_path, sampling_mode, analysis_width=analysis_width)
+    raise ValueError(f"Bộ giải mã không hợp lệ: {decoder}")
+
+
+class FrameRingBuffer:
+    """
+    Bộ đệm vòng các khung hình được lấy mẫu gần nhất, giới hạn theo dung lượng bộ nhớ
+
+    Cho phép lấy khung hình đại diện giữa cảnh từ bộ nhớ thay vì seek lại trong video.
+    Khi vượt quá max_bytes, khung hình cũ nhất bị loại bỏ.
+    """
+
+    def __init__(self, max_bytes=RING_BUFFER_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._samples = collections.deque()
+        self._bytes = 0
+
+    def append(self, sample):
+        if sample.image is None:
+            return
+        self._samples.append(sample)
+        self._bytes += sample.image.nbytes
+        while self._bytes > self.max_bytes and self._samples:
+            self._pop_oldest()
+
+    def discard_before(self, frame_index):
+        """Loại bỏ các khung hình có chỉ số nhỏ hơn frame_index"""
+        while self._samples and self._samples[0].index < frame_index:
+            self._pop_oldest()
+
+    def get(self, frame_index):
+        """Khung hình có đúng chỉ số frame_index, None nếu không có trong bộ đệm"""
+        for sample in self._samples:
+            if sample.index == frame_index:
+                return sample
+        return None
+
+    def _pop_oldest(self):
+        sample = self._samples.popleft()
+        self._bytes -= sample.image.nbytes
+
+
+def _gray_histogram(sample):
+    """Histogram 64 bin đã chuẩn hóa của ảnh xám, lưu lại trên sample để dùng lại"""
+    if sample.hist is None:
+        hist = cv2.calcHist([sample.gray], [0], None, [64], [0, 256])
+        cv2.normalize(hist, hist, 0, 1, cv2.NORM_MINMAX)
+        sample.hist = hist
+    return sample.hist
+
+
+class FrameSignals:
+    """
+    Các chỉ số của một khung hình so với khung hình được lấy mẫu trước đó
+
+    Mỗi chỉ số chỉ được tính khi có detector cần đến và chỉ tính một lần
+    cho tất cả detector trong cùng lượt quét
+    """
+
+    def __init__(self, sample, prev):
+        self.sample = sample
+        self.prev = prev
+        self._cache = {}
+
+    def _get(self, name, compute):
+        if name not in self._cache:
+            self._cache[name] = compute()
+        return self._cache[name]
+
+    @property
+    def is_first(self):
+        """Khung hình đầu tiên của video (không có khung hình trước để so sánh)"""
+        return self.prev is None
+
+    @property
+    def mean_diff(self):
+        """Trung bình độ khác biệt tuyệt đối giữa hai ảnh xám"""
+        if self.prev is None:
+            return 0.0
+        return self._get('mean_diff', lambda: float(np.mean(cv2.absdiff(self.sample.gray, self.prev.gray))))
+
+    @property
+    def hist_diff(self):
+        """Khoảng cách Bhattacharyya giữa histogram của hai ảnh xám"""
+        if self.prev is None:
+            return 0.0
+        return self._get('hist_diff', lambda: float(cv2.compareHist(
+            _gray_histogram(self.prev), _gray_histogram(self.sample), cv2.HISTCMP_BHATTACHARYYA)))
+
+    @property
+    def contrast(self):
+        """Độ tương phản chuẩn hóa về khoảng 0-1"""
+        return self._get('contrast', lambda: float(np.std(self.sample.gray)) / 128.0)
+
+    @property
+    def edge_density(self):
+        """Tỷ lệ điểm ảnh là cạnh (Canny), đo trên ảnh xám rộng EDGE_REFERENCE_WIDTH"""
+        def compute():
+            gray = self.sample.gray
+            height, width = gray.shape
+            if width != EDGE_REFERENCE_WIDTH:
+                size = (EDGE_REFERENCE_WIDTH, max(1, round(height * EDGE_REFERENCE_WIDTH / width)))
+                interpolation = cv2.INTER_AREA if width > EDGE_REFERENCE_WIDTH else cv2.INTER_LINEAR
+                gray = cv2.resize(gray, size, interpolation=interpolation)
+            edges = cv2.Canny(gray, 100, 200)
+            return np.count_nonzero(edges) / (gray.shape[0] * gray.shape[1])
+        return self._get('edge_density', compute)
+
+
+def transition_confidence(contrast_score, edge_density, diff_history=None, threshold=0.4):
+    """
+    Tính độ tin cậy một khung hình là một phần của hiệu ứng fade transition
+
+    Kết hợp độ tương phản, mật độ cạnh và mẫu thời gian trong diff_history
+    """
+    # 1. Kiểm tra độ tương phản - transitions thường có độ tương phản thấp hơn
+    low_contrast = contrast_score < (0.1 + threshold * 0.2)
+
+    # 2. Phát hiện cạnh - transitions có ít cạnh mạnh hơn
+    low_edge_density = edge_density < (0.01 + threshold * 0.05)
+
+    # 3. Kiểm tra mẫu thời gian - fade transitions thể hiện một mẫu cụ thể trong diff_history
+    temporal_pattern = False
+    if diff_history and len(diff_history) >= 3:
+        # Kiểm tra sự khác biệt tăng dần hoặc giảm dần (đặc trưng của fades)
+        diffs = np.array(list(diff_history)[-3:])
+        is_increasing = np.all(np.diff(diffs) > 0)
+        is_decreasing = np.all(np.diff(diffs) < 0)
+        temporal_pattern = is_increasing or is_decreasing
+
+    # Kết hợp các chỉ số - trọng số dựa trên ngưỡng
+    confidence = 0
+
+    if low_contrast:
+        confidence += 0.4
+
+    if low_edge_density:
+        confidence += 0.4
+
+    if temporal_pattern:
+        confidence += 0.2
+
+    return confidence
+
+
+def is_transition_frame(frame, gray=None, diff_history=None, threshold=0.4):
+    """
+    Phát hiện nếu một khung hình có khả năng là một phần của hiệu ứng fade transition
+
+    Sử dụng nhiều chỉ số đánh giá:
+    1. Phân tích độ tương phản và độ sáng
+    2. Phát hiện cạnh
+    3. Phân tích mẫu thời gian sử dụng lịch sử khác biệt
+
+    Tham số:
+    - threshold: Giá trị từ 0-1 kiểm soát độ nhạy (cao hơn = nghiêm ngặt hơn)
+
+    Trả về:
+    - Boolean cho biết khung hình có khả năng là transition hay không
+    """
+    # Chuyển sang ảnh xám nếu chưa có
+    if gray is None:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+    signals = FrameSignals(SampledFrame(0, 0, frame, gray), None)
+    confidence = transition_confidence(signals.contrast, signals.edge_density, diff_history, threshold)
+
+    # Trả về true nếu độ tin cậy kết hợp vượt quá ngưỡng
+    return confidence > threshold
+
+
+class KeyframeDetector:
+    """
+    Lớp cơ sở cho các bộ phát hiện khung hình chính
+
+    Detector nhận từng khung hình được lấy mẫu cùng các chỉ số dùng chung (FrameSignals)
+    và trả về danh sách (frame_index, metadata) của các khung hình cần lưu.
+    Engine lo việc đọc ảnh, ghi file và gán đường dẫn, thời điểm, ID.
+    """
+
+    method = None
+    prefix = 'frame'
+    signal_names = ()  # Các chỉ số (SIGNAL_NAMES) detector có thể đọc, với bất kỳ tham số nào
+
+    def __init__(self, threshold=30, max_frames=20, prefix=None):
+        self.threshold = threshold
+        self.max_frames = max_frames
+        if prefix:
+            self.prefix = prefix
+        self.keyframes = []
+
+    @property
+    def done(self):
+        """Detector đã đủ số lượng khung hình tối đa"""
+        return self.max_frames is not None and len(self.keyframes) >= self.max_frames
+
+    def observe(self, sample, signals):
+        raise NotImplementedError
+
+    def finish(self):
+        """Gọi khi kết thúc lượt quét, trả về các khung hình còn lại cần lưu"""
+        return []
+
+    def retain_from(self, frame_index):
+        """Chỉ số khung hình nhỏ nhất detector còn có thể yêu cầu lưu khi đang ở frame_index"""
+        return frame_index
+
+    def filename(self, meta):
+        return f"{self.prefix}_{len(self.keyframes)}.jpg"
+
+    def result_fields(self):
+        """Các trường bổ sung cho kết quả trả về của phương pháp"""
+        return {}
+
+
+class FrameDifferenceDetector(KeyframeDetector):
+    """Phương pháp 1: lưu khung hình khi độ khác biệt trung bình vượt ngưỡng"""
+
+    method = 'frame_difference'
+    signal_names = ('mean_diff',)
+
+    def observe(self, sample, signals):
+        # Khung hình đầu tiên luôn được lưu
+        if signals.is_first:
+            return [(sample.index, {
+                'diff_value': 0
+            })]
+
+        mean_diff = signals.mean_diff
+        if mean_diff > self.threshold:
+            return [(sample.index, {
+                'diff_value': mean_diff
+            })]
+        return []
+
+
+class TransitionAwareDetector(KeyframeDetector):
+    """Phương pháp khác biệt khung hình kèm đánh dấu khung hình thuộc hiệu ứng transition"""
+
+    method = 'transition_aware'
+    signal_names = ('mean_diff', 'contrast', 'edge_density')
+
+    def __init__(self, threshold=30, max_frames=20, transition_threshold=0.4, prefix=None):
+        super().__init__(threshold, max_frames, prefix)
+        self.transition_threshold = transition_threshold
+        self.diff_history = collections.deque(maxlen=5)  # Lưu trữ lịch sử khác biệt
+
+    def observe(self, sample, signals):
+        if signals.is_first:
+            return [(sample.index, {
+                'diff_value': 0,
+                'is_transition': False
+            })]
+
+        mean_diff = signals.mean_diff
+        self.diff_history.append(mean_diff)
+
+        # Nếu có sự thay đổi lớn, kiểm tra xem đây có phải là khung hình transition không
+        if mean_diff > self.threshold:
+            confidence = transition_confidence(signals.contrast, signals.edge_density,
+                                               self.diff_history, self.transition_threshold)
+            return [(sample.index, {
+                'diff_value': mean_diff,
+                'is_transition': confidence > self.transition_threshold
+            })]
+        return []
+
+    def result_fields(self):
+        return {'transition_threshold': self.transition_threshold}
+
+
+class SceneDetector(KeyframeDetector):
+    """
+    Phương pháp 2: phát hiện chuyển cảnh bằng histogram, lưu khung hình giữa mỗi cảnh
+
+    Khung hình giữa cảnh là khung hình được lấy mẫu gần điểm giữa nhất (bằng nhau thì lấy khung hình trước),
+    nên luôn có sẵn trong bộ đệm vòng và giống nhau giữa chạy tuần tự, song song và chọn lại.
+    """
+
+    method = 'scene_detection'
+    prefix = 'scene'
+    signal_names = ('hist_diff',)
+
+    def __init__(self, threshold=30, max_frames=20, min_scene_length=15, prefix=None):
+        super().__init__(threshold, max_frames, prefix)
+        self.min_scene_length = min_scene_length
+        self.scene_start = 0
+        self.end_index = 0  # Chỉ số ngay sau khung hình cuối cùng đã quét
+        self.scenes = []
+        self.scene_samples = []  # Chỉ số các khung hình được lấy mẫu trong cảnh hiện tại
+
+    def observe(self, sample, signals):
+        self.end_index = sample.index + 1
+
+        if signals.is_first:
+            self.scene_start = sample.index
+            self.scene_samples = [sample.index]
+            return [(sample.index, {
+                'scene_id': 0,
+                'hist_diff': 0
+            })]
+
+        hist_diff = signals.hist_diff
+
+        # Phát hiện chuyển cảnh
+        if hist_diff > self.threshold / 100 and (sample.index - self.scene_start) >= self.min_scene_length:
+            emitted = [self._close_scene(sample.index, hist_diff)]
+            # Bắt đầu cảnh mới
+            self.scene_start = sample.index
+            self.scene_samples = [sample.index]
+            return emitted
+        self.scene_samples.append(sample.index)
+        return []
+
+    def _close_scene(self, end, hist_diff):
+        """Kết thúc cảnh hiện tại và trả về khung hình đại diện (khung hình giữa cảnh)"""
+        self.scenes.append({
+            'start': self.scene_start,
+            'end': end,
+            'length': end - self.scene_start
+        })
+        midpoint = self.scene_start + (end - self.scene_start) // 2
+        mid_frame_idx = min(self.scene_samples, key=lambda index: (abs(index - midpoint), index), default=midpoint)
+        return (mid_frame_idx, {
+            'scene_id': len(self.scenes),
+            'hist_diff': hist_diff
+        })
+
+    def finish(self):
+        # Xử lý cảnh cuối cùng nếu cần
+        if self.scene_start < self.end_index - self.min_scene_length and \
+                (self.max_frames is None or len(self.scenes) < self.max_frames):
+            return [self._close_scene(self.end_index, 0)]
+        return []
+
+    def retain_from(self, frame_index):
+        # Khung hình giữa cảnh hiện tại chỉ tiến lên khi cảnh dài thêm
+        return self.scene_start + (frame_index - self.scene_start) // 2
+
+    def filename(self, meta):
+        return f"{self.prefix}_{meta['scene_id']}.jpg"
+
+    def result_fields(self):
+        return {'scenes': self.scenes}
+
+
+DETECTOR_CLASSES = {
+    FrameDifferenceDetector.method: FrameDifferenceDetector,
+    SceneDetector.method: SceneDetector,
+    TransitionAwareDetector.method: TransitionAwareDetector,
+}
+
+
+def supported_output_formats():
+    """Các định dạng trong OUTPUT_FORMATS mà bản OpenCV đang dùng ghi được"""
+    return [name for name, (extension, quality_flag) in OUTPUT_FORMATS.items()
+            if quality_flag is not None and cv2.haveImageWriter(extension)]
+
+
+def output_profile(output_format=DEFAULT_OUTPUT_FORMAT, quality=DEFAULT_OUTPUT_QUALITY, max_dimension=None):
+    """
+    Cấu hình ghi ảnh khung hình chính (dạng từ điển để lưu cùng tham số trích xuất)
+
+    - output_format: một trong OUTPUT_FORMATS
+    - quality: chất lượng nén 1-100
+    - max_dimension: cạnh dài nhất của ảnh lưu ra, None = giữ độ phân giải gốc
+    """
+    return {'format': output_format, 'quality': int(quality), 'max_dimension': max_dimension or None}
+
+
+def thumbnail_path(path):
+    """Đường dẫn ảnh thu nhỏ của ảnh khung hình tại path"""
+    return os.path.join(os.path.dirname(path), THUMBNAIL_FOLDER, os.path.basename(path))
+
+
+def fit_image(image, max_dimension):
+    """Thu nhỏ ảnh để cạnh dài nhất không quá max_dimension (không phóng to)"""
+    height, width = image.shape[:2]
+    scale = max_dimension / float(max(height, width)) if max_dimension else 1.0
+    if scale >= 1.0:
+        return image
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def compute_image_hashes(image):
+    """
+    Perceptual hash (pHash) và difference hash (dHash) của ảnh BGR, dạng chuỗi hex 64 bit
+
+    Tính trên ảnh xám trong bộ nhớ, cùng cách imagehash xử lý ảnh đọc từ file.
+    """
+    gray = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+    return {'phash': str(imagehash.phash(gray)), 'dhash': str(imagehash.dhash(gray))}
+
+
+_write_pool = None
+_write_pool_lock = threading.Lock()
+
+
+def keyframe_write_pool():
+    """Nhóm luồng nén/ghi ảnh dùng chung (cv2.imwrite nhả GIL nên các luồng chạy song song)"""
+    global _write_pool
+    with _write_pool_lock:
+        if _write_pool is None:
+            _write_pool = ThreadPoolExecutor(max_workers=KEYFRAME_WRITE_WORKERS, thread_name_prefix='keyframe-writer')
+        return _write_pool
+
+
+class KeyframeWriter:
+    """
+    Ghi khung hình chính vào thư mục phiên và tạo metadata cho frontend
+
+    Ảnh được ghi theo output (xem output_profile: định dạng, chất lượng, kích thước tối đa),
+    kèm một ảnh thu nhỏ trong thư mục THUMBNAIL_FOLDER để hiển thị trong lưới.
+    Với async_writes, ảnh được sao chép rồi giao cho keyframe_write_pool() nén và ghi, bộ quét
+    chỉ phải chờ khi đã có KEYFRAME_WRITE_QUEUE ảnh đang chờ. Gọi join() trước khi dùng kết quả.
+    """
+
+    def __init__(self, session_folder, relative_folder, fps, async_writes=True, output=None):
+        self.session_folder = session_folder
+        self.relative_folder = relative_folder  # Đường dẫn tương đối cho frontend
+        self.fps = fps
+        self.async_writes = async_writes
+        self.output = dict(output_profile(), **(output or {}))
+        self.extension, quality_flag = OUTPUT_FORMATS[self.output['format']]
+        self.write_params = [quality_flag, self.output['quality']]
+        self.thumbnail_params = [quality_flag, min(self.output['quality'], THUMBNAIL_QUALITY)]
+        self._slots = threading.BoundedSemaphore(KEYFRAME_WRITE_QUEUE)
+        self._futures = []
+        os.makedirs(os.path.join(session_folder, THUMBNAIL_FOLDER), exist_ok=True)
+
+    def add(self, detector, frame_index, meta):
+        """Đăng ký khung hình chính cho detector (chưa ghi ảnh), trả về metadata của khung hình"""
+        frame_filename = os.path.splitext(detector.filename(meta))[0] + self.extension
+        keyframe = {
+            'path': os.path.join(self.relative_folder, frame_filename),
+            'thumbnail_path': os.path.join(self.relative_folder, THUMBNAIL_FOLDER, frame_filename),
+            'frame_number': frame_index,
+            'timestamp': frame_index / self.fps
+        }
+        keyframe.update(meta)
+        keyframe['id'] = str(uuid.uuid4())[:8]  # Thêm ID duy nhất cho mỗi khung hình
+        detector.keyframes.append(keyframe)
+        return keyframe
+
+    def save(self, keyframe, image):
+        """Ghi ảnh của khung hình chính đã đăng ký và lưu hash của ảnh vào metadata"""
+        if not self.async_writes:
+            self._write(keyframe, image)
+            return
+
+        self._slots.acquire()
+        try:
+            # Sao chép ảnh để bộ quét có thể dùng lại/giải phóng khung hình ngay
+            future = keyframe_write_pool().submit(self._write_and_release, keyframe, image.copy())
+        except Exception:
+            self._slots.release()
+            raise
+        self._futures.append(future)
+
+    def reuse(self, keyframe, image_path, hashes=None):
+        """
+        Dùng lại ảnh đã ghi trước đó (vd: của phiên gốc khi chọn lại keyframes) thay vì giải mã lại
+
+        Trả về False nếu ảnh không còn hoặc khác định dạng đầu ra, khi đó cần ghi lại từ video.
+        """
+        if not os.path.exists(image_path) or os.path.splitext(image_path)[1] != self.extension:
+            return False
+        target_path = os.path.join(self.session_folder, os.path.basename(keyframe['path']))
+        if os.path.abspath(image_path) != os.path.abspath(target_path):
+            shutil.copyfile(image_path, target_path)
+
+        image = None
+        target_thumbnail = thumbnail_path(target_path)
+        if os.path.exists(thumbnail_path(image_path)):
+            if os.path.abspath(thumbnail_path(image_path)) != os.path.abspath(target_thumbnail):
+                shutil.copyfile(thumbnail_path(image_path), target_thumbnail)
+        else:
+            # Phiên cũ chưa có ảnh thu nhỏ
+            image = cv2.imread(target_path)
+            self._write_thumbnail(target_path, image)
+
+        if hashes is None:
+            hashes = compute_image_hashes(image if image is not None else cv2.imread(target_path))
+        keyframe.update(hashes)
+        return True
+
+    def _write_thumbnail(self, frame_path, image):
+        cv2.imwrite(thumbnail_path(frame_path), fit_image(image, THUMBNAIL_MAX_DIMENSION), self.thumbnail_params)
+
+    def _write(self, keyframe, image):
+        frame_path = os.path.join(self.session_folder, os.path.basename(keyframe['path']))
+        image = fit_image(image, self.output['max_dimension'])
+        cv2.imwrite(frame_path, image, self.write_params)
+        self._write_thumbnail(frame_path, image)
+        keyframe.update(compute_image_hashes(image))
+
+    def _write_and_release(self, keyframe, image):
+        try:
+            self._write(keyframe, image)
+        finally:
+            self._slots.release()
+
+    def join(self):
+        """Chờ ghi xong mọi ảnh đã giao, ném lại lỗi ghi nếu có"""
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def write(self, detector, frame_index, image, meta):
+        keyframe = self.add(detector, frame_index, meta)
+        self.save(keyframe, image)
+        return keyframe
+
+
+def report_progress(progress, source, frame_index):
+    """Gọi callback progress với tỉ lệ video đã quét (0.0 - 1.0)"""
+    if progress is not None:
+        progress(min(1.0, frame_index / max(1, source.total_frames)))
+
+
+def run_keyframe_detectors(source, detectors, writer, ring_buffer_bytes=RING_BUFFER_MAX_BYTES, progress=None,
+                           signal_index=None):
+    """
+    Chạy nhiều detector trên cùng một lượt giải mã video
+
+    Mỗi khung hình được lấy mẫu chỉ được giải mã và chuyển sang ảnh xám một lần,
+    các chỉ số (FrameSignals) được tính một lần và dùng chung cho mọi detector.
+    Lượt quét dừng khi tất cả detector đã đủ số lượng khung hình.
+
+    Khung hình chính không phải khung hình hiện tại (vd: khung hình giữa cảnh) được lấy
+    từ bộ đệm vòng các khung hình gần nhất; nếu đã bị loại khỏi bộ đệm, khung hình
+    được đọc sau khi quét xong trong một lượt duyệt có thứ tự (read_frames_sorted).
+
+    progress (tùy chọn) được gọi với tỉ lệ video đã quét sau mỗi khung hình được lấy mẫu.
+    signal_index (tùy chọn, SignalIndex) ghi lại chỉ số của mọi khung hình đã quét.
+    """
+    ring = FrameRingBuffer(ring_buffer_bytes)
+    pending = []
+
+    def emit(detector, frame_index, meta):
+        # Chỉ dùng đúng khung hình được yêu cầu để kết quả giống hệt khi chạy song song hoặc chọn lại
+        sample = ring.get(frame_index)
+        if sample is not None:
+            writer.write(detector, sample.index, sample.image, meta)
+        else:
+            pending.append((detector, writer.add(detector, frame_index, meta)))
+
+    # Chỉ ghi vào chỉ số những gì các detector này cần, không tính thêm chỉ số khác cho mỗi khung hình
+    recorded_names = required_signals(detectors)
+    prev = None
+    scanned_all = True
+    for sample in source:
+        active = [detector for detector in detectors if not detector.done]
+        if not active:
+            scanned_all = False
+            break
+
+        ring.append(sample)
+        signals = FrameSignals(sample, prev)
+        for detector in active:
+            for frame_index, meta in detector.observe(sample, signals):
+                emit(detector, frame_index, meta)
+        if signal_index is not None:
+            signal_index.record(sample.index, signals, recorded_names)
+
+        # Giữ lại khung hình gần nhất trước vị trí mà các detector còn có thể cần
+        retain = min((detector.retain_from(sample.index) for detector in active if not detector.done),
+                     default=sample.index)
+        ring.discard_before(retain - source.frame_skip + 1)
+
+        prev = sample
+        report_progress(progress, source, sample.index)
+
+    if signal_index is not None:
+        signal_index.complete = scanned_all
+
+    for detector in detectors:
+        for frame_index, meta in detector.finish():
+            emit(detector, frame_index, meta)
+
+    if pending:
+        logging.info(f"Đọc lại {len(pending)} khung hình không còn trong bộ đệm")
+        save_pending_keyframes(source.video_path, writer, pending)
+    writer.join()
+    report_progress(progress, source, source.total_frames)
+
+
+def read_frames_sorted(video_path, frame_indices):
+    """
+    Đọc nhiều khung hình bất kỳ trong một lượt duyệt theo thứ tự vị trí
+
+    Khoảng cách ngắn được bỏ qua bằng grab, khoảng cách lớn dùng seek,
+    nên mỗi đoạn GOP chỉ bị giải mã tối đa một lần.
+    Trả về (yield) từng cặp (frame_index, frame), frame là None nếu không đọc được
+    """
+    cap = cv2.VideoCapture(video_path)
+    position = 0
+    try:
+        for frame_index in sorted(set(frame_indices)):
+            if frame_index - position >= SEEK_MIN_STRIDE or frame_index < position:
+                if cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index):
+                    position = frame_index
+
+            while position < frame_index:
+                if not cap.grab():
+                    break
+                position += 1
+
+            ret, frame = cap.read() if position == frame_index else (False, None)
+            if ret:
+                position += 1
+            yield frame_index, frame if ret else None
+    finally:
+        cap.release()
+
+
+def required_signals(detectors):
+    """Các chỉ số cần ghi lại để chọn lại khung hình với các detector này (theo thứ tự SIGNAL_NAMES)"""
+    names = {name for detector in detectors for name in detector.signal_names}
+    return tuple(name for name in SIGNAL_NAMES if name in names)
+
+
+def signal_row(signals, names=SIGNAL_NAMES):
+    """Giá trị các chỉ số của một khung hình theo cột SIGNAL_NAMES, chỉ số không nằm trong names là NaN"""
+    return [getattr(signals, name) if name in names else np.nan for name in SIGNAL_NAMES]
+
+
+def compute_segment_signals(video_path, frame_skip, sampling_mode, start_frame, end_frame, analysis_width=None,
+                            names=SIGNAL_NAMES):
+    """
+    Tính các chỉ số names (mặc định tất cả SIGNAL_NAMES) cho mọi khung hình được lấy mẫu trong [start_frame, end_frame)
+
+    Khung hình được lấy mẫu cuối cùng của đoạn trước được đọc lại để làm khung hình so sánh
+    cho khung hình đầu tiên của đoạn, nhờ đó độ khác biệt tại ranh giới giữa hai đoạn không bị mất.
+    Trả về (frame_indices, signals) với signals có dạng (N, len(SIGNAL_NAMES)), chỉ số không tính là NaN
+    """
+    warmup_frame = max(0, start_frame - frame_skip)
+    source = OpenCVFrameSource(video_path, sampling_mode, frame_skip, warmup_frame, end_frame, analysis_width)
+    frame_indices = []
+    rows = []
+    try:
+        prev = None
+        for sample in source:
+            # Khung hình ranh giới chỉ dùng để so sánh, không thuộc đoạn này
+            if sample.index >= start_frame:
+                signals = FrameSignals(sample, prev)
+                frame_indices.append(sample.index)
+                rows.append(signal_row(signals, names))
+            prev = sample
+    finally:
+        source.release()
+
+    return np.array(frame_indices, dtype=np.int64), np.array(rows, dtype=np.float64).reshape(-1, len(SIGNAL_NAMES))
+
+
+def _compute_segment_signals_worker(args):
+    # Mỗi tiến trình đã xử lý một đoạn riêng, tránh OpenCV tự tạo thêm luồng
+    cv2.setNumThreads(1)
+    return compute_segment_signals(*args)
+
+
+class RecordedSignals:
+    """Chỉ số đã tính sẵn của một khung hình, cùng giao diện với FrameSignals"""
+
+    def __init__(self, values, is_first=False):
+        self._values = values
+        self.is_first = is_first
+
+    def __getattr__(self, name):
+        if name in SIGNAL_NAMES:
+            return float(self._values[SIGNAL_NAMES.index(name)])
+        raise AttributeError(name)
+
+
+def replay_detectors(frame_indices, signals, detectors, writer, is_first_segment=True):
+    """
+    Chạy các detector trên chỉ số đã tính sẵn thay vì trên khung hình đã giải mã
+
+    Chỉ đăng ký khung hình chính (writer.add), trả về danh sách khung hình cần đọc ảnh.
+    Trả về False trong phần tử thứ hai nếu tất cả detector đã đủ số lượng khung hình.
+    """
+    pending = []
+    for row, frame_index in enumerate(frame_indices):
+        active = [detector for detector in detectors if not detector.done]
+        if not active:
+            return pending, False
+
+        sample = SampledFrame(int(frame_index), None, None, None)
+        recorded = RecordedSignals(signals[row], is_first_segment and row == 0)
+        for detector in active:
+            for keyframe_index, meta in detector.observe(sample, recorded):
+                pending.append((detector, writer.add(detector, keyframe_index, meta)))
+
+    return pending, True
+
+
+def save_pending_keyframes(video_path, writer, pending, existing_images=None, existing_hashes=None):
+    """
+    Đọc ảnh cho các khung hình chính đã đăng ký trong một lượt duyệt có thứ tự rồi ghi ra đĩa
+
+    existing_images (tùy chọn): {frame_index: đường dẫn ảnh đã trích xuất trước đó},
+    các khung hình này được sao chép thay vì giải mã lại (nếu cùng định dạng đầu ra, xem KeyframeWriter.reuse).
+    existing_hashes (tùy chọn): {frame_index: hash của ảnh đó}, thiếu thì tính lại từ file.
+    """
+    existing_images = existing_images or {}
+    existing_hashes = existing_hashes or {}
+    by_index = collections.defaultdict(list)
+    for detector, keyframe in pending:
+        image_path = existing_images.get(keyframe['frame_number'])
+        if not image_path or not writer.reuse(keyframe, image_path, existing_hashes.get(keyframe['frame_number'])):
+            by_index[keyframe['frame_number']].append((detector, keyframe))
+
+    for frame_index, frame in read_frames_sorted(video_path, by_index.keys()):
+        for detector, keyframe in by_index[frame_index]:
+            if frame is None:
+                logging.warning(f"Không đọc được khung hình {frame_index}, bỏ qua")
+                detector.keyframes.remove(keyframe)
+            else:
+                writer.save(keyframe, frame)
+
+
+class SignalIndex:
+    """
+    Chỉ số (SIGNAL_NAMES) của mọi khung hình được lấy mẫu trong một phiên trích xuất
+
+    Được lưu thành {name}.npy (mỗi dòng: frame_index và các chỉ số) và {name}.json
+    (thông tin video và lấy mẫu), dùng để chọn lại khung hình chính với tham số khác
+    mà không cần giải mã lại video. complete=False khi lượt quét ban đầu dừng sớm
+    vì các detector đã đủ khung hình; phần còn lại được tính khi cần.
+    """
+
+    def __init__(self, info=None, table=None, complete=False):
+        self.info = dict(info or {})
+        self.complete = complete
+        self._chunks = [] if table is None else [table]
+        self._rows = []
+
+    @classmethod
+    def for_source(cls, source):
+        return cls({
+            'video_path': source.video_path,
+            'fps': source.fps,
+            'total_frames': source.total_frames,
+            'width': source.width,
+            'height': source.height,
+            'frame_skip': source.frame_skip,
+            'sampling_mode': source.sampling_mode,
+            'analysis_width': source.analysis_width
+        })
+
+    def record(self, frame_index, signals, names=SIGNAL_NAMES):
+        """Ghi chỉ số names của một khung hình vừa quét (FrameSignals), các chỉ số khác là NaN"""
+        self._rows.append([frame_index] + signal_row(signals, names))
+
+    def extend(self, frame_indices, signals):
+        """Ghi chỉ số của nhiều khung hình liên tiếp (kết quả của compute_segment_signals)"""
+        self._flush()
+        self._chunks.append(np.column_stack([frame_indices.astype(np.float64), signals]))
+
+    def _flush(self):
+        if self._rows:
+            self._chunks.append(np.array(self._rows, dtype=np.float64))
+            self._rows = []
+
+    @property
+    def table(self):
+        self._flush()
+        if not self._chunks:
+            return np.empty((0, 1 + len(SIGNAL_NAMES)), dtype=np.float64)
+        if len(self._chunks) > 1:
+            self._chunks = [np.concatenate(self._chunks)]
+        return self._chunks[0]
+
+    # Thông tin video, cùng tên thuộc tính với nguồn khung hình (dùng cho build_result)
+    fps = property(lambda self: self.info['fps'])
+    total_frames = property(lambda self: self.info['total_frames'])
+    width = property(lambda self: self.info['width'])
+    height = property(lambda self: self.info['height'])
+
+    @property
+    def frame_indices(self):
+        return self.table[:, 0].astype(np.int64)
+
+    @property
+    def signals(self):
+        return self.table[:, 1:]
+
+    def missing_signals(self, names):
+        """Các chỉ số trong names không được ghi lại (cột NaN) trong chỉ số này"""
+        signals = self.signals
+        return [name for name in names if len(signals) and np.isnan(signals[:, SIGNAL_NAMES.index(name)]).any()]
+
+    def save(self, folder, name):
+        os.makedirs(folder, exist_ok=True)
+        np.save(os.path.join(folder, f"{name}.npy"), self.table)
+        info = dict(self.info, complete=self.complete, signal_names=list(SIGNAL_NAMES))
+        with open(os.path.join(folder, f"{name}.json"), 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, folder, name):
+        """Đọc chỉ số đã lưu, FileNotFoundError nếu phiên không có chỉ số"""
+        with open(os.path.join(folder, f"{name}.json"), 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        table = np.load(os.path.join(folder, f"{name}.npy"))
+        complete = info.pop('complete', False)
+        info.pop('signal_names', None)
+        return cls(info, table, complete)
+
+
+def replay_signal_index(index, detectors, writer, existing_images=None, existing_hashes=None):
+    """
+    Chọn lại khung hình chính từ chỉ số đã lưu rồi ghi ảnh của chúng
+
+    Chỉ những khung hình chưa có trong existing_images mới được giải mã (xem save_pending_keyframes). Nếu lượt quét
+    ban đầu dừng sớm và các detector vẫn cần thêm khung hình, phần video còn lại được
+    tính bổ sung và thêm vào index.
+    """
+    video_path = index.info['video_path']
+    names = required_signals(detectors)
+    missing = index.missing_signals(names)
+    if missing:
+        raise ValueError(f"Chỉ số đã lưu không có {', '.join(missing)}, cần trích xuất lại video")
+    pending, running = replay_detectors(index.frame_indices, index.signals, detectors, writer)
+
+    if running and not index.complete and len(index.frame_indices) and os.path.exists(video_path):
+        start_frame = int(index.frame_indices[-1]) + index.info['frame_skip']
+        frame_indices, signals = compute_segment_signals(video_path, index.info['frame_skip'],
+                                                         index.info['sampling_mode'], start_frame, None,
+                                                         index.info['analysis_width'], names)
+        index.extend(frame_indices, signals)
+        index.complete = True
+        segment_pending, _ = replay_detectors(frame_indices, signals, detectors, writer, is_first_segment=False)
+        pending.extend(segment_pending)
+
+    for detector in detectors:
+        for frame_index, meta in detector.finish():
+            pending.append((detector, writer.add(detector, frame_index, meta)))
+
+    save_pending_keyframes(video_path, writer, pending, existing_images, existing_hashes)
+    writer.join()
+
+
+def plan_segments(source, workers):
+    """Chia video thành các đoạn [start, end) theo lưới lấy mẫu để xử lý song song"""
+    total_samples = max(1, -(-source.total_frames // source.frame_skip))
+    segment_count = max(1, min(workers * SEGMENTS_PER_WORKER, total_samples // MIN_SEGMENT_SAMPLES))
+    samples_per_segment = -(-total_samples // segment_count)
+
+    segments = []
+    for i in range(segment_count):
+        start = i * samples_per_segment * source.frame_skip
+        # Đoạn cuối đọc đến hết video vì số khung hình báo cáo có thể không chính xác
+        end = None if i == segment_count - 1 else (i + 1) * samples_per_segment * source.frame_skip
+        segments.append((start, end))
+    return segments
+
+
+def run_keyframe_detectors_parallel(source, detectors, writer, workers, progress=None, signal_index=None):
+    """
+    Chạy các detector song song trên nhiều tiến trình, mỗi tiến trình xử lý một đoạn video
+
+    1. Mỗi đoạn được giải mã trong một tiến trình riêng với VideoCapture riêng,
+       tiến trình chỉ trả về các chỉ số của khung hình được lấy mẫu
+    2. Các đoạn được ghép lại theo thứ tự và detector chạy tuần tự trên chỉ số,
+       nên kết quả giống hệt khi chạy tuần tự (kể cả trạng thái cảnh và lịch sử khác biệt)
+    3. Ảnh của các khung hình chính được đọc lại trong một lượt duyệt có thứ tự
+    """
+    segments = plan_segments(source, workers)
+    logging.info(f"Trích xuất song song: {len(segments)} đoạn, {workers} tiến trình")
+
+    pending = []
+    # Dùng spawn để không fork tiến trình web server đang chạy nhiều luồng
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        futures = [
+            executor.submit(_compute_segment_signals_worker,
+                            (source.video_path, source.frame_skip, source.sampling_mode, start, end,
+                             source.analysis_width, required_signals(detectors)))
+            for start, end in segments
+        ]
+        for segment_number, future in enumerate(futures):
+            frame_indices, signals = future.result()
+            if signal_index is not None:
+                signal_index.extend(frame_indices, signals)
+                signal_index.complete = segment_number == len(futures) - 1
+            segment_pending, running = replay_detectors(frame_indices, signals, detectors, writer,
+                                                        is_first_segment=segment_number == 0)
+            pending.extend(segment_pending)
+            if not running:
+                break
+            report_progress(progress, source, segments[segment_number][1] or source.total_frames)
+    finally:
+        # Không cần các đoạn còn lại khi tất cả detector đã đủ khung hình
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    for detector in detectors:
+        for frame_index, meta in detector.finish():
+            pending.append((detector, writer.add(detector, frame_index, meta)))
+
+    save_pending_keyframes(source.video_path, writer, pending)
+    writer.join()
+    report_progress(progress, source, source.total_frames)
+
+
+def build_result(source, session_id, detector):
+    """Tạo kết quả trả về cho một phương pháp trích xuất (source: nguồn khung hình hoặc SignalIndex)"""
+    result = {
+        'session_id': session_id,
+        'keyframes': detector.keyframes,
+        'total_frames': source.total_frames,
+        'fps': source.fps,
+        'duration': source.total_frames / source.fps,
+        'width': source.width,
+        'height': source.height,
+        'method': detector.method
+    }
+    result.update(detector.result_fields())
+    return result
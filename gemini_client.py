@@ -0,0 +1,149 @@
+import json
+import time
+import logging
+import threading
+import collections
+
+import google.generativeai as genai
+
+
+DEFAULT_GEMINI_MODEL = 'gemini-1.5-flash'
+
+# Cấu hình sinh nội dung mặc định, các endpoint chỉ ghi đè những giá trị khác (vd: temperature)
+DEFAULT_GENERATION_CONFIG = {
+    "temperature": 0.9,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 2048,
+}
+
+DEFAULT_SAFETY_SETTINGS = [
+    {"category": category, "threshold": "BLOCK_MEDIUM_AND_ABOVE"}
+    for category in ("HARM_CATEGORY_HARASSMENT", "HARM_CATEGORY_HATE_SPEECH",
+                     "HARM_CATEGORY_SEXUALLY_EXPLICIT", "HARM_CATEGORY_DANGEROUS_CONTENT")
+]
+
+DEFAULT_REQUEST_TIMEOUT = 120  # Thời gian chờ tối đa một lần gọi (giây)
+DEFAULT_MAX_RETRIES = 2  # Số lần thử lại khi lỗi tạm thời (quá tải, hết hạn, lỗi máy chủ)
+DEFAULT_RETRY_BACKOFF = 2.0  # Thời gian chờ trước lần thử lại đầu tiên, nhân đôi sau mỗi lần (giây)
+DEFAULT_MAX_CONCURRENCY = 4  # Số lời gọi Gemini đồng thời tối đa trong một tiến trình
+MAX_CACHED_MODELS = 32
+
+
+def generation_config(**overrides):
+    """Cấu hình sinh nội dung mặc định với các giá trị ghi đè"""
+    config = dict(DEFAULT_GENERATION_CONFIG)
+    config.update(overrides)
+    return config
+
+
+def _retryable_errors():
+    """Các lỗi tạm thời đáng thử lại"""
+    errors = (TimeoutError, ConnectionError)
+    try:
+        from google.api_core import exceptions
+    except ImportError:
+        return errors
+    return errors + (exceptions.ResourceExhausted, exceptions.ServiceUnavailable,
+                     exceptions.DeadlineExceeded, exceptions.InternalServerError)
+
+
+class GeminiClient:
+    """
+    Lớp gọi Gemini dùng chung cho mọi endpoint
+
+    GenerativeModel được tạo một lần cho mỗi bộ (tên model, cấu hình, safety settings) và
+    dùng lại giữa các request. Mọi lời gọi đi qua generate(): giới hạn số lời gọi đồng thời,
+    đặt timeout, thử lại lỗi tạm thời và ghi lại độ trễ theo từng nhãn (endpoint).
+    """
+
+    def __init__(self, timeout=DEFAULT_REQUEST_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES,
+                 retry_backoff=DEFAULT_RETRY_BACKOFF, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.timeout = timeout
+        self.max_retries = max(0, max_retries)
+        self.retry_backoff = retry_backoff
+        self.retryable_errors = _retryable_errors()
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrency))
+        self._models = collections.OrderedDict()
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def model(self, model_name=DEFAULT_GEMINI_MODEL, generation_config=None, safety_settings=None):
+        """GenerativeModel đã tạo cho bộ tham số này (tạo mới nếu chưa có)"""
+        key = (model_name, json.dumps(generation_config, sort_keys=True), json.dumps(safety_settings, sort_keys=True))
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = genai.GenerativeModel(model_name=model_name, generation_config=generation_config,
+                                              safety_settings=safety_settings)
+                self._models[key] = model
+                while len(self._models) > MAX_CACHED_MODELS:
+                    self._models.popitem(last=False)
+            else:
+                self._models.move_to_end(key)
+            return model
+
+    def generate(self, contents, label='gemini', model_name=DEFAULT_GEMINI_MODEL, generation_config=None,
+                 safety_settings=None, cancel=None, **kwargs):
+        """
+        Gọi generate_content với timeout và thử lại, trả về response của Gemini
+
+        cancel (threading.Event, tùy chọn): khi được đặt thì không thử lại nữa mà ném lại lỗi vừa gặp.
+        """
+        model = self.model(model_name, generation_config, safety_settings)
+        request_options = dict(kwargs.pop('request_options', None) or {}, timeout=self.timeout)
+        attempt = 0
+        while True:
+            start_time = time.time()
+            try:
+                with self._slots:
+                    response = model.generate_content(contents, request_options=request_options, **kwargs)
+            except self.retryable_errors as e:
+                self._record(label, time.time() - start_time, error=True)
+                if attempt >= self.max_retries or (cancel is not None and cancel.is_set()):
+                    raise
+                delay = self.retry_backoff * (2 ** attempt)
+                attempt += 1
+                logging.warning(f"Gemini ({label}) lỗi tạm thời: {str(e)}, thử lại lần {attempt} sau {delay:.1f}s")
+                self._record_retry(label)
+                if cancel is None:
+                    time.sleep(delay)
+                elif cancel.wait(delay):
+                    raise
+                continue
+            except Exception:
+                self._record(label, time.time() - start_time, error=True)
+                raise
+
+            latency = time.time() - start_time
+            self._record(label, latency)
+            logging.info(f"Gemini ({label}) hoàn thành trong {latency:.2f}s")
+            return response
+
+    def _stats(self, label):
+        return self._metrics.setdefault(label, {
+            'calls': 0, 'errors': 0, 'retries': 0, 'total_latency': 0.0, 'max_latency': 0.0
+        })
+
+    def _record(self, label, latency, error=False):
+        with self._lock:
+            stats = self._stats(label)
+            stats['calls'] += 1
+            stats['errors'] += int(error)
+            stats['total_latency'] += latency
+            stats['max_latency'] = max(stats['max_latency'], latency)
+
+    def _record_retry(self, label):
+        with self._lock:
+            self._stats(label)['retries'] += 1
+
+    def metrics(self):
+        """Thống kê lời gọi theo nhãn: số lần gọi, lỗi, thử lại, độ trễ trung bình/lớn nhất (giây)"""
+        with self._lock:
+            return {
+                label: dict(stats,
+                            avg_latency=round(stats['total_latency'] / stats['calls'], 4) if stats['calls'] else 0.0,
+                            total_latency=round(stats['total_latency'], 4),
+                            max_latency=round(stats['max_latency'], 4))
+                for label, stats in self._metrics.items()
+            }
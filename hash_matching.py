@@ -0,0 +1,110 @@
+import numpy as np
+
+
+HASH_BITS = 64
+PAIR_BLOCK_SIZE = 512  # Số hash mỗi khối khi so sánh từng cặp
+
+# Multi-index hashing chỉ có lợi khi bán kính nhỏ (mỗi đoạn dài ít nhất 16 bit) và số hash lớn
+MULTI_INDEX_MAX_DISTANCE = 3
+MULTI_INDEX_MIN_HASHES = 2000
+
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount64(values):
+    """Số bit 1 của từng phần tử trong mảng uint64"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    bytes_view = np.ascontiguousarray(values).view(np.uint8).reshape(values.shape + (8,))
+    return _POPCOUNT_TABLE[bytes_view].sum(axis=-1, dtype=np.uint8)
+
+
+def hash_to_int(image_hash):
+    """Chuyển hash 64 bit (ImageHash hoặc chuỗi hex) thành số nguyên"""
+    return int(str(image_hash), 16)
+
+
+def pack_hashes(hashes):
+    """Gói danh sách hash 64 bit (ImageHash, chuỗi hex hoặc int) vào mảng uint64"""
+    return np.array([value if isinstance(value, int) else hash_to_int(value) for value in hashes],
+                    dtype=np.uint64)
+
+
+def _empty_pairs():
+    return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+
+
+def _blocked_pairs(hashes, max_distance, block_size=PAIR_BLOCK_SIZE):
+    """So sánh mọi cặp theo từng khối hàng: XOR rồi đếm bit, không tạo ma trận n x n"""
+    count = len(hashes)
+    found_i, found_j, found_distance = [], [], []
+    for start in range(0, count - 1, block_size):
+        stop = min(start + block_size, count)
+        distances = popcount64(hashes[start:stop, None] ^ hashes[None, start:])
+
+        # Chỉ giữ các cặp i < j
+        mask = distances <= max_distance
+        mask &= np.arange(start, count)[None, :] > np.arange(start, stop)[:, None]
+        rows, columns = np.nonzero(mask)
+        found_i.append(rows + start)
+        found_j.append(columns + start)
+        found_distance.append(distances[rows, columns])
+
+    if not found_i:
+        return _empty_pairs()
+    return np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_distance)
+
+
+def _multi_index_pairs(hashes, max_distance):
+    """
+    Multi-index hashing: chia 64 bit thành max_distance + 1 đoạn
+
+    Hai hash cách nhau không quá max_distance bit chắc chắn trùng nhau ở ít nhất một đoạn,
+    nên chỉ cần so sánh các cặp cùng nhóm trong một đoạn nào đó.
+    """
+    count = len(hashes)
+    bounds = np.linspace(0, HASH_BITS, max_distance + 2).astype(int)
+    candidates = []
+    for low, high in zip(bounds[:-1], bounds[1:]):
+        keys = (hashes >> np.uint64(low)) & np.uint64((1 << int(high - low)) - 1)
+        order = np.argsort(keys, kind='stable')
+        groups = np.split(order, np.flatnonzero(np.diff(keys[order])) + 1)
+        for group in groups:
+            if len(group) < 2:
+                continue
+            group = np.sort(group)
+            rows, columns = np.triu_indices(len(group), 1)
+            candidates.append(group[rows] * count + group[columns])
+
+    if not candidates:
+        return _empty_pairs()
+
+    # Mã hóa cặp (i, j) thành i * count + j: loại trùng và sắp xếp theo (i, j) cùng lúc
+    pair_codes = np.unique(np.concatenate(candidates))
+    pair_i, pair_j = pair_codes // count, pair_codes % count
+    distances = popcount64(hashes[pair_i] ^ hashes[pair_j])
+    keep = distances <= max_distance
+    return pair_i[keep], pair_j[keep], distances[keep]
+
+
+def find_similar_pairs(hashes, max_distance, method='auto'):
+    """
+    Tìm mọi cặp (i, j), i < j, có khoảng cách Hamming không quá max_distance
+
+    hashes: mảng uint64 (xem pack_hashes)
+    method: 'blocked' (so sánh vector hóa theo khối), 'multi_index' hoặc 'auto'
+    Trả về (i, j, distance) sắp xếp theo i rồi j, cùng thứ tự với vòng lặp lồng nhau.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    if len(hashes) < 2 or max_distance < 0:
+        return _empty_pairs()
+
+    if method == 'auto':
+        use_multi_index = len(hashes) >= MULTI_INDEX_MIN_HASHES and max_distance <= MULTI_INDEX_MAX_DISTANCE
+        method = 'multi_index' if use_multi_index else 'blocked'
+
+    if method == 'multi_index':
+        return _multi_index_pairs(hashes, max_distance)
+    if method == 'blocked':
+        return _blocked_pairs(hashes, max_distance)
+    raise ValueError(f"Phương pháp so sánh hash không hợp lệ: {method}")
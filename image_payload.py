@@ -0,0 +1,82 @@
+import os
+import base64
+import threading
+import collections
+from io import BytesIO
+
+from PIL import Image
+
+
+DEFAULT_IMAGE_MAX_EDGE = 1024  # Cạnh dài nhất của ảnh gửi lên API (pixel)
+DEFAULT_IMAGE_QUALITY = 85  # Chất lượng JPEG khi nén lại
+DEFAULT_PAYLOAD_CACHE_BYTES = 64 * 1024 * 1024  # Dung lượng tối đa của các ảnh đã chuẩn bị giữ trong bộ nhớ
+
+
+def prepare_image(data, max_edge=DEFAULT_IMAGE_MAX_EDGE, quality=DEFAULT_IMAGE_QUALITY):
+    """
+    Thu nhỏ ảnh để cạnh dài nhất không quá max_edge rồi nén lại JPEG, trả về bytes JPEG
+
+    Ảnh JPEG đã đủ nhỏ được giữ nguyên để tránh nén lại nhiều lần.
+    """
+    image = Image.open(BytesIO(data))
+    if image.format == 'JPEG' and max(image.size) <= max_edge:
+        return data
+
+    # Với JPEG, giải mã trực tiếp ở tỉ lệ nhỏ hơn (1/2, 1/4, 1/8) thay vì giải mã toàn bộ ảnh 4K
+    image.draft('RGB', (max_edge, max_edge))
+    image = image.convert('RGB')
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    output = BytesIO()
+    image.save(output, format='JPEG', quality=quality, optimize=True)
+    return output.getvalue()
+
+
+class ImagePayloadCache:
+    """
+    Ảnh khung hình đã thu nhỏ, nén lại và mã hóa base64 để gửi lên API
+
+    Mỗi file chỉ được xử lý một lần cho đến khi thay đổi (theo mtime và kích thước);
+    các ảnh đã chuẩn bị được giữ trong bộ nhớ tối đa max_bytes, cũ nhất bị loại trước (LRU).
+    """
+
+    def __init__(self, max_edge=DEFAULT_IMAGE_MAX_EDGE, quality=DEFAULT_IMAGE_QUALITY,
+                 max_bytes=DEFAULT_PAYLOAD_CACHE_BYTES):
+        self.max_edge = max_edge
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def settings(self):
+        """Tham số xử lý ảnh (dùng trong khóa cache của phản hồi API)"""
+        return {'max_edge': self.max_edge, 'quality': self.quality}
+
+    def encode(self, path):
+        """Ảnh đã chuẩn bị của file path dưới dạng chuỗi base64"""
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                return payload
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        payload = base64.b64encode(prepare_image(data, self.max_edge, self.quality)).decode('utf-8')
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = payload
+                self._size += len(payload)
+            while self._size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+        return payload
+
+    def inline_data(self, path):
+        """Phần inline_data của request Gemini cho ảnh tại path"""
+        return {"mime_type": "image/jpeg", "data": self.encode(path)}
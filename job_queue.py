@@ -0,0 +1,218 @@
+import os
+import json
+import uuid
+import time
+import sqlite3
+import logging
+import contextlib
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Trạng thái của một job
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+
+DEFAULT_JOB_WORKERS = 2
+MAX_FINISHED_JOBS = 200  # Số job đã xong được giữ lại để client lấy kết quả
+JOB_SAVE_INTERVAL = 0.5  # Khoảng cách tối thiểu giữa hai lần lưu tiến độ trong cùng giai đoạn (giây)
+SQLITE_BUSY_TIMEOUT = 10  # Thời gian chờ khóa cơ sở dữ liệu (giây)
+
+
+class Job:
+    """
+    Một tác vụ xử lý video chạy nền
+
+    Hàm xử lý nhận job làm tham số đầu tiên và gọi job.update(stage, progress)
+    để báo giai đoạn hiện tại và tiến độ trong giai đoạn đó (0.0 - 1.0).
+    """
+
+    def __init__(self, kind, stages=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.stages = list(stages or [])
+        self.status = JOB_QUEUED
+        self.stage = None
+        self.stage_progress = 0.0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.on_change = None  # Gọi khi trạng thái thay đổi (JobQueue dùng để lưu vào JobStore)
+        self._saved_at = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, stage, progress=0.0):
+        with self._lock:
+            new_stage = stage != self.stage
+            if stage not in self.stages:
+                self.stages.append(stage)
+            self.stage = stage
+            self.stage_progress = max(0.0, min(1.0, progress))
+        self.changed(force=new_stage)
+
+    def changed(self, force=False):
+        """Báo trạng thái thay đổi; tiến độ trong cùng giai đoạn chỉ được báo mỗi JOB_SAVE_INTERVAL giây"""
+        if self.on_change is None:
+            return
+        now = time.time()
+        if not force and now - self._saved_at < JOB_SAVE_INTERVAL:
+            return
+        self._saved_at = now
+        self.on_change(self)
+
+    def stage_callback(self, stage):
+        """Callback tiến độ (nhận tỉ lệ 0.0 - 1.0) cho một giai đoạn"""
+        self.update(stage)
+        return lambda progress: self.update(stage, progress)
+
+    @property
+    def finished(self):
+        return self.status in (JOB_COMPLETED, JOB_FAILED)
+
+    @property
+    def progress(self):
+        """Tiến độ tổng thể, mỗi giai đoạn chiếm một phần bằng nhau"""
+        if self.status == JOB_COMPLETED:
+            return 1.0
+        if not self.stages or self.stage is None:
+            return 0.0
+        return (self.stages.index(self.stage) + self.stage_progress) / len(self.stages)
+
+    def to_dict(self):
+        with self._lock:
+            data = {
+                'job_id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'stage': self.stage,
+                'stages': list(self.stages),
+                'stage_progress': round(self.stage_progress, 4),
+                'progress': round(self.progress, 4),
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at
+            }
+            if self.status == JOB_COMPLETED:
+                data['result'] = self.result
+            elif self.status == JOB_FAILED:
+                data['error'] = self.error
+            return data
+
+
+class JobStore:
+    """
+    Trạng thái job (kết quả của Job.to_dict) lưu trong SQLite, dùng chung giữa các tiến trình worker
+
+    Job chạy trong tiến trình đã nhận request, nhưng request /jobs/<job_id> có thể đến
+    bất kỳ worker nào. Chỉ giữ lại max_finished_jobs job đã xong gần nhất.
+    """
+
+    def __init__(self, db_path, max_finished_jobs=MAX_FINISHED_JOBS):
+        self.db_path = db_path
+        self.max_finished_jobs = max_finished_jobs
+        folder = os.path.dirname(db_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS jobs "
+                         "(id TEXT PRIMARY KEY, data TEXT NOT NULL, finished INTEGER NOT NULL, "
+                         "updated_at REAL NOT NULL)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def save(self, data):
+        """Ghi trạng thái job, dọn bớt các job đã xong cũ nhất khi job vừa xong"""
+        finished = data['status'] in (JOB_COMPLETED, JOB_FAILED)
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("INSERT OR REPLACE INTO jobs (id, data, finished, updated_at) VALUES (?, ?, ?, ?)",
+                         (data['job_id'], json.dumps(data, ensure_ascii=False), int(finished), time.time()))
+            if finished:
+                conn.execute("DELETE FROM jobs WHERE finished = 1 AND id NOT IN "
+                             "(SELECT id FROM jobs WHERE finished = 1 ORDER BY updated_at DESC LIMIT ?)",
+                             (self.max_finished_jobs,))
+
+    def load(self, job_id):
+        """Trạng thái job đã lưu hoặc None"""
+        with contextlib.closing(self._connect()) as conn:
+            row = conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+class JobQueue:
+    """
+    Hàng đợi job chạy trên một nhóm luồng cố định
+
+    Request chỉ đăng ký job và trả về ngay, việc tải video, trích xuất khung hình,
+    tách âm thanh và phiên âm chạy trong các luồng của hàng đợi.
+    Với db_path, trạng thái job được lưu vào JobStore để mọi tiến trình worker đều trả lời được.
+    """
+
+    def __init__(self, max_workers=DEFAULT_JOB_WORKERS, max_finished_jobs=MAX_FINISHED_JOBS, db_path=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.max_finished_jobs = max_finished_jobs
+        self.store = JobStore(db_path, max_finished_jobs) if db_path else None
+        self.jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind, func, *args, stages=None, **kwargs):
+        """Đăng ký job mới, func(job, *args, **kwargs) trả về kết quả của job"""
+        job = Job(kind, stages)
+        if self.store is not None:
+            job.on_change = self._save
+            job.changed(force=True)
+        with self._lock:
+            self.jobs[job.id] = job
+            self._evict_finished()
+        self.executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def status(self, job_id):
+        """Trạng thái job (Job.to_dict) của tiến trình này hoặc từ JobStore, None nếu không có"""
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if self.store is not None:
+            return self.store.load(job_id)
+        return None
+
+    def _save(self, job):
+        try:
+            self.store.save(job.to_dict())
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logging.error(f"Không lưu được trạng thái job {job.id}: {str(e)}")
+
+    def _run(self, job, func, args, kwargs):
+        with job._lock:
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+        job.changed(force=True)
+        try:
+            result = func(job, *args, **kwargs)
+            with job._lock:
+                job.result = result
+                job.status = JOB_COMPLETED
+                job.finished_at = time.time()
+        except Exception as e:
+            logging.error(f"Job {job.id} ({job.kind}) thất bại: {str(e)}")
+            with job._lock:
+                job.error = str(e)
+                job.status = JOB_FAILED
+                job.finished_at = time.time()
+        job.changed(force=True)
+
+    def _evict_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import uuid
+import logging
+import functools
+import threading
+import contextlib
+import collections
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ khóa trong tiến trình
+    fcntl = None
+
+
+DEFAULT_MAX_SESSIONS = 100  # Số phiên giữ trong bộ nhớ cùng lúc (manifest trên đĩa không giới hạn)
+# Khóa file dùng chung cho mọi manifest: một file duy nhất, không để lại file khóa theo từng phiên
+# (tên bắt đầu bằng dấu chấm nên không trùng session_id nào)
+MANIFEST_LOCK_NAME = '.manifests.lock'
+
+
+def frame_key(frame):
+    """Khóa của khung hình trong phiên: id, hoặc đường dẫn nếu khung hình chưa có id"""
+    return frame.get('id') or frame.get('path')
+
+
+def session_id_from_path(path):
+    """Session ID từ đường dẫn keyframe dạng uploads/keyframes/<session_id>/<file>"""
+    return os.path.basename(os.path.dirname(os.path.normpath(path)))
+
+
+class SessionKeyframes:
+    """
+    Danh sách keyframes của một phiên, tra cứu theo id và theo đường dẫn
+
+    Thứ tự khung hình được giữ nguyên; xóa nhiều khung hình cùng lúc chỉ tốn O(k).
+    Mọi thao tác đều giữ khóa của phiên nên an toàn khi nhiều request cùng cập nhật.
+    on_change (tùy chọn) nhận danh sách keyframes sau mỗi lần thay đổi (vd: để ghi manifest).
+    sync (tùy chọn) tạo context manager bao quanh mỗi lần thay đổi, trả về danh sách keyframes
+    mới nhất (vd: manifest do worker khác ghi) để thay đổi được áp dụng lên đó, hoặc None.
+    """
+
+    def __init__(self, keyframes=(), on_change=None, sync=None):
+        self._lock = threading.Lock()
+        self._on_change = on_change
+        self._sync = sync
+        self._by_key = collections.OrderedDict()
+        self._by_path = collections.defaultdict(list)
+        self._index(keyframes)
+
+    def _index(self, keyframes):
+        self._by_key.clear()
+        self._by_path.clear()
+        for frame in keyframes:
+            self._by_key[frame_key(frame)] = frame
+            self._by_path[frame.get('path')].append(frame)
+
+    def _changed(self):
+        if self._on_change is not None:
+            self._on_change(list(self._by_key.values()))
+
+    @contextlib.contextmanager
+    def _edit(self):
+        if self._sync is None:
+            yield
+            return
+        with self._sync() as latest:
+            if latest is not None:
+                self._index(latest)
+            yield
+
+    def replace(self, keyframes):
+        with self._lock, self._edit():
+            self._index(keyframes)
+            self._changed()
+
+    def list(self):
+        """Bản sao danh sách keyframes theo thứ tự ban đầu"""
+        with self._lock:
+            return [dict(frame) for frame in self._by_key.values()]
+
+    def get(self, frame_id):
+        with self._lock:
+            frame = self._by_key.get(frame_id)
+            return dict(frame) if frame else None
+
+    def find_by_path(self, path):
+        """Khung hình đầu tiên có đường dẫn path"""
+        with self._lock:
+            frames = self._by_path.get(path)
+            return dict(frames[0]) if frames else None
+
+    def update_many(self, updates):
+        """Cập nhật trường của nhiều khung hình: {frame_id: {trường: giá trị}}"""
+        with self._lock, self._edit():
+            for frame_id, fields in updates.items():
+                frame = self._by_key.get(frame_id)
+                if frame is not None:
+                    frame.update(fields)
+            self._changed()
+
+    def remove_many(self, frame_ids):
+        """Xóa nhiều khung hình theo id, trả về danh sách id đã xóa"""
+        removed = []
+        with self._lock, self._edit():
+            for frame_id in frame_ids:
+                frame = self._by_key.pop(frame_id, None)
+                if frame is None:
+                    continue
+                removed.append(frame_id)
+                frames = self._by_path[frame.get('path')]
+                frames[:] = [other for other in frames if other is not frame]
+                if not frames:
+                    del self._by_path[frame.get('path')]
+            if removed:
+                self._changed()
+        return removed
+
+    def __len__(self):
+        with self._lock:
+            return len(self._by_key)
+
+
+class KeyframeStore:
+    """
+    Keyframes của các phiên, lưu trong manifest JSON trên đĩa và giữ bản đã tải trong bộ nhớ
+
+    Mỗi lần trích xuất hoặc cập nhật, manifest {session_id}.json trong manifest_folder được ghi lại,
+    nên thông tin phiên còn nguyên sau khi khởi động lại và dùng chung giữa các worker.
+    Bộ nhớ giữ tối đa max_sessions phiên (LRU); phiên được tải lại khi manifest bị worker khác thay đổi.
+    Mỗi lần cập nhật giữ khóa file MANIFEST_LOCK_NAME và áp dụng lên manifest mới nhất trên đĩa,
+    nên cập nhật đồng thời từ nhiều worker không làm mất thay đổi của nhau.
+    Không có manifest_folder thì chỉ lưu trong bộ nhớ.
+    """
+
+    def __init__(self, max_sessions=DEFAULT_MAX_SESSIONS, manifest_folder=None):
+        self.max_sessions = max(1, max_sessions)
+        self.manifest_folder = manifest_folder
+        self.sessions = collections.OrderedDict()
+        self._loaded_versions = {}
+        self._lock = threading.Lock()
+        if manifest_folder:
+            os.makedirs(manifest_folder, exist_ok=True)
+
+    def _manifest_path(self, session_id):
+        # Chỉ chấp nhận tên file đơn giản để session_id từ request không thoát khỏi thư mục manifest
+        if not self.manifest_folder or not session_id or os.path.basename(session_id) != session_id:
+            return None
+        return os.path.join(self.manifest_folder, f"{session_id}.json")
+
+    @staticmethod
+    def _version(manifest_path):
+        try:
+            stat = os.stat(manifest_path)
+        except (OSError, TypeError):
+            return None
+        # Manifest luôn được ghi bằng file mới rồi đổi tên nên inode đổi sau mỗi lần ghi
+        return stat.st_mtime_ns, stat.st_ino
+
+    @contextlib.contextmanager
+    def _manifest_lock(self, session_id):
+        """Khóa file dùng chung giữa các tiến trình cho việc ghi manifest của phiên"""
+        if self._manifest_path(session_id) is None or fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.manifest_folder, MANIFEST_LOCK_NAME), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_manifest(self, session_id):
+        """Keyframes trong manifest của phiên, None nếu không có hoặc không đọc được"""
+        manifest_path = self._manifest_path(session_id)
+        if manifest_path is None:
+            return None
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('keyframes', [])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.error(f"Không đọc được manifest của phiên {session_id}: {str(e)}")
+            return None
+
+    @contextlib.contextmanager
+    def _sync(self, session_id):
+        """Giữ khóa manifest trong lúc phiên được cập nhật, trả về keyframes mới nhất trên đĩa"""
+        with self._manifest_lock(session_id):
+            yield self._read_manifest(session_id)
+
+    def _write_manifest(self, session_id, keyframes):
+        manifest_path = self._manifest_path(session_id)
+        if manifest_path is None:
+            return
+        temp_path = f"{manifest_path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'session_id': session_id, 'updated_at': time.time(), 'keyframes': keyframes},
+                      f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temp_path, manifest_path)
+        with self._lock:
+            self._loaded_versions[session_id] = self._version(manifest_path)
+
+    def _new_session(self, session_id, keyframes):
+        return SessionKeyframes(keyframes, on_change=functools.partial(self._write_manifest, session_id),
+                                sync=functools.partial(self._sync, session_id))
+
+    def _cache(self, session_id, session, version):
+        self.sessions[session_id] = session
+        self.sessions.move_to_end(session_id)
+        self._loaded_versions[session_id] = version
+        while len(self.sessions) > self.max_sessions:
+            evicted_id, _ = self.sessions.popitem(last=False)
+            self._loaded_versions.pop(evicted_id, None)
+
+    def set(self, session_id, keyframes):
+        """Lưu (thay thế) keyframes của một phiên và ghi manifest"""
+        keyframes = list(keyframes)
+        session = self._new_session(session_id, keyframes)
+        with self._manifest_lock(session_id):
+            self._write_manifest(session_id, keyframes)
+        with self._lock:
+            self._cache(session_id, session, self._version(self._manifest_path(session_id)))
+        return session
+
+    def get(self, session_id):
+        """Keyframes của phiên hoặc None nếu phiên không có trong bộ nhớ lẫn trên đĩa"""
+        manifest_path = self._manifest_path(session_id)
+        version = self._version(manifest_path)
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is not None and (manifest_path is None or version == self._loaded_versions.get(session_id)):
+                self.sessions.move_to_end(session_id)
+                return session
+        if version is None:
+            # Manifest đã bị xóa (vd: phiên bị dọn khỏi cache) thì bỏ bản trong bộ nhớ
+            if manifest_path is not None:
+                self.discard(session_id)
+            return None
+
+        keyframes = self._read_manifest(session_id)
+        if keyframes is None:
+            return None
+        session = self._new_session(session_id, keyframes)
+        with self._lock:
+            self._cache(session_id, session, version)
+        return session
+
+    def session(self, session_id):
+        """Keyframes của phiên, phiên chưa có thì trả về danh sách rỗng (không lưu lại)"""
+        session = self.get(session_id)
+        return session if session is not None else SessionKeyframes()
+
+    def find_by_path(self, path, session_id=None):
+        """Tìm khung hình theo đường dẫn, session_id mặc định lấy từ đường dẫn"""
+        session = self.get(session_id or session_id_from_path(path))
+        return session.find_by_path(path) if session is not None else None
+
+    def discard(self, session_id):
+        """Bỏ phiên khỏi bộ nhớ (manifest trên đĩa giữ nguyên)"""
+        with self._lock:
+            self.sessions.pop(session_id, None)
+            self._loaded_versions.pop(session_id, None)
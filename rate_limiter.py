@@ -0,0 +1,120 @@
+import os
+import time
+import uuid
+import sqlite3
+import logging
+import contextlib
+
+
+# Độ ưu tiên khi chờ lượt gọi API (số nhỏ được phục vụ trước)
+PRIORITY_INTERACTIVE = 0  # Người dùng đang chờ kết quả (tạo kịch bản, tạo ảnh...)
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2  # Gọi hàng loạt (tạo prompt cho nhiều khung hình, so sánh ảnh trùng lặp)
+
+POLL_INTERVAL = 0.25  # Thời gian chờ tối đa giữa hai lần kiểm tra lượt (giây)
+SQLITE_BUSY_TIMEOUT = 10  # Thời gian chờ khóa cơ sở dữ liệu (giây)
+
+
+class RateLimitExceeded(Exception):
+    """Không lấy được lượt gọi API trong thời gian chờ cho phép"""
+
+
+class TokenBucketRateLimiter:
+    """
+    Giới hạn tốc độ theo token bucket, dùng chung giữa các tiến trình worker qua SQLite
+
+    Bucket chứa tối đa capacity lượt và được nạp lại đều capacity lượt mỗi window giây.
+    Khi hết lượt, acquire() xếp hàng chờ đến hạn timeout thay vì từ chối ngay; hàng đợi
+    cũng nằm trong SQLite nên request có độ ưu tiên cao ở mọi worker được phục vụ trước.
+    """
+
+    def __init__(self, db_path, capacity, window, name='default'):
+        self.db_path = db_path
+        self.capacity = float(capacity)
+        self.rate = capacity / float(window)  # Số lượt được nạp lại mỗi giây
+        self.name = name
+        folder = os.path.dirname(db_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets "
+                         "(name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS waiters "
+                         "(id TEXT PRIMARY KEY, bucket TEXT NOT NULL, priority INTEGER NOT NULL, "
+                         "enqueued_at REAL NOT NULL, deadline REAL NOT NULL)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _refill(self, conn, now):
+        """Số lượt hiện có sau khi nạp lại theo thời gian đã trôi qua"""
+        row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (self.name,)).fetchone()
+        if row is None:
+            tokens = self.capacity
+        else:
+            tokens = min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate)
+        conn.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                     (self.name, tokens, now))
+        return tokens
+
+    def _try_take(self, conn, waiter):
+        """
+        Lấy một lượt cho waiter nếu đủ lượt cho cả những waiter xếp trước nó
+
+        Trả về 0 khi đã lấy được lượt, ngược lại là số giây ước tính cần chờ.
+        """
+        waiter_id, priority, enqueued_at = waiter
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Waiter của tiến trình đã chết sẽ không tự xóa, bỏ qua khi quá hạn
+            conn.execute("DELETE FROM waiters WHERE bucket = ? AND deadline < ?", (self.name, now))
+            tokens = self._refill(conn, now)
+            ahead = conn.execute(
+                "SELECT COUNT(*) FROM waiters WHERE bucket = ? AND id != ? AND "
+                "(priority < ? OR (priority = ? AND enqueued_at < ?) OR "
+                "(priority = ? AND enqueued_at = ? AND id < ?))",
+                (self.name, waiter_id, priority, priority, enqueued_at, priority, enqueued_at, waiter_id)
+            ).fetchone()[0]
+            needed = ahead + 1
+            if tokens >= needed:
+                conn.execute("UPDATE buckets SET tokens = ? WHERE name = ?", (tokens - 1, self.name))
+                conn.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+                conn.execute("COMMIT")
+                return 0
+            conn.execute("COMMIT")
+            return (needed - tokens) / self.rate
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def acquire(self, priority=PRIORITY_NORMAL, timeout=0, cancel=None):
+        """
+        Lấy một lượt gọi API, chờ tối đa timeout giây
+
+        Trả về True nếu lấy được lượt, False nếu hết hạn chờ (timeout=0: không chờ)
+        hoặc cancel (threading.Event, tùy chọn) được đặt trong lúc chờ.
+        """
+        now = time.time()
+        deadline = now + max(0.0, timeout)
+        waiter = (uuid.uuid4().hex, priority, now)
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("INSERT INTO waiters (id, bucket, priority, enqueued_at, deadline) VALUES (?, ?, ?, ?, ?)",
+                         (waiter[0], self.name, priority, now, deadline + POLL_INTERVAL))
+            try:
+                while True:
+                    wait = self._try_take(conn, waiter)
+                    if wait == 0:
+                        return True
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        logging.warning(f"Hết thời gian chờ lượt gọi API ({self.name}, ưu tiên {priority})")
+                        return False
+                    if cancel is None:
+                        time.sleep(min(wait, remaining, POLL_INTERVAL))
+                    elif cancel.wait(min(wait, remaining, POLL_INTERVAL)):
+                        return False
+            finally:
+                conn.execute("DELETE FROM waiters WHERE id = ?", (waiter[0],))
@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+
+
+DEFAULT_RESPONSE_CACHE_TTL = 7 * 24 * 3600  # Thời gian giữ một phản hồi (giây)
+DEFAULT_RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # Dung lượng tối đa của thư mục cache
+
+
+class ResponseCache:
+    """
+    Cache phản hồi API trên đĩa, mỗi phản hồi là một file JSON đặt tên theo khóa
+
+    Phản hồi quá ttl giây bị bỏ qua và xóa khi đọc. Khi tổng dung lượng vượt quá max_bytes,
+    các phản hồi ít được dùng gần đây nhất bị xóa trước. Thư mục có thể dùng chung giữa các worker.
+    """
+
+    def __init__(self, cache_folder, ttl=DEFAULT_RESPONSE_CACHE_TTL, max_bytes=DEFAULT_RESPONSE_CACHE_MAX_BYTES):
+        self.cache_folder = cache_folder
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_folder, exist_ok=True)
+
+    @staticmethod
+    def key(**parts):
+        """Khóa cache từ các thành phần ảnh hưởng đến phản hồi (hash nội dung, prompt, cấu hình model...)"""
+        payload = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_folder, f"{key}.json")
+
+    def get(self, key):
+        """Phản hồi đã lưu hoặc None nếu chưa có/đã hết hạn"""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - entry.get('created_at', 0) > self.ttl:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        # Đánh dấu lần dùng gần nhất cho việc loại bỏ LRU
+        try:
+            now = time.time()
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        return entry.get('value')
+
+    def put(self, key, value):
+        path = self._path(key)
+        # Tên file tạm duy nhất giữa các tiến trình (ident của luồng có thể trùng giữa các worker)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'created_at': time.time(), 'value': value}, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            now = time.time()
+            for name in os.listdir(self.cache_folder):
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(self.cache_folder, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+                total += stat.st_size
+
+            for used_at, path, size in sorted(entries):
+                # Xóa các phản hồi lâu không dùng đã quá hạn hoặc khi vượt dung lượng
+                if total <= self.max_bytes and now - used_at <= self.ttl:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
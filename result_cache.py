@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+DEFAULT_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # Dung lượng tối đa của thư mục keyframes (2GB)
+EVICT_SCAN_INTERVAL = 300  # Đo lại toàn bộ thư mục keyframes ít nhất mỗi khoảng này (giây)
+
+
+def copy_stream_with_hash(stream, file_path, chunk_size=HASH_CHUNK_SIZE):
+    """Ghi stream ra file và tính SHA-256 trong cùng một lượt đọc, trả về mã hash"""
+    digest = hashlib.sha256()
+    with open(file_path, 'wb') as f:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+
+def hash_file(file_path, chunk_size=HASH_CHUNK_SIZE):
+    """SHA-256 của một file đã có trên đĩa (vd: video tải từ URL)"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _link_or_copy(src, dst):
+    """Tạo hard link (không tốn thêm dung lượng), sao chép nếu hệ thống file không hỗ trợ"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _rebase_session(value, old_session_id, new_session_id):
+    """Đổi session ID trong kết quả (session_id và đường dẫn ảnh .../old/... thành .../new/...)"""
+    if isinstance(value, dict):
+        return {key: _rebase_session(item, old_session_id, new_session_id) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_rebase_session(item, old_session_id, new_session_id) for item in value]
+    if isinstance(value, str):
+        if value == old_session_id:
+            return new_session_id
+        for sep in {'/', os.sep}:
+            value = value.replace(f"{sep}{old_session_id}{sep}", f"{sep}{new_session_id}{sep}")
+    return value
+
+
+def _folder_size(folder):
+    total = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ResultCache:
+    """
+    Cache kết quả trích xuất theo nội dung video và tham số trích xuất
+
+    Mỗi kết quả được lưu dưới dạng manifest JSON tên theo khóa; ảnh khung hình nằm
+    trong thư mục phiên ở keyframes_folder. Khi thư mục keyframes vượt quá max_bytes,
+    các phiên ít được dùng gần đây nhất bị xóa cùng manifest của chúng và các file
+    {session_id}.* trong companion_folders. Dung lượng được cộng dần theo từng phiên được lưu,
+    chỉ đo lại cả thư mục khi vượt max_bytes hoặc sau EVICT_SCAN_INTERVAL giây.
+
+    Phiên trong cache không được trả thẳng cho request khác: get(key, session_id) tạo bản sao
+    của phiên (hard link ảnh) để việc xóa/sửa keyframes của một người không ảnh hưởng người khác.
+    """
+
+    def __init__(self, cache_folder, keyframes_folder, max_bytes=DEFAULT_CACHE_MAX_BYTES, companion_folders=()):
+        self.cache_folder = cache_folder
+        self.keyframes_folder = keyframes_folder
+        self.max_bytes = max_bytes
+        self.companion_folders = list(companion_folders)
+        self._lock = threading.Lock()
+        self._total_bytes = None  # Dung lượng ước tính của thư mục keyframes (None: chưa đo)
+        self._scanned_at = 0.0
+        os.makedirs(cache_folder, exist_ok=True)
+
+    @staticmethod
+    def key(video_hash, params):
+        """Khóa cache từ hash của video và các tham số ảnh hưởng đến kết quả"""
+        payload = json.dumps({'video': video_hash, 'params': params}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _manifest_path(self, key):
+        return os.path.join(self.cache_folder, f"{key}.json")
+
+    def _is_complete(self, result):
+        """Kiểm tra mọi ảnh khung hình của kết quả vẫn còn trên đĩa"""
+        session_folder = os.path.join(self.keyframes_folder, result.get('session_id', ''))
+        results = [result] + list(result.get('results', {}).values())
+        return all(
+            os.path.exists(os.path.join(session_folder, os.path.basename(keyframe['path'])))
+            for item in results for keyframe in item.get('keyframes', [])
+        )
+
+    def get(self, key, session_id=None):
+        """
+        Trả về kết quả đã lưu hoặc None nếu chưa có/ảnh đã bị xóa
+
+        Với session_id, kết quả trả về thuộc một bản sao của phiên đã lưu mang tên session_id.
+        """
+        manifest_path = self._manifest_path(key)
+        with self._lock:
+            try:
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    result = json.load(f)
+            except (OSError, ValueError):
+                return None
+
+            if not self._is_complete(result):
+                os.remove(manifest_path)
+                return None
+
+            # Đánh dấu lần dùng gần nhất cho việc loại bỏ LRU
+            now = time.time()
+            os.utime(manifest_path, (now, now))
+            if session_id is not None:
+                result = self._clone_session(result, session_id)
+            return result
+
+    def _clone_session(self, result, session_id):
+        """Sao chép phiên của result (ảnh bằng hard link, file đi kèm bằng bản sao) sang session_id"""
+        source_id = result['session_id']
+        shutil.copytree(os.path.join(self.keyframes_folder, source_id), os.path.join(self.keyframes_folder, session_id),
+                        copy_function=_link_or_copy)
+        for folder in self.companion_folders:
+            if not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                stem, ext = os.path.splitext(name)
+                if stem == source_id:
+                    # File đi kèm (vd: chỉ số khung hình) được ghi đè tại chỗ nên không dùng hard link
+                    shutil.copy2(os.path.join(folder, name), os.path.join(folder, f"{session_id}{ext}"))
+        return _rebase_session(result, source_id, session_id)
+
+    def put(self, key, result):
+        """Lưu kết quả và dọn bớt thư mục keyframes nếu vượt quá dung lượng"""
+        with self._lock:
+            manifest_path = self._manifest_path(key)
+            temp_path = f"{manifest_path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False)
+            os.replace(temp_path, manifest_path)
+
+            now = time.time()
+            if self._total_bytes is not None and now - self._scanned_at < EVICT_SCAN_INTERVAL:
+                session_folder = os.path.join(self.keyframes_folder, result.get('session_id', ''))
+                self._total_bytes += _folder_size(session_folder)
+                if self._total_bytes <= self.max_bytes:
+                    return
+            self._total_bytes = self._evict(keep=result.get('session_id'))
+            self._scanned_at = now
+
+    def _evict(self, keep=None):
+        """Xóa các phiên ít được dùng gần đây nhất đến khi không vượt max_bytes, trả về dung lượng còn lại"""
+        if not os.path.isdir(self.keyframes_folder):
+            return 0
+
+        # Lần dùng gần nhất của mỗi phiên: manifest được truy cập gần nhất hoặc thời điểm ghi thư mục
+        manifests_by_session = {}
+        last_used = {}
+        for name in os.listdir(self.cache_folder):
+            if not name.endswith('.json'):
+                continue
+            manifest_path = os.path.join(self.cache_folder, name)
+            try:
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    session_id = json.load(f).get('session_id')
+                used_at = os.path.getmtime(manifest_path)
+            except (OSError, ValueError):
+                continue
+            manifests_by_session.setdefault(session_id, []).append(manifest_path)
+            last_used[session_id] = max(last_used.get(session_id, 0), used_at)
+
+        sessions = []
+        total = 0
+        for session_id in os.listdir(self.keyframes_folder):
+            session_folder = os.path.join(self.keyframes_folder, session_id)
+            if not os.path.isdir(session_folder):
+                continue
+            size = _folder_size(session_folder)
+            used_at = max(last_used.get(session_id, 0), os.path.getmtime(session_folder))
+            sessions.append((used_at, session_id, size))
+            total += size
+
+        for _, session_id, size in sorted(sessions):
+            if total <= self.max_bytes:
+                break
+            if session_id == keep:
+                continue
+            logging.info(f"Xóa phiên cũ khỏi cache: {session_id} ({size} bytes)")
+            shutil.rmtree(os.path.join(self.keyframes_folder, session_id), ignore_errors=True)
+            companion_files = [
+                os.path.join(folder, name)
+                for folder in self.companion_folders if os.path.isdir(folder)
+                for name in os.listdir(folder) if os.path.splitext(name)[0] == session_id
+            ]
+            for file_path in manifests_by_session.get(session_id, []) + companion_files:
+                try:
+                    os.remove(file_path)
+                except OSError:
+                    pass
+            total -= size
+        return total
@@ -52,6 +52,13 @@ document.addEventListener("DOMContentLoaded", function () {
     "transition-threshold-value"
   );
   const applyThresholdBtn = document.getElementById("apply-threshold-btn");
+  const reselectThresholdSlider = document.getElementById("reselect-threshold");
+  const reselectThresholdValue = document.getElementById(
+    "reselect-threshold-value"
+  );
+  const reselectKeyframesBtn = document.getElementById(
+    "reselect-keyframes-btn"
+  );
   const scriptSection = document.getElementById("script-section");
   const scriptLoading = document.getElementById("script-loading");
   const scriptContent = document.getElementById("script-content");
@@ -347,6 +354,61 @@ document.addEventListener("DOMContentLoaded", function () {
     });
   }
 
+  // Chọn lại khung hình với ngưỡng mới từ chỉ số đã lưu của phiên
+  if (reselectThresholdSlider) {
+    reselectThresholdSlider.addEventListener("input", function () {
+      reselectThresholdValue.textContent = this.value;
+    });
+  }
+
+  if (reselectKeyframesBtn) {
+    reselectKeyframesBtn.addEventListener("click", function () {
+      if (!currentSessionId) {
+        showToast("Lỗi: Vui lòng xử lý video trước khi chọn lại khung hình");
+        return;
+      }
+
+      reselectKeyframes(reselectThresholdSlider.value, maxFramesInput.value);
+    });
+  }
+
+  function reselectKeyframes(threshold, maxFrames) {
+    reselectKeyframesBtn.disabled = true;
+
+    fetch("/reselect-keyframes", {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({
+        session_id: currentSessionId,
+        threshold: parseInt(threshold),
+        max_frames: parseInt(maxFrames),
+      }),
+    })
+      .then((response) => {
+        if (!response.ok) {
+          return response.json().then((data) => {
+            throw new Error(data.error || "Lỗi khi chọn lại khung hình");
+          });
+        }
+        return response.json();
+      })
+      .then((data) => {
+        debugLog("Reselect response:", data);
+        currentSessionId = data.session_id;
+        displayResults(data);
+        showToast(`Đã chọn lại ${data.keyframes.length} khung hình`);
+      })
+      .catch((error) => {
+        console.error("Error:", error);
+        showToast(`Lỗi: ${error.message}`);
+      })
+      .finally(() => {
+        reselectKeyframesBtn.disabled = false;
+      });
+  }
+
   // Tab switching
   uploadTabs.forEach((tab) => {
     tab.addEventListener("click", function () {
@@ -937,6 +999,10 @@ document.addEventListener("DOMContentLoaded", function () {
     } else {
       // Add parameters for other methods
       formData.append("threshold", thresholdSlider.value);
+      if (reselectThresholdSlider) {
+        reselectThresholdSlider.value = thresholdSlider.value;
+        reselectThresholdValue.textContent = thresholdSlider.value;
+      }
       formData.append("max_frames", maxFramesInput.value);
       formData.append(
         "extract_audio",
@@ -966,45 +1032,12 @@ document.addEventListener("DOMContentLoaded", function () {
       }
     }
 
-    // Simulate progress
-    let progressValue = 0;
-    const progressInterval = setInterval(() => {
-      if (progressValue < 90) {
-        progressValue +=
-          Math.random() * (activeUploadMethod !== "file-upload" ? 1 : 4);
-        progress.style.width = `${progressValue}%`;
-
-        if (selectedMethod === "azure") {
-          // Custom progress messages for Azure
-          if (progressValue < 20) {
-            progressText.textContent = `Đang ${
-              activeUploadMethod !== "file-upload" ? "tải video và " : ""
-            }tải lên Azure... ${Math.round(progressValue)}%`;
-          } else if (progressValue < 40) {
-            progressText.textContent = `Azure đang phân tích video... ${Math.round(
-              progressValue
-            )}%`;
-          } else if (progressValue < 60) {
-            progressText.textContent = `Đang phát hiện cảnh... ${Math.round(
-              progressValue
-            )}%`;
-          } else if (progressValue < 80) {
-            progressText.textContent = `Đang trích xuất văn bản... ${Math.round(
-              progressValue
-            )}%`;
-          } else {
-            progressText.textContent = `Đang hoàn thiện kết quả... ${Math.round(
-              progressValue
-            )}%`;
-          }
-        } else {
-          // Original progress messages for other methods
-          progressText.textContent = `Đang ${
-            activeUploadMethod !== "file-upload" ? "tải video và " : ""
-          }xử lý... ${Math.round(progressValue)}%`;
-        }
-      }
-    }, 500);
+    // Show upload status until the server returns a job id
+    progress.style.width = "0%";
+    progressText.textContent =
+      activeUploadMethod === "file-upload"
+        ? "Đang tải lên video..."
+        : "Đang gửi yêu cầu...";
 
     // Determine endpoint based on method
     let endpoint;
@@ -1030,8 +1063,6 @@ document.addEventListener("DOMContentLoaded", function () {
       body: formData,
     })
       .then((response) => {
-        clearInterval(progressInterval);
-
         if (!response.ok) {
           return response.json().then((data) => {
             throw new Error(data.error || "Lỗi xử lý video");
@@ -1039,6 +1070,11 @@ document.addEventListener("DOMContentLoaded", function () {
         }
         return response.json();
       })
+      .then((job) => {
+        // Server xử lý video trong job nền, theo dõi tiến độ thực tế
+        debugLog("Job submitted:", job.job_id);
+        return pollJob(job.job_id, updateJobProgress);
+      })
       .then((data) => {
         // Kiểm tra dữ liệu API trả về
         debugLog("API Response:", data);
@@ -1092,6 +1128,54 @@ document.addEventListener("DOMContentLoaded", function () {
       });
   });
 
+  // Nhãn hiển thị cho từng giai đoạn của job xử lý video
+  const JOB_STAGE_LABELS = {
+    download: "Đang tải video",
+    extract: "Đang trích xuất khung hình",
+    azure: "Azure đang phân tích video",
+    audio: "Đang trích xuất âm thanh",
+    transcribe: "Đang phiên âm",
+  };
+
+  // Cập nhật thanh tiến độ theo trạng thái job
+  function updateJobProgress(job) {
+    const percent = Math.round(job.progress * 100);
+    progress.style.width = `${percent}%`;
+    const label = job.stage
+      ? JOB_STAGE_LABELS[job.stage] || job.stage
+      : "Đang chờ xử lý";
+    progressText.textContent = `${label}... ${percent}%`;
+  }
+
+  // Theo dõi job cho đến khi hoàn thành, trả về kết quả của job
+  function pollJob(jobId, onProgress, interval = 1000) {
+    return new Promise((resolve, reject) => {
+      function check() {
+        fetch(`/jobs/${jobId}`)
+          .then((response) => {
+            if (!response.ok) {
+              return response.json().then((data) => {
+                throw new Error(data.error || "Không tìm thấy job");
+              });
+            }
+            return response.json();
+          })
+          .then((job) => {
+            if (job.status === "completed") {
+              resolve(job.result);
+            } else if (job.status === "failed") {
+              reject(new Error(job.error || "Lỗi xử lý video"));
+            } else {
+              onProgress(job);
+              setTimeout(check, interval);
+            }
+          })
+          .catch(reject);
+      }
+      check();
+    });
+  }
+
   // Show error message
   function showError(message) {
     // Remove any existing error message
@@ -1441,6 +1525,11 @@ document.addEventListener("DOMContentLoaded", function () {
           `Frame ${index}: Original=${originalPath}, Normalized=${imagePath}`
         );
 
+        // Lưới chỉ tải ảnh thu nhỏ, ảnh gốc được tải khi bấm vào ảnh
+        const thumbnailPath = frame.thumbnail_path
+          ? `/static/${frame.thumbnail_path.replace(/\\/g, "/")}`
+          : imagePath;
+
         const frameNumber = frame.frame_number || index;
 
         // In the displayResults function, modify the keyframeElement.innerHTML to include the new button
@@ -1448,14 +1537,15 @@ document.addEventListener("DOMContentLoaded", function () {
   ${labelHTML}
   <div class="image-container">
     <img 
-      src="${imagePath}" 
+      src="${thumbnailPath}" 
+      data-full-src="${imagePath}" 
       alt="Khung hình ${frameNumber}" 
       loading="lazy" 
       onerror="
         if (!this.dataset.tried) {
           this.dataset.tried = 'true';
           console.error('Failed to load image:', this.src);
-          this.src = '/static/${originalPath.replace(/\\/g, "/")}';
+          this.src = this.dataset.fullSrc;
         } else {
           this.src = '/static/img/error.png';
         }
@@ -1515,7 +1605,8 @@ document.addEventListener("DOMContentLoaded", function () {
         const imgElement = keyframeElement.querySelector("img");
         imgElement.addEventListener("click", function () {
           // Instead of opening in a new tab, show in a modal with download options
-          const imgSrc = this.src;
+          const imgSrc = new URL(this.dataset.fullSrc, window.location.href)
+            .href;
 
           // Create a modal to show the full image with download options
           const modal = document.createElement("div");
@@ -2563,10 +2654,76 @@ document.addEventListener("DOMContentLoaded", function () {
       });
   }
 
+  // Đường dẫn uploads/... của ảnh nằm trên máy chủ này, null nếu là ảnh bên ngoài
+  function toUploadPath(imageUrl) {
+    const url = new URL(imageUrl, window.location.href);
+    if (url.origin !== window.location.origin) return null;
+    const path = decodeURIComponent(url.pathname);
+    return path.startsWith("/static/uploads/")
+      ? path.substring("/static/".length)
+      : null;
+  }
+
+  // Để trình duyệt tải thẳng tệp ZIP do máy chủ tạo (ghi dần ra đĩa, không giữ trong bộ nhớ)
+  function startDownload(url) {
+    const link = document.createElement("a");
+    link.href = url;
+    link.download = "";
+    document.body.appendChild(link);
+    link.click();
+    document.body.removeChild(link);
+  }
+
+  // Gửi danh sách ảnh cho máy chủ để tạo ZIP bằng form ẩn
+  function submitZipDownload(paths, zipFilename) {
+    const form = document.createElement("form");
+    form.method = "POST";
+    form.action = "/download-zip";
+    form.style.display = "none";
+
+    // Gửi vào iframe ẩn để trang hiện tại không bị thay thế nếu máy chủ trả về lỗi
+    let frame = document.getElementById("zip-download-frame");
+    if (!frame) {
+      frame = document.createElement("iframe");
+      frame.id = "zip-download-frame";
+      frame.name = "zip-download-frame";
+      frame.style.display = "none";
+      document.body.appendChild(frame);
+    }
+    form.target = frame.name;
+
+    const fields = paths.map((path) => ["paths", path]);
+    fields.push(["filename", zipFilename]);
+    fields.forEach(([name, value]) => {
+      const input = document.createElement("input");
+      input.type = "hidden";
+      input.name = name;
+      input.value = value;
+      form.appendChild(input);
+    });
+
+    document.body.appendChild(form);
+    form.submit();
+    document.body.removeChild(form);
+  }
+
   // Download multiple images as a ZIP file
   function downloadImagesAsZip(images, zipFilename = "images.zip") {
     showToast("Đang chuẩn bị tệp ZIP...");
 
+    // Add timestamp to filename to avoid duplicates
+    const timestamp = new Date().toISOString().replace(/[:.]/g, "-");
+
+    // Ảnh đều nằm trên máy chủ: máy chủ tạo ZIP, không cần tải từng ảnh về trình duyệt
+    const uploadPaths = images.map(toUploadPath);
+    if (uploadPaths.length > 0 && uploadPaths.every((path) => path !== null)) {
+      submitZipDownload(
+        uploadPaths,
+        zipFilename.replace(".zip", `-${timestamp}.zip`)
+      );
+      return;
+    }
+
     // Create a new ZIP file
     const zip = new JSZip();
     const imgFolder = zip.folder("images");
@@ -2627,8 +2784,6 @@ document.addEventListener("DOMContentLoaded", function () {
       .then((zipBlob) => {
         if (!zipBlob) return;
 
-        // Add timestamp to filename to avoid duplicates
-        const timestamp = new Date().toISOString().replace(/[:.]/g, "-");
         const finalFilename = zipFilename.replace(".zip", `-${timestamp}.zip`);
 
         // Save ZIP file using FileSaver.js
@@ -2798,20 +2953,13 @@ document.addEventListener("DOMContentLoaded", function () {
       return;
     }
 
-    fetch(`/download/${currentSessionId}`)
-      .then((response) => response.json())
-      .then((data) => {
-        if (data.files && data.files.length > 0) {
-          const imageUrls = data.files.map((file) => `/static/${file}`);
-          downloadImagesAsZip(imageUrls, `keyframes-${currentSessionId}.zip`);
-        } else {
-          showToast("Không có khung hình nào để tải xuống");
-        }
-      })
-      .catch((error) => {
-        console.error("Error downloading files:", error);
-        showToast("Lỗi khi tải xuống các khung hình");
-      });
+    // Máy chủ tạo ZIP gồm khung hình, phiên âm và metadata rồi gửi dần về trình duyệt
+    showToast("Đang tải xuống tệp ZIP...");
+    startDownload(
+      `/download-zip/${encodeURIComponent(
+        currentSessionId
+      )}?include_transcript=true&include_manifest=true`
+    );
   });
 
   // Process new video
@@ -3477,7 +3625,8 @@ document.addEventListener("DOMContentLoaded", function () {
       const imgElement = keyframe.querySelector("img");
       if (imgElement && imgElement.src) {
         // Extract the path relative to /static from the full URL
-        const fullSrc = imgElement.src;
+        // (ảnh gốc, không phải ảnh thu nhỏ hiển thị trong lưới)
+        const fullSrc = imgElement.dataset.fullSrc || imgElement.src;
         // Find the index of "/static/" in the URL
         const staticIndex = fullSrc.indexOf("/static/");
         if (staticIndex !== -1) {
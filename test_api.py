@@ -1,5 +1,18 @@
 import requests
 import json
+import time
+
+
+def wait_for_job(job):
+    """Poll a background job until it finishes and return its result"""
+    while True:
+        status = requests.get(f"http://localhost:5000/jobs/{job['job_id']}").json()
+        if status['status'] == 'completed':
+            return status['result']
+        if status['status'] == 'failed':
+            raise RuntimeError(status['error'])
+        time.sleep(1)
+
 
 # Test different threshold values
 thresholds = [30, 20, 15, 10, 5]
@@ -12,7 +25,7 @@ for threshold in thresholds:
         data={"threshold": str(threshold), "max_frames": "20"}
     )
     
-    result = response.json()
+    result = wait_for_job(response.json())
     keyframe_count = len(result['keyframes'])
     
     print(f"Threshold: {threshold}, Keyframe count: {keyframe_count}")
@@ -0,0 +1,51 @@
+import pytest
+
+pytest.importorskip('pydub')
+from pydub import AudioSegment
+from pydub.generators import Sine
+
+from audio_chunks import split_audio_on_silence
+
+
+def tone(ms):
+    return Sine(440).to_audio_segment(duration=ms, volume=-10)
+
+
+def assert_covers(chunks, length, max_chunk_ms):
+    """Các đoạn liền nhau, phủ toàn bộ âm thanh và không dài quá max_chunk_ms"""
+    assert chunks[0][0] == 0
+    assert chunks[-1][1] == length
+    for (_, end), (start, _) in zip(chunks, chunks[1:]):
+        assert end == start
+    assert all(0 < end - start <= max_chunk_ms for start, end in chunks)
+
+
+def test_short_audio_is_one_chunk():
+    sound = tone(5000)
+    assert split_audio_on_silence(sound) == [(0, 5000)]
+
+
+def test_cuts_in_the_middle_of_the_last_silence_in_window():
+    # Giọng nói 12s, lặng 1s, nói 12s, lặng 1s, nói 12s
+    sound = tone(12000) + AudioSegment.silent(1000) + tone(12000) + AudioSegment.silent(1000) + tone(12000)
+    chunks = split_audio_on_silence(sound, max_chunk_ms=30000, min_chunk_ms=10000)
+
+    assert_covers(chunks, len(sound), 30000)
+    # Điểm cắt rơi vào giữa khoảng lặng thứ hai (25000 - 26000), không cắt ngang câu nói
+    assert 25000 <= chunks[0][1] <= 26000
+    assert len(chunks) == 2
+
+
+def test_hard_cut_without_silence():
+    sound = tone(65000)
+    chunks = split_audio_on_silence(sound, max_chunk_ms=30000, min_chunk_ms=10000)
+
+    assert chunks == [(0, 30000), (30000, 60000), (60000, 65000)]
+
+
+def test_silence_before_min_chunk_is_ignored():
+    sound = tone(3000) + AudioSegment.silent(1000) + tone(40000)
+    chunks = split_audio_on_silence(sound, max_chunk_ms=30000, min_chunk_ms=10000)
+
+    assert_covers(chunks, len(sound), 30000)
+    assert chunks[0] == (0, 30000)
@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+
+import download_cache
+from download_cache import DownloadCache
+
+
+def add_video(cache, key, size):
+    folder = cache.path(key)
+    path = os.path.join(folder, 'video.mp4')
+    with open(path, 'wb') as f:
+        f.write(b'v' * size)
+    cache.put(key, {'path': path, 'title': key})
+    return path
+
+
+def test_put_then_get(tmp_path):
+    cache = DownloadCache(str(tmp_path))
+    path = add_video(cache, 'youtube_abc', 100)
+
+    assert cache.get('youtube_abc') == {'path': path, 'title': 'youtube_abc'}
+    assert cache.get('youtube_missing') is None
+    assert cache.get(None) is None
+
+
+def test_entry_without_video_file_is_ignored(tmp_path):
+    cache = DownloadCache(str(tmp_path))
+    path = add_video(cache, 'youtube_abc', 100)
+    os.remove(path)
+
+    assert cache.get('youtube_abc') is None
+
+
+def test_evicts_least_recently_used_old_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(download_cache, 'DOWNLOAD_MIN_AGE', 0)
+    cache = DownloadCache(str(tmp_path), max_bytes=2500)
+    add_video(cache, 'a', 1000)
+    add_video(cache, 'b', 1000)
+    old = time.time() - 100
+    os.utime(os.path.join(str(tmp_path), 'a', 'info.json'), (old, old))
+    os.utime(os.path.join(str(tmp_path), 'b', 'info.json'), (old - 10, old - 10))
+
+    add_video(cache, 'c', 1000)
+
+    assert sorted(os.listdir(tmp_path)) == ['a', 'c']
+
+
+def test_recently_used_entries_are_kept(tmp_path):
+    cache = DownloadCache(str(tmp_path), max_bytes=1500)
+    add_video(cache, 'a', 1000)
+    add_video(cache, 'b', 1000)
+
+    # Video vừa dùng có thể vẫn đang được job đọc, không bị xóa dù vượt dung lượng
+    assert sorted(os.listdir(tmp_path)) == ['a', 'b']
+
+
+def test_lock_is_per_key(tmp_path):
+    cache = DownloadCache(str(tmp_path))
+
+    assert cache.lock('a') is cache.lock('a')
+    assert cache.lock('a') is not cache.lock('b')
+    with cache.lock(None):
+        pass
+
+    acquired = []
+    with cache.lock('a'):
+        thread = threading.Thread(target=lambda: acquired.append(cache.lock('b').acquire(timeout=1)))
+        thread.start()
+        thread.join()
+    assert acquired == [True]
@@ -0,0 +1,73 @@
+import imagehash
+import numpy as np
+import pytest
+
+from hash_matching import find_similar_pairs, hash_to_int, pack_hashes, popcount64
+
+
+def brute_force_pairs(values, max_distance):
+    """Vòng lặp lồng nhau như cách so sánh ban đầu"""
+    pairs = []
+    for i in range(len(values)):
+        for j in range(i + 1, len(values)):
+            distance = bin(values[i] ^ values[j]).count('1')
+            if distance <= max_distance:
+                pairs.append((i, j, distance))
+    return pairs
+
+
+def clustered_hashes(count, seed):
+    """Hash ngẫu nhiên kèm các biến thể lệch vài bit để có nhiều cặp gần nhau"""
+    rng = np.random.default_rng(seed)
+    values = []
+    while len(values) < count:
+        base = int(rng.integers(0, 2 ** 63)) * 2 + int(rng.integers(0, 2))
+        values.append(base)
+        for _ in range(int(rng.integers(0, 4))):
+            flipped = base
+            for bit in rng.choice(64, size=int(rng.integers(0, 6)), replace=False):
+                flipped ^= 1 << int(bit)
+            values.append(flipped)
+    return values[:count]
+
+
+def as_tuples(result):
+    return list(zip(*(array.tolist() for array in result)))
+
+
+def test_popcount_matches_python():
+    values = clustered_hashes(200, seed=1)
+    expected = [bin(value).count('1') for value in values]
+
+    assert popcount64(pack_hashes(values)).tolist() == expected
+
+
+def test_pack_hashes_accepts_imagehash_hex_and_int():
+    image_hash = imagehash.hex_to_hash('ff00ff00ff00ff00')
+
+    packed = pack_hashes([image_hash, 'ff00ff00ff00ff00', 0xff00ff00ff00ff00])
+
+    assert packed.dtype == np.uint64
+    assert packed.tolist() == [hash_to_int(image_hash)] * 3
+
+
+@pytest.mark.parametrize('method', ['blocked', 'multi_index', 'auto'])
+@pytest.mark.parametrize('max_distance', [0, 2, 3, 10])
+def test_matches_brute_force(method, max_distance):
+    values = clustered_hashes(700, seed=max_distance)
+
+    result = find_similar_pairs(pack_hashes(values), max_distance, method=method)
+
+    assert as_tuples(result) == brute_force_pairs(values, max_distance)
+
+
+def test_small_inputs():
+    assert as_tuples(find_similar_pairs(pack_hashes([]), 5)) == []
+    assert as_tuples(find_similar_pairs(pack_hashes([1]), 5)) == []
+    assert as_tuples(find_similar_pairs(pack_hashes([1, 3]), -1)) == []
+    assert as_tuples(find_similar_pairs(pack_hashes([1, 3]), 1)) == [(0, 1, 1)]
+
+
+def test_invalid_method():
+    with pytest.raises(ValueError):
+        find_similar_pairs(pack_hashes([1, 2]), 1, method='sorted')
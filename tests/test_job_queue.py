@@ -0,0 +1,70 @@
+import time
+
+from job_queue import JobQueue, JOB_COMPLETED, JOB_FAILED
+
+
+def wait_finished(queue, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = queue.status(job_id)
+        if status and status['status'] in (JOB_COMPLETED, JOB_FAILED):
+            return status
+        time.sleep(0.02)
+    raise AssertionError(f"Job {job_id} chưa xong sau {timeout}s")
+
+
+def test_job_result_and_progress(tmp_path):
+    queue = JobQueue(max_workers=1, db_path=str(tmp_path / 'jobs.db'))
+
+    def work(job, value):
+        job.update('extract', 0.5)
+        job.update('audio')
+        return {'value': value}
+
+    job = queue.submit('test', work, 42, stages=['extract', 'audio'])
+    status = wait_finished(queue, job.id)
+
+    assert status['status'] == JOB_COMPLETED
+    assert status['result'] == {'value': 42}
+    assert status['progress'] == 1.0
+    assert status['stages'] == ['extract', 'audio']
+
+
+def test_status_is_shared_through_the_store(tmp_path):
+    db_path = str(tmp_path / 'jobs.db')
+    worker = JobQueue(max_workers=1, db_path=db_path)
+    other_worker = JobQueue(max_workers=1, db_path=db_path)
+
+    job = worker.submit('test', lambda job: {'text': 'Tiếng Việt'})
+    wait_finished(worker, job.id)
+
+    status = other_worker.status(job.id)
+    assert status['status'] == JOB_COMPLETED
+    assert status['result'] == {'text': 'Tiếng Việt'}
+    assert other_worker.status('unknown') is None
+
+
+def test_failed_job_reports_error(tmp_path):
+    queue = JobQueue(max_workers=1, db_path=str(tmp_path / 'jobs.db'))
+
+    def fail(job):
+        raise ValueError('video hỏng')
+
+    job = queue.submit('test', fail)
+    status = wait_finished(JobQueue(db_path=str(tmp_path / 'jobs.db')), job.id)
+
+    assert status['status'] == JOB_FAILED
+    assert status['error'] == 'video hỏng'
+    assert 'result' not in status
+
+
+def test_store_keeps_only_recent_finished_jobs(tmp_path):
+    db_path = str(tmp_path / 'jobs.db')
+    queue = JobQueue(max_workers=1, max_finished_jobs=2, db_path=db_path)
+
+    jobs = [queue.submit('test', lambda job, i=i: i) for i in range(4)]
+    for job in jobs:
+        wait_finished(queue, job.id)
+
+    reader = JobQueue(db_path=db_path)
+    assert [reader.status(job.id) is not None for job in jobs] == [False, False, True, True]
@@ -0,0 +1,113 @@
+import json
+import multiprocessing
+import os
+
+from keyframe_store import KeyframeStore, SessionKeyframes, session_id_from_path
+
+
+def frames(count, session_id='session'):
+    return [{'id': f"frame_{i}", 'path': f"uploads/keyframes/{session_id}/frame_{i}.jpg"} for i in range(count)]
+
+
+def test_session_lookup_update_and_remove():
+    session = SessionKeyframes(frames(5))
+
+    assert session.get('frame_2')['path'] == 'uploads/keyframes/session/frame_2.jpg'
+    assert session.find_by_path('uploads/keyframes/session/frame_3.jpg')['id'] == 'frame_3'
+
+    session.update_many({'frame_1': {'prompt': 'a cat'}, 'missing': {'prompt': 'x'}})
+    assert session.get('frame_1')['prompt'] == 'a cat'
+
+    assert session.remove_many(['frame_0', 'frame_4', 'missing']) == ['frame_0', 'frame_4']
+    assert [frame['id'] for frame in session.list()] == ['frame_1', 'frame_2', 'frame_3']
+    assert session.find_by_path('uploads/keyframes/session/frame_0.jpg') is None
+
+
+def test_manifest_survives_restart(tmp_path):
+    store = KeyframeStore(manifest_folder=str(tmp_path))
+    store.set('session', frames(3))
+    store.session('session').update_many({'frame_1': {'prompt': 'a dog'}})
+
+    with open(tmp_path / 'session.json', encoding='utf-8') as f:
+        manifest = json.load(f)
+    assert manifest['session_id'] == 'session'
+    assert len(manifest['keyframes']) == 3
+
+    restarted = KeyframeStore(manifest_folder=str(tmp_path))
+    assert restarted.get('session').get('frame_1')['prompt'] == 'a dog'
+    assert restarted.find_by_path('uploads/keyframes/session/frame_2.jpg')['id'] == 'frame_2'
+    assert restarted.get('other') is None
+
+
+def test_reloads_manifest_written_by_another_worker(tmp_path):
+    first = KeyframeStore(manifest_folder=str(tmp_path))
+    second = KeyframeStore(manifest_folder=str(tmp_path))
+    first.set('session', frames(3))
+    assert len(second.get('session')) == 3
+
+    first.session('session').remove_many(['frame_0'])
+
+    assert [frame['id'] for frame in second.get('session').list()] == ['frame_1', 'frame_2']
+
+
+def test_stale_copy_applies_changes_to_latest_manifest(tmp_path):
+    first = KeyframeStore(manifest_folder=str(tmp_path))
+    second = KeyframeStore(manifest_folder=str(tmp_path))
+    first.set('session', frames(3))
+    stale = second.get('session')
+
+    first.session('session').remove_many(['frame_0'])
+    stale.update_many({'frame_1': {'prompt': 'a bird'}})
+
+    keyframes = KeyframeStore(manifest_folder=str(tmp_path)).get('session').list()
+    assert [frame['id'] for frame in keyframes] == ['frame_1', 'frame_2']
+    assert keyframes[0]['prompt'] == 'a bird'
+
+
+def remove_frames(folder, frame_ids):
+    store = KeyframeStore(manifest_folder=folder)
+    for frame_id in frame_ids:
+        store.session('session').remove_many([frame_id])
+
+
+def test_concurrent_workers_do_not_lose_updates(tmp_path):
+    KeyframeStore(manifest_folder=str(tmp_path)).set('session', frames(200))
+
+    ids = [f"frame_{i}" for i in range(200)]
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=remove_frames, args=(str(tmp_path), ids[k::4])) for k in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert all(worker.exitcode == 0 for worker in workers)
+    assert len(KeyframeStore(manifest_folder=str(tmp_path)).get('session')) == 0
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+
+def test_rejects_session_ids_outside_manifest_folder(tmp_path):
+    store = KeyframeStore(manifest_folder=str(tmp_path / 'sessions'))
+
+    store.set('../escape', frames(1))
+
+    assert not os.path.exists(tmp_path / 'escape.json')
+    assert session_id_from_path('uploads/keyframes/abc/frame_0.jpg') == 'abc'
+
+
+def test_memory_is_bounded(tmp_path):
+    store = KeyframeStore(max_sessions=2, manifest_folder=str(tmp_path))
+    for name in ('a', 'b', 'c'):
+        store.set(name, frames(1, name))
+
+    assert list(store.sessions) == ['b', 'c']
+    assert len(store.get('a')) == 1
+
+
+def test_no_lock_file_per_session(tmp_path):
+    store = KeyframeStore(manifest_folder=str(tmp_path))
+    for i in range(3):
+        store.set(f"session_{i}", frames(2, f"session_{i}"))
+        store.session(f"session_{i}").remove_many(['frame_0'])
+
+    assert sorted(os.listdir(tmp_path)) == ['.manifests.lock', 'session_0.json', 'session_1.json', 'session_2.json']
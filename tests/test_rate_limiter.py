@@ -0,0 +1,85 @@
+import contextlib
+import sqlite3
+import threading
+import time
+
+from rate_limiter import TokenBucketRateLimiter, PRIORITY_BULK, PRIORITY_INTERACTIVE
+
+
+def make_limiter(tmp_path, capacity=2, window=1.0, name='test'):
+    return TokenBucketRateLimiter(str(tmp_path / 'limits.db'), capacity, window, name)
+
+
+def test_burst_up_to_capacity_then_refuses(tmp_path):
+    limiter = make_limiter(tmp_path, capacity=3, window=60)
+
+    assert [limiter.acquire() for _ in range(3)] == [True, True, True]
+    assert limiter.acquire(timeout=0) is False
+
+
+def test_waits_for_refill(tmp_path):
+    limiter = make_limiter(tmp_path, capacity=2, window=0.5)
+    assert limiter.acquire() and limiter.acquire()
+
+    start = time.time()
+    assert limiter.acquire(timeout=2)
+    # Một lượt được nạp lại sau window / capacity giây
+    assert 0.15 <= time.time() - start < 1.5
+
+
+def test_bucket_is_shared_through_database(tmp_path):
+    first = make_limiter(tmp_path, capacity=2, window=60)
+    second = make_limiter(tmp_path, capacity=2, window=60)
+    other_bucket = make_limiter(tmp_path, capacity=2, window=60, name='other')
+
+    assert first.acquire()
+    assert second.acquire()
+    assert first.acquire(timeout=0) is False
+    assert second.acquire(timeout=0) is False
+    assert other_bucket.acquire()
+
+
+def test_higher_priority_waiter_is_served_first(tmp_path):
+    limiter = make_limiter(tmp_path, capacity=1, window=0.6)
+    assert limiter.acquire()
+
+    order = []
+
+    def wait_for_slot(priority, label):
+        if make_limiter(tmp_path, capacity=1, window=0.6).acquire(priority=priority, timeout=5):
+            order.append(label)
+
+    bulk = threading.Thread(target=wait_for_slot, args=(PRIORITY_BULK, 'bulk'))
+    bulk.start()
+    time.sleep(0.1)
+    interactive = threading.Thread(target=wait_for_slot, args=(PRIORITY_INTERACTIVE, 'interactive'))
+    interactive.start()
+    bulk.join()
+    interactive.join()
+
+    # Request xếp hàng sau nhưng ưu tiên cao hơn vẫn được phục vụ trước
+    assert order == ['interactive', 'bulk']
+
+
+def test_timed_out_waiter_leaves_queue(tmp_path):
+    limiter = make_limiter(tmp_path, capacity=1, window=0.4)
+    assert limiter.acquire()
+    assert limiter.acquire(priority=PRIORITY_INTERACTIVE, timeout=0.05) is False
+
+    # Waiter đã hết hạn không còn chặn request có độ ưu tiên thấp hơn
+    assert limiter.acquire(priority=PRIORITY_BULK, timeout=2)
+
+
+def test_cancelled_waiter_stops_waiting(tmp_path):
+    limiter = make_limiter(tmp_path, capacity=1, window=60)
+    assert limiter.acquire()
+
+    cancel = threading.Event()
+    threading.Timer(0.1, cancel.set).start()
+    start = time.time()
+    assert limiter.acquire(priority=PRIORITY_BULK, timeout=30, cancel=cancel) is False
+    assert time.time() - start < 2
+
+    # Waiter đã hủy không còn nằm trong hàng đợi
+    with contextlib.closing(sqlite3.connect(str(tmp_path / 'limits.db'))) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM waiters").fetchone()[0] == 0
@@ -0,0 +1,95 @@
+import io
+import os
+import hashlib
+
+from result_cache import ResultCache, copy_stream_with_hash, hash_file
+
+
+def make_session(keyframes_folder, session_id, size=1000):
+    folder = os.path.join(keyframes_folder, session_id)
+    os.makedirs(os.path.join(folder, 'thumbs'), exist_ok=True)
+    with open(os.path.join(folder, 'frame_0.jpg'), 'wb') as f:
+        f.write(b'x' * size)
+    with open(os.path.join(folder, 'thumbs', 'frame_0.jpg'), 'wb') as f:
+        f.write(b'y' * 10)
+    return {
+        'session_id': session_id,
+        'keyframes': [{
+            'path': f"uploads/keyframes/{session_id}/frame_0.jpg",
+            'thumbnail_path': f"uploads/keyframes/{session_id}/thumbs/frame_0.jpg"
+        }]
+    }
+
+
+def make_cache(tmp_path, **kwargs):
+    keyframes_folder = str(tmp_path / 'keyframes')
+    signals_folder = str(tmp_path / 'signals')
+    os.makedirs(keyframes_folder, exist_ok=True)
+    os.makedirs(signals_folder, exist_ok=True)
+    cache = ResultCache(str(tmp_path / 'cache'), keyframes_folder, companion_folders=[signals_folder], **kwargs)
+    return cache, keyframes_folder, signals_folder
+
+
+def test_hash_helpers_agree(tmp_path):
+    data = os.urandom(3 * 1024 * 1024 + 7)
+    path = str(tmp_path / 'video.mp4')
+    digest = copy_stream_with_hash(io.BytesIO(data), path, chunk_size=1024 * 1024)
+
+    assert digest == hashlib.sha256(data).hexdigest() == hash_file(path)
+
+
+def test_key_depends_on_video_and_params():
+    key = ResultCache.key('abc', {'threshold': 30, 'max_frames': 20})
+
+    assert key == ResultCache.key('abc', {'max_frames': 20, 'threshold': 30})
+    assert key != ResultCache.key('abd', {'threshold': 30, 'max_frames': 20})
+    assert key != ResultCache.key('abc', {'threshold': 31, 'max_frames': 20})
+
+
+def test_get_returns_private_copy_of_session(tmp_path):
+    cache, keyframes_folder, signals_folder = make_cache(tmp_path)
+    result = make_session(keyframes_folder, 'video_aaaa')
+    with open(os.path.join(signals_folder, 'video_aaaa.json'), 'w') as f:
+        f.write('{}')
+    cache.put('key', result)
+
+    copy = cache.get('key', session_id='video_bbbb')
+
+    assert copy['session_id'] == 'video_bbbb'
+    assert copy['keyframes'][0]['path'] == 'uploads/keyframes/video_bbbb/frame_0.jpg'
+    assert copy['keyframes'][0]['thumbnail_path'] == 'uploads/keyframes/video_bbbb/thumbs/frame_0.jpg'
+    assert os.path.exists(os.path.join(keyframes_folder, 'video_bbbb', 'thumbs', 'frame_0.jpg'))
+    assert os.path.exists(os.path.join(signals_folder, 'video_bbbb.json'))
+
+    # Xóa ảnh trong bản sao không ảnh hưởng phiên đã lưu
+    os.remove(os.path.join(keyframes_folder, 'video_bbbb', 'frame_0.jpg'))
+    assert cache.get('key') == result
+
+
+def test_incomplete_result_is_dropped(tmp_path):
+    cache, keyframes_folder, _ = make_cache(tmp_path)
+    cache.put('key', make_session(keyframes_folder, 'video_aaaa'))
+
+    os.remove(os.path.join(keyframes_folder, 'video_aaaa', 'frame_0.jpg'))
+
+    assert cache.get('key') is None
+    assert cache.get('key') is None
+
+
+def test_evicts_least_recently_used_sessions(tmp_path):
+    cache, keyframes_folder, signals_folder = make_cache(tmp_path, max_bytes=3500)
+    for i in range(3):
+        cache.put(f"key{i}", make_session(keyframes_folder, f"session_{i}"))
+        with open(os.path.join(signals_folder, f"session_{i}.json"), 'w') as f:
+            f.write('{}')
+    # Thứ tự dùng chỉ theo manifest, bỏ qua thời điểm ghi thư mục
+    for i in range(3):
+        os.utime(os.path.join(keyframes_folder, f"session_{i}"), (1, 1))
+    # Dùng lại phiên đầu tiên để nó không còn là phiên cũ nhất
+    assert cache.get('key0') is not None
+
+    cache.put('key3', make_session(keyframes_folder, 'session_3'))
+
+    assert sorted(os.listdir(keyframes_folder)) == ['session_0', 'session_2', 'session_3']
+    assert not os.path.exists(os.path.join(signals_folder, 'session_1.json'))
+    assert cache.get('key1') is None
@@ -0,0 +1,168 @@
+import cv2
+import numpy as np
+import pytest
+
+from frame_engine import (
+    FrameDifferenceDetector, SceneDetector, TransitionAwareDetector, KeyframeWriter, SignalIndex,
+    open_frame_source, run_keyframe_detectors, run_keyframe_detectors_parallel, replay_signal_index
+)
+
+
+def write_clip(path, frame_count, scene_length):
+    """Video 25 fps, màu nền đổi sau mỗi scene_length khung hình và một khối hình di chuyển"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 25, (160, 120))
+    for i in range(frame_count):
+        shade = (i // scene_length) * 15 % 256
+        frame = np.full((120, 160, 3), shade, dtype=np.uint8)
+        cv2.rectangle(frame, (i % 100, 10), (i % 100 + 40, 60), (255 - shade, shade, 128), -1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+@pytest.fixture(scope='module')
+def video_path(tmp_path_factory):
+    """Video 16 giây, lấy mẫu mọi khung hình (frame_skip = 1)"""
+    return write_clip(str(tmp_path_factory.mktemp('video') / 'clip.avi'), 400, 25)
+
+
+@pytest.fixture(scope='module')
+def sampled_video_path(tmp_path_factory):
+    """Video 60 giây, chỉ lấy mẫu mỗi 6 khung hình (frame_skip = 6)"""
+    path = write_clip(str(tmp_path_factory.mktemp('video') / 'long_clip.avi'), 1500, 100)
+    source = open_frame_source(path)
+    assert source.frame_skip == 6
+    source.release()
+    return path
+
+
+def extract(video_path, detectors, folder):
+    source = open_frame_source(video_path)
+    index = SignalIndex.for_source(source)
+    try:
+        run_keyframe_detectors(source, detectors, KeyframeWriter(str(folder), 'keyframes', source.fps),
+                               signal_index=index)
+    finally:
+        source.release()
+    return index
+
+
+def frame_numbers(detector):
+    return [keyframe['frame_number'] for keyframe in detector.keyframes]
+
+
+DETECTOR_FACTORIES = [
+    lambda max_frames: FrameDifferenceDetector(5, max_frames),
+    lambda max_frames: SceneDetector(10, max_frames, 15),
+    lambda max_frames: TransitionAwareDetector(5, max_frames, 0.4)
+]
+
+
+@pytest.mark.parametrize('clip', ['video_path', 'sampled_video_path'])
+@pytest.mark.parametrize('make_detector', DETECTOR_FACTORIES)
+def test_replay_matches_fresh_extraction(request, tmp_path, clip, make_detector):
+    video_path = request.getfixturevalue(clip)
+    # Lượt quét đầu dừng sớm vì max_frames nhỏ, lần chọn lại phải quét tiếp phần còn lại
+    index = extract(video_path, [make_detector(2)], tmp_path / 'first')
+    assert not index.complete
+
+    fresh = make_detector(10)
+    extract(video_path, [fresh], tmp_path / 'fresh')
+
+    replayed = make_detector(10)
+    replay_signal_index(index, [replayed], KeyframeWriter(str(tmp_path / 'replay'), 'keyframes', index.fps))
+
+    assert frame_numbers(replayed) == frame_numbers(fresh)
+    assert [keyframe['timestamp'] for keyframe in replayed.keyframes] == \
+        [keyframe['timestamp'] for keyframe in fresh.keyframes]
+    assert index.complete
+
+
+@pytest.mark.parametrize('make_detector', DETECTOR_FACTORIES)
+def test_all_paths_agree_when_frames_are_skipped(sampled_video_path, tmp_path, make_detector):
+    # Tuần tự, song song và chọn lại với cùng tham số phải cho đúng cùng các khung hình
+    sequential = make_detector(None)
+    index = extract(sampled_video_path, [sequential], tmp_path / 'sequential')
+
+    parallel = make_detector(None)
+    source = open_frame_source(sampled_video_path)
+    try:
+        run_keyframe_detectors_parallel(source, [parallel],
+                                        KeyframeWriter(str(tmp_path / 'parallel'), 'keyframes', source.fps), 2)
+    finally:
+        source.release()
+
+    replayed = make_detector(None)
+    replay_signal_index(index, [replayed], KeyframeWriter(str(tmp_path / 'replay'), 'keyframes', index.fps))
+
+    assert len(frame_numbers(sequential)) > 2
+    assert all(number % 6 == 0 for number in frame_numbers(sequential))
+    assert frame_numbers(parallel) == frame_numbers(sequential)
+    assert frame_numbers(replayed) == frame_numbers(sequential)
+
+
+def test_replay_with_saved_index(video_path, tmp_path):
+    index = extract(video_path, [FrameDifferenceDetector(5, None)], tmp_path / 'first')
+    assert index.complete
+    index.save(str(tmp_path / 'signals'), 'session')
+
+    loaded = SignalIndex.load(str(tmp_path / 'signals'), 'session')
+    np.testing.assert_array_equal(loaded.table, index.table)
+
+    fresh = FrameDifferenceDetector(12, None)
+    extract(video_path, [fresh], tmp_path / 'fresh')
+    replayed = FrameDifferenceDetector(12, None)
+    replay_signal_index(loaded, [replayed], KeyframeWriter(str(tmp_path / 'replay'), 'keyframes', loaded.fps))
+
+    assert frame_numbers(replayed) == frame_numbers(fresh)
+
+
+def test_index_records_only_needed_signals(video_path, tmp_path):
+    index = extract(video_path, [FrameDifferenceDetector(5, None)], tmp_path / 'first')
+
+    assert index.missing_signals(('mean_diff',)) == []
+    assert index.missing_signals(('hist_diff', 'contrast', 'edge_density')) == ['hist_diff', 'contrast', 'edge_density']
+    with pytest.raises(ValueError):
+        replay_signal_index(index, [SceneDetector(10, 5)],
+                            KeyframeWriter(str(tmp_path / 'replay'), 'keyframes', index.fps))
+
+
+@pytest.fixture(scope='module')
+def fade_video_path(tmp_path_factory):
+    """Video 640x360 gồm 4 cảnh có hình khối và chữ, mỗi cảnh mờ dần vào và ra"""
+    path = str(tmp_path_factory.mktemp('video') / 'fade.avi')
+    rng = np.random.default_rng(1)
+    scenes = []
+    for k in range(4):
+        frame = np.full((360, 640, 3), 40 * k + 30, dtype=np.uint8)
+        for _ in range(25):
+            x, y = int(rng.integers(0, 600)), int(rng.integers(0, 330))
+            color = tuple(int(value) for value in rng.integers(0, 256, 3))
+            cv2.rectangle(frame, (x, y), (x + int(rng.integers(10, 120)), y + int(rng.integers(10, 80))), color, -1)
+        cv2.putText(frame, f"Scene {k}", (50, 300), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+        scenes.append(frame.astype(np.float32))
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 25, (640, 360))
+    for i in range(400):
+        scene, t = divmod(i, 100)
+        fade = min(1.0, (100 - t) / 20, t / 20 if scene else 1.0)
+        writer.write((scenes[scene] * fade).astype(np.uint8))
+    writer.release()
+    return path
+
+
+def test_transition_flags_stable_across_analysis_width(fade_video_path, tmp_path):
+    flagged = {}
+    for analysis_width in (160, 320, 480, None):
+        source = open_frame_source(fade_video_path, analysis_width=analysis_width)
+        detector = TransitionAwareDetector(5, None, 0.4)
+        try:
+            run_keyframe_detectors(source, [detector], KeyframeWriter(str(tmp_path), 'keyframes', source.fps))
+        finally:
+            source.release()
+        flagged[analysis_width] = {keyframe['frame_number'] for keyframe in detector.keyframes
+                                   if keyframe['is_transition']}
+
+    # Mật độ cạnh đo ở cùng chiều rộng nên chỉ có thể lệch ở khung hình sát ngưỡng
+    assert len(flagged[None]) > 20
+    for analysis_width in (160, 320, 480):
+        assert len(flagged[analysis_width] ^ flagged[None]) <= 2
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+from upload_ingest import IngestFile, Mp4Probe, UploadRejected, parse_moov
+
+
+def write_video(path, fourcc, frames=50, fps=25, size=(160, 96)):
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*fourcc), fps, size)
+    if not writer.isOpened():
+        pytest.skip(f"OpenCV không ghi được video {fourcc}")
+    for i in range(frames):
+        writer.write(np.full((size[1], size[0], 3), i * 5 % 256, dtype=np.uint8))
+    writer.release()
+    return path.read_bytes()
+
+
+def top_level_boxes(data):
+    boxes = []
+    offset = 0
+    while offset < len(data):
+        size = struct.unpack_from('>I', data, offset)[0]
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+        boxes.append((data[offset + 4:offset + 8], data[offset:offset + size]))
+        offset += size
+    return boxes
+
+
+@pytest.fixture(scope='module')
+def mp4_data(tmp_path_factory):
+    return write_video(tmp_path_factory.mktemp('video') / 'clip.mp4', 'mp4v')
+
+
+@pytest.fixture(scope='module')
+def faststart_data(mp4_data):
+    # Đưa moov lên trước mdat (offset mẫu sai cũng không sao vì probe chỉ đọc moov)
+    boxes = top_level_boxes(mp4_data)
+    order = {b'ftyp': 0, b'moov': 1}
+    return b''.join(box for _, box in sorted(boxes, key=lambda item: order.get(item[0], 2)))
+
+
+def feed(data, chunk_size):
+    probe = Mp4Probe()
+    for start in range(0, len(data), chunk_size):
+        probe.feed(data[start:start + chunk_size])
+        if probe.done:
+            break
+    return probe
+
+
+def test_reads_metadata_from_moov_at_end(mp4_data):
+    assert [box_type for box_type, _ in top_level_boxes(mp4_data)][-1] == b'moov'
+
+    probe = feed(mp4_data, len(mp4_data))
+
+    assert probe.done
+    metadata = probe.metadata
+    assert metadata['container'] == 'mp4'
+    assert (metadata['width'], metadata['height']) == (160, 96)
+    assert metadata['fps'] == pytest.approx(25, rel=0.01)
+    assert metadata['duration'] == pytest.approx(2.0, rel=0.05)
+    assert metadata['codec'] == 'mp4v'
+    assert metadata['faststart'] is False
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+def test_result_does_not_depend_on_chunking(mp4_data, faststart_data, chunk_size):
+    whole = feed(mp4_data, len(mp4_data)).metadata
+
+    assert feed(mp4_data, chunk_size).metadata == whole
+    assert feed(faststart_data, chunk_size).metadata == dict(whole, faststart=True)
+
+
+def test_faststart_metadata_available_before_media_data(faststart_data):
+    probe = Mp4Probe()
+    mdat_offset = faststart_data.index(b'mdat') - 4
+    probe.feed(faststart_data[:mdat_offset])
+
+    assert probe.done and probe.metadata['faststart'] is True
+
+
+def test_non_mp4_input_gives_no_metadata(tmp_path):
+    avi_data = write_video(tmp_path / 'clip.avi', 'MJPG')
+
+    probe = feed(avi_data, 1)
+
+    assert probe.done and probe.metadata is None
+
+
+def test_moov_without_video_track():
+    assert parse_moov(b'') is None
+
+
+def test_ingest_file_hashes_and_commits(tmp_path, mp4_data):
+    seen = []
+    ingest = IngestFile(str(tmp_path), on_metadata=seen.append)
+    for start in range(0, len(mp4_data), 1000):
+        ingest.write(mp4_data[start:start + 1000])
+    ingest.seek(0)
+    assert ingest.read(8) == mp4_data[:8]
+
+    target = str(tmp_path / 'video.mp4')
+    ingest.commit(target)
+    ingest.close()
+
+    assert ingest.hexdigest() == hashlib.sha256(mp4_data).hexdigest()
+    assert len(seen) == 1 and seen[0]['width'] == 160
+    with open(target, 'rb') as f:
+        assert f.read() == mp4_data
+    assert os.listdir(tmp_path) == ['video.mp4']
+
+
+def test_rejected_upload_removes_part_file(tmp_path, faststart_data):
+    def reject(metadata):
+        raise UploadRejected('Video quá dài')
+
+    ingest = IngestFile(str(tmp_path), on_metadata=reject)
+    with pytest.raises(UploadRejected):
+        for start in range(0, len(faststart_data), 1000):
+            ingest.write(faststart_data[start:start + 1000])
+
+    assert ingest.closed
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,49 @@
+import io
+import os
+import zipfile
+
+from zip_stream import compress_type_for, stream_zip
+
+
+def test_round_trip_through_zipfile(tmp_path):
+    image = tmp_path / 'frame_0.jpg'
+    image.write_bytes(os.urandom(3 * 1024 * 1024 + 11))
+    transcript = 'Xin chào\n' * 1000
+
+    chunks = list(stream_zip([
+        ('images/001_frame_0.jpg', str(image)),
+        ('transcript.txt', transcript.encode('utf-8')),
+        ('missing.jpg', str(tmp_path / 'missing.jpg'))
+    ], chunk_size=64 * 1024))
+
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == ['images/001_frame_0.jpg', 'transcript.txt']
+        assert archive.read('images/001_frame_0.jpg') == image.read_bytes()
+        assert archive.read('transcript.txt').decode('utf-8') == transcript
+        assert archive.getinfo('images/001_frame_0.jpg').compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo('transcript.txt').compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_output_is_streamed_in_chunks(tmp_path):
+    image = tmp_path / 'video.mp4'
+    image.write_bytes(os.urandom(1024 * 1024))
+
+    chunks = list(stream_zip([('video.mp4', str(image))], chunk_size=64 * 1024))
+
+    # Dữ liệu được trả ra sau mỗi đoạn đọc, không đợi đến khi có cả file ZIP
+    assert len(chunks) >= 16
+    assert max(len(chunk) for chunk in chunks) < 128 * 1024
+
+
+def test_empty_archive_is_valid():
+    data = b''.join(stream_zip([]))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.namelist() == []
+
+
+def test_compress_type_by_extension():
+    assert compress_type_for('a/frame.JPG') == zipfile.ZIP_STORED
+    assert compress_type_for('frame.webp') == zipfile.ZIP_STORED
+    assert compress_type_for('manifest.json') == zipfile.ZIP_DEFLATED
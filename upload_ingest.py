@@ -0,0 +1,274 @@
+import os
+import uuid
+import struct
+import hashlib
+import logging
+
+
+MAX_MOOV_BYTES = 64 * 1024 * 1024  # moov lớn hơn thì bỏ qua việc đọc metadata
+
+# Các box cấp cao nhất thường gặp ở đầu file MP4/MOV, dùng để nhận biết định dạng
+MP4_TOP_LEVEL_BOXES = {b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pdin', b'uuid', b'meta',
+                       b'styp', b'sidx', b'moof', b'mfra'}
+
+# Box chứa box con trên đường từ moov đến bảng mẫu (stbl)
+MP4_CONTAINER_BOXES = {b'trak', b'mdia', b'minf', b'stbl'}
+
+
+class UploadRejected(Exception):
+    """Video upload bị từ chối dựa trên metadata (vd: quá dài, không có hình ảnh)"""
+
+
+def _iter_boxes(data, offset=0, end=None):
+    """Duyệt các box (loại, vị trí bắt đầu nội dung, vị trí kết thúc) trong data[offset:end]"""
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                return
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            return
+        yield box_type, offset + header, offset + size
+        offset += size
+
+
+def _parse_track(data, start, end):
+    """Thông tin của một track: loại (handler), kích thước, timescale, thời lượng, số mẫu, codec"""
+    track = {}
+    stack = [(start, end)]
+    while stack:
+        box_start, box_end = stack.pop()
+        for box_type, content, content_end in _iter_boxes(data, box_start, box_end):
+            if box_type in MP4_CONTAINER_BOXES:
+                stack.append((content, content_end))
+            elif box_type == b'tkhd':
+                # Chiều rộng/cao (16.16 fixed point) nằm ở cuối box
+                track['width'] = struct.unpack_from('>I', data, content_end - 8)[0] >> 16
+                track['height'] = struct.unpack_from('>I', data, content_end - 4)[0] >> 16
+            elif box_type == b'mdhd':
+                if data[content] == 1:
+                    track['timescale'], track['duration'] = struct.unpack_from('>IQ', data, content + 20)
+                else:
+                    track['timescale'], track['duration'] = struct.unpack_from('>II', data, content + 12)
+            elif box_type == b'hdlr':
+                track['handler'] = data[content + 8:content + 12].decode('latin-1')
+            elif box_type == b'stts':
+                entry_count = struct.unpack_from('>I', data, content + 4)[0]
+                entries = struct.unpack_from(f'>{2 * entry_count}I', data, content + 8)
+                track['sample_count'] = sum(entries[0::2])
+            elif box_type == b'stsd':
+                track['codec'] = data[content + 12:content + 16].decode('latin-1')
+    return track
+
+
+def parse_moov(data):
+    """
+    Metadata video từ nội dung box moov: thời lượng (giây), fps, kích thước và codec của track hình
+
+    Trả về None nếu không có track hình ảnh.
+    """
+    duration = None
+    video_track = None
+    for box_type, content, content_end in _iter_boxes(data):
+        if box_type == b'mvhd':
+            if data[content] == 1:
+                timescale, movie_duration = struct.unpack_from('>IQ', data, content + 20)
+            else:
+                timescale, movie_duration = struct.unpack_from('>II', data, content + 12)
+            if timescale:
+                duration = movie_duration / timescale
+        elif box_type == b'trak' and video_track is None:
+            track = _parse_track(data, content, content_end)
+            if track.get('handler') == 'vide':
+                video_track = track
+
+    if video_track is None:
+        return None
+
+    metadata = {
+        'container': 'mp4',
+        'duration': duration,
+        'width': video_track.get('width'),
+        'height': video_track.get('height'),
+        'codec': video_track.get('codec'),
+        'fps': None
+    }
+    if video_track.get('timescale') and video_track.get('duration') and video_track.get('sample_count'):
+        track_duration = video_track['duration'] / video_track['timescale']
+        metadata['fps'] = video_track['sample_count'] / track_duration
+        if metadata['duration'] is None:
+            metadata['duration'] = track_duration
+    return metadata
+
+
+class Mp4Probe:
+    """
+    Đọc metadata MP4/MOV từ dữ liệu nhận dần (feed), không cần có cả file
+
+    Chỉ giữ lại nội dung box moov; các box khác (vd: mdat chứa dữ liệu hình) chỉ được đếm
+    byte để bỏ qua. Metadata có ngay khi nhận xong moov: ở đầu file với video "faststart",
+    ở cuối file với các video khác. done=True khi đã có kết quả hoặc không thể đọc
+    (không phải MP4, moov quá lớn...), khi đó metadata là None.
+    """
+
+    def __init__(self, max_moov_bytes=MAX_MOOV_BYTES):
+        self.max_moov_bytes = max_moov_bytes
+        self.done = False
+        self.metadata = None
+        self.offset = 0  # Số byte đã nhận
+        self._header = b''
+        self._skip = 0
+        self._moov = None
+        self._moov_size = 0
+        self._seen_mdat = False
+
+    def feed(self, data):
+        view = memoryview(data)
+        while view and not self.done:
+            if self._skip:
+                taken = min(self._skip, len(view))
+                self._skip -= taken
+            elif self._moov is not None:
+                taken = min(self._moov_size - len(self._moov), len(view))
+                self._moov += view[:taken]
+                if len(self._moov) == self._moov_size:
+                    self._finish_moov()
+            else:
+                taken = min(16 - len(self._header), len(view))
+                self._header += bytes(view[:taken])
+                taken -= self._start_box()
+            view = view[taken:]
+            self.offset += taken
+
+    def _start_box(self):
+        """Xử lý header box đang đọc, trả về số byte đã nhận thừa (thuộc nội dung box)"""
+        if len(self._header) < 8:
+            return 0
+        size, box_type = struct.unpack_from('>I4s', self._header)
+        header_size = 8
+        if size == 1:
+            if len(self._header) < 16:
+                return 0
+            size = struct.unpack_from('>Q', self._header, 8)[0]
+            header_size = 16
+        extra = len(self._header) - header_size
+        self._header = b''
+
+        if box_type not in MP4_TOP_LEVEL_BOXES or (size != 0 and size < header_size):
+            # Không phải MP4/MOV (vd: MKV, AVI) hoặc dữ liệu hỏng
+            self.done = True
+            return extra
+        if size == 0:
+            # Box kéo dài đến hết file, không còn box nào sau nó
+            if box_type == b'moov':
+                logging.warning("Không đọc được metadata: box moov không có kích thước")
+            self.done = True
+            return extra
+
+        content_size = size - header_size
+        if box_type == b'moov':
+            if content_size > self.max_moov_bytes:
+                logging.warning(f"Không đọc được metadata: moov quá lớn ({content_size} byte)")
+                self.done = True
+                return extra
+            self._moov = bytearray()
+            self._moov_size = content_size
+            if content_size == 0:
+                self._finish_moov()
+        else:
+            self._seen_mdat = self._seen_mdat or box_type == b'mdat'
+            self._skip = content_size
+        return extra
+
+    def _finish_moov(self):
+        try:
+            self.metadata = parse_moov(bytes(self._moov))
+        except (struct.error, IndexError) as e:
+            logging.warning(f"Không đọc được metadata từ moov: {str(e)}")
+            self.metadata = None
+        if self.metadata is not None:
+            # moov nằm trước dữ liệu hình: metadata có ngay khi bắt đầu nhận video
+            self.metadata['faststart'] = not self._seen_mdat
+        self._moov = None
+        self.done = True
+
+
+class IngestFile:
+    """
+    File nhận dữ liệu upload: ghi thẳng vào thư mục đích, tính SHA-256 và đọc metadata trong cùng một lượt
+
+    Dữ liệu được ghi vào file tạm .part trong folder; commit() đổi tên thành file đích (không sao chép).
+    on_metadata (tùy chọn) được gọi ngay khi đọc được metadata (xem Mp4Probe), có thể ném
+    UploadRejected để dừng nhận phần còn lại của request. File chưa commit bị xóa khi close().
+    Có các phương thức đọc/ghi của file thông thường để dùng làm stream của FileStorage.
+    """
+
+    def __init__(self, folder, on_metadata=None):
+        self.part_path = os.path.join(folder, f".upload-{uuid.uuid4().hex}.part")
+        self.on_metadata = on_metadata
+        self.probe = Mp4Probe()
+        self.size = 0
+        self.committed_path = None
+        self._digest = hashlib.sha256()
+        self._file = open(self.part_path, 'w+b')
+
+    @property
+    def metadata(self):
+        return self.probe.metadata
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def write(self, data):
+        self._file.write(data)
+        self._digest.update(data)
+        self.size += len(data)
+        if not self.probe.done:
+            self.probe.feed(data)
+            if self.probe.done and self.metadata is not None and self.on_metadata is not None:
+                try:
+                    self.on_metadata(self.metadata)
+                except Exception:
+                    self.close()
+                    raise
+        return len(data)
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readline(self, size=-1):
+        return self._file.readline(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    def commit(self, file_path):
+        """Đóng file và đổi tên thành file_path"""
+        self._file.close()
+        os.replace(self.part_path, file_path)
+        self.committed_path = file_path
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if self.committed_path is None:
+            try:
+                os.remove(self.part_path)
+            except OSError:
+                pass
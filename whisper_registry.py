@@ -0,0 +1,105 @@
+import time
+import logging
+import threading
+import contextlib
+import collections
+
+
+# Các model Whisper có thể chọn cho mỗi request
+WHISPER_MODEL_NAMES = (
+    'tiny', 'tiny.en', 'base', 'base.en', 'small', 'small.en', 'medium', 'medium.en',
+    'large', 'large-v1', 'large-v2', 'large-v3', 'turbo'
+)
+DEFAULT_WHISPER_MODEL = 'base'
+DEFAULT_MAX_WHISPER_MODELS = 2  # Số model giữ trong bộ nhớ cùng lúc
+
+
+class WhisperModelRegistry:
+    """
+    Bộ nhớ đệm model Whisper dùng chung trong tiến trình
+
+    Model được tải lười ở lần dùng đầu tiên và giữ lại theo tên; khi vượt quá
+    max_models, model ít được dùng gần đây nhất bị loại bỏ (LRU), trừ model đang được dùng.
+    Mỗi tên model chỉ được tải một lần kể cả khi nhiều job cần nó cùng lúc.
+    Một model không phiên âm song song được (kv-cache của Whisper gắn hook vào chính model),
+    nên các job dùng model qua use(), mỗi lúc chỉ một job dùng một model.
+    """
+
+    def __init__(self, max_models=DEFAULT_MAX_WHISPER_MODELS, device=None):
+        self.max_models = max(1, max_models)
+        self.device = device
+        self.models = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._use_locks = {}
+        self._in_use = collections.Counter()
+
+    def _cached(self, name, reserve):
+        model = self.models.get(name)
+        if model is not None:
+            self.models.move_to_end(name)
+            if reserve:
+                self._in_use[name] += 1
+        return model
+
+    def get(self, name=DEFAULT_WHISPER_MODEL):
+        """Trả về model Whisper theo tên, ImportError nếu chưa cài whisper"""
+        return self._get(name, reserve=False)
+
+    @contextlib.contextmanager
+    def use(self, name=DEFAULT_WHISPER_MODEL):
+        """
+        Dùng model Whisper theo tên trong khối with, chờ nếu job khác đang dùng model đó
+
+        Model đang được dùng không bị loại khỏi bộ nhớ đệm. ImportError nếu chưa cài whisper.
+        """
+        model = self._get(name, reserve=True)
+        try:
+            with self._lock:
+                use_lock = self._use_locks.setdefault(name, threading.Lock())
+            with use_lock:
+                yield model
+        finally:
+            with self._lock:
+                self._in_use[name] -= 1
+                if self._in_use[name] <= 0:
+                    del self._in_use[name]
+                # Các model bị bỏ qua khi đang dùng có thể được loại bây giờ
+                self._evict()
+
+    def _get(self, name, reserve):
+        with self._lock:
+            model = self._cached(name, reserve)
+            if model is not None:
+                return model
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        with load_lock:
+            # Luồng khác có thể vừa tải xong model trong lúc chờ
+            with self._lock:
+                model = self._cached(name, reserve)
+                if model is not None:
+                    return model
+
+            import whisper
+
+            start_time = time.time()
+            model = whisper.load_model(name, device=self.device)
+            logging.info(f"Đã tải model Whisper '{name}' trong {time.time() - start_time:.1f}s")
+
+            with self._lock:
+                self.models[name] = model
+                if reserve:
+                    self._in_use[name] += 1
+                self._evict(keep=name)
+            return model
+
+    def _evict(self, keep=None):
+        """Loại các model cũ nhất khi vượt quá max_models, bỏ qua model đang dùng (gọi khi giữ _lock)"""
+        for name in list(self.models):
+            if len(self.models) <= self.max_models:
+                break
+            if name == keep or self._in_use[name]:
+                continue
+            del self.models[name]
+            logging.info(f"Giải phóng model Whisper '{name}'")
@@ -0,0 +1,75 @@
+import os
+import time
+import zipfile
+
+
+ZIP_CHUNK_SIZE = 1024 * 1024  # Kích thước mỗi lần đọc file nguồn (byte)
+
+# Định dạng đã nén sẵn, lưu nguyên (ZIP_STORED) vì nén lại không giảm dung lượng mà chỉ tốn CPU
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.avif', '.gif', '.mp4', '.webm', '.mp3', '.zip'}
+
+
+class _StreamBuffer:
+    """File chỉ ghi, không seek được: zipfile ghi vào đây, generator lấy dữ liệu ra sau mỗi đoạn"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def compress_type_for(name):
+    """ZIP_STORED cho ảnh/video đã nén, ZIP_DEFLATED cho các file còn lại (văn bản, JSON)"""
+    if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def stream_zip(entries, chunk_size=ZIP_CHUNK_SIZE):
+    """
+    Tạo file ZIP theo từng đoạn (yield bytes) mà không giữ cả file trong bộ nhớ hay ghi ra đĩa
+
+    entries: các cặp (tên trong ZIP, nguồn), nguồn là đường dẫn file trên đĩa hoặc bytes.
+    File nguồn không còn tồn tại khi đến lượt được bỏ qua.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for arcname, source in entries:
+            if isinstance(source, bytes):
+                info = zipfile.ZipInfo(arcname, time.localtime()[:6])
+                info.compress_type = compress_type_for(arcname)
+                archive.writestr(info, source)
+            else:
+                if not os.path.isfile(source):
+                    continue
+                info = zipfile.ZipInfo.from_file(source, arcname)
+                info.compress_type = compress_type_for(arcname)
+                with open(source, 'rb') as src, archive.open(info, 'w') as dst:
+                    while True:
+                        chunk = src.read(chunk_size)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        data = buffer.drain()
+                        if data:
+                            yield data
+            data = buffer.drain()
+            if data:
+                yield data
+    # Thư mục trung tâm được ghi khi đóng file ZIP
+    yield buffer.drain()